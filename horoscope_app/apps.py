@@ -4,3 +4,8 @@ from django.apps import AppConfig
 class HoroscopeAppConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'horoscope_app'
+
+    def ready(self):
+        # LLM_ROUTES の誤りはリクエストを受ける前に ImproperlyConfigured にする
+        from . import routing
+        routing.check_routes()
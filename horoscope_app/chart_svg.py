@@ -0,0 +1,199 @@
+# horoscope_app/chart_svg.py
+"""
+ホロスコープのチャート(ホイール)を SVG で描画する。
+
+- 入力は analyze_horoscope_data の解析結果（天体の配置・ハウスカスプ・アスペクト）
+- 外周の円・星座の区切り線・記号の <defs> 定義などチャートごとに変わらない部分は
+  モジュール読み込み時に一度だけ文字列として組み立てておき、描画時は連結するだけにする
+- 星座の輪はアセンダントに合わせて rotate で回転させるだけで、座標は再計算しない
+- 描画結果はチャートのキー(BirthInput.key)ごとに Django キャッシュへ保存する
+
+向きは一般的なホイールと同じく、アセンダントを左(9時の位置)に置いて反時計回り。
+出生時刻不明(ハウスなし)の場合は牡羊座0°を左に置く。
+"""
+import math
+
+from django.core.cache import cache
+
+from .utils import horoscope_for
+
+# 描画内容を変更したら上げる（キャッシュキーと ETag に含まれる）
+CHART_SVG_VERSION = 1
+CHART_SVG_CACHE_TIMEOUT = 60 * 60 * 24 * 30
+# URL にバージョン (v=CHART_SVG_VERSION) が無い場合のブラウザキャッシュの期限 (秒)
+CHART_SVG_MAX_AGE = 60 * 60 * 24
+
+SIZE = 500
+CENTER = SIZE / 2
+R_OUTER = 240        # 外周
+R_ZODIAC = 205       # 星座の輪の内側
+R_PLANET = 180       # 天体記号
+R_TICK = 198         # 天体の実際の位置を示す目盛り
+R_HOUSE_NUM = 128    # ハウス番号
+R_INNER = 115        # アスペクト線を引く円
+
+# 天体記号が重ならないように広げる最小間隔(度)
+MIN_GLYPH_SEPARATION = 7.0
+
+# 記号を絵文字ではなく文字として表示させるための異体字セレクタ
+_TEXT_PRESENTATION = "\ufe0e"
+SIGN_GLYPHS = ("♈", "♉", "♊", "♋", "♌", "♍", "♎", "♏", "♐", "♑", "♒", "♓")
+SIGN_COLORS = ("#d9534f", "#5cb85c", "#f0ad4e", "#5bc0de") * 3   # 火・地・風・水
+PLANET_GLYPHS = {
+    "太陽": "☉", "月": "☽", "水星": "☿", "金星": "♀", "火星": "♂",
+    "木星": "♃", "土星": "♄", "天王星": "♅", "海王星": "♆", "冥王星": "♇",
+    "ドラゴンヘッド": "☊", "ドラゴンテイル": "☋",
+}
+ASPECT_STYLES = {
+    "オポジション": ("#d9534f", ""),
+    "スクエア": ("#d9534f", ""),
+    "トライン": ("#2575fc", ""),
+    "セクスタイル": ("#2575fc", ' stroke-dasharray="4 3"'),
+}
+
+
+def _xy(radius: float, angle: float) -> tuple[float, float]:
+    """画面上の角度(度, 9時の位置から反時計回り)の点の座標を返す。"""
+    rad = math.radians(180.0 + angle)
+    return CENTER + radius * math.cos(rad), CENTER - radius * math.sin(rad)
+
+
+def _line(r1: float, r2: float, angle: float, attrs: str) -> str:
+    x1, y1 = _xy(r1, angle)
+    x2, y2 = _xy(r2, angle)
+    return f'<line x1="{x1:.1f}" y1="{y1:.1f}" x2="{x2:.1f}" y2="{y2:.1f}"{attrs}/>'
+
+
+def _build_defs() -> str:
+    symbols = []
+    for i, glyph in enumerate(SIGN_GLYPHS):
+        symbols.append(
+            f'<g id="s{i}"><text text-anchor="middle" dominant-baseline="central" font-size="16" '
+            f'fill="{SIGN_COLORS[i]}">{glyph}{_TEXT_PRESENTATION}</text></g>'
+        )
+    for j, glyph in enumerate(PLANET_GLYPHS.values()):
+        symbols.append(
+            f'<g id="p{j}"><text text-anchor="middle" dominant-baseline="central" font-size="17" '
+            f'fill="#333">{glyph}{_TEXT_PRESENTATION}</text></g>'
+        )
+    return "<defs>" + "".join(symbols) + "</defs>"
+
+
+def _build_zodiac_ring() -> str:
+    """牡羊座0°を左に置いた星座の輪（描画時に回転させる）。"""
+    parts = [
+        f'<circle cx="{CENTER}" cy="{CENTER}" r="{R_OUTER}" fill="#fff" stroke="#555"/>',
+        f'<circle cx="{CENTER}" cy="{CENTER}" r="{R_ZODIAC}" fill="none" stroke="#555"/>',
+        f'<circle cx="{CENTER}" cy="{CENTER}" r="{R_INNER}" fill="none" stroke="#aaa"/>',
+    ]
+    for i in range(12):
+        parts.append(_line(R_ZODIAC, R_OUTER, i * 30.0, ' stroke="#555"'))
+    for deg in range(0, 360, 5):
+        if deg % 30:
+            length = 6 if deg % 10 == 0 else 3
+            parts.append(_line(R_ZODIAC, R_ZODIAC + length, float(deg), ' stroke="#999"'))
+    return "".join(parts)
+
+
+_HEADER = (
+    f'<svg xmlns="http://www.w3.org/2000/svg" xmlns:xlink="http://www.w3.org/1999/xlink" '
+    f'viewBox="0 0 {SIZE} {SIZE}" width="{SIZE}" height="{SIZE}" '
+    f'font-family="\'Segoe UI Symbol\',\'Noto Sans Symbols\',\'DejaVu Sans\',sans-serif">'
+)
+_DEFS = _build_defs()
+_ZODIAC_RING = _build_zodiac_ring()
+# 星座記号は各星座の中央(15°, 45°, ...)に置く。回転前の角度を保持しておく
+_SIGN_MIDPOINTS = tuple(i * 30.0 + 15.0 for i in range(12))
+_PLANET_SYMBOL_IDS = {name: f"p{j}" for j, name in enumerate(PLANET_GLYPHS)}
+
+
+def _spread(longitudes: list[tuple[float, str]]) -> list[tuple[float, float, str]]:
+    """
+    近接する天体の表示角度をずらす。
+    :return: [(実際の経度, 表示用の経度, 天体名)]
+    """
+    items = sorted(longitudes)
+    shown = [lon for lon, _ in items]
+    for _ in range(3):
+        for k in range(1, len(shown)):
+            if shown[k] - shown[k - 1] < MIN_GLYPH_SEPARATION:
+                shown[k] = shown[k - 1] + MIN_GLYPH_SEPARATION
+    return [(lon, disp, name) for (lon, name), disp in zip(items, shown)]
+
+
+def render_chart_svg(analysis: dict) -> str:
+    """解析結果(analysis)からチャートの SVG 文字列を作る。"""
+    positions = analysis["1.天体の配置"]
+    cusps = analysis.get("8.ハウスカスプ", [])
+    asc = positions.get("アセンダント")
+    rotation = asc["degree"] if asc else 0.0
+
+    parts = [_HEADER, _DEFS]
+    # 画面上では経度 L を角度 L - ASC に置く。SVG の rotate は時計回りなので rotate(ASC) になる
+    parts.append(f'<g transform="rotate({rotation:.3f} {CENTER} {CENTER})">{_ZODIAC_RING}</g>')
+    for i, mid in enumerate(_SIGN_MIDPOINTS):
+        x, y = _xy((R_ZODIAC + R_OUTER) / 2, mid - rotation)
+        parts.append(f'<use href="#s{i}" xlink:href="#s{i}" x="{x:.1f}" y="{y:.1f}"/>')
+
+    # ハウスカスプと番号
+    for k, cusp in enumerate(cusps):
+        angle = cusp["cusp_degree"] - rotation
+        strong = cusp["house"] in (1, 4, 7, 10)
+        attrs = ' stroke="#333" stroke-width="2"' if strong else ' stroke="#bbb"'
+        parts.append(_line(R_INNER, R_ZODIAC, angle, attrs))
+        nxt = cusps[(k + 1) % len(cusps)]["cusp_degree"] - rotation
+        mid = angle + ((nxt - angle) % 360) / 2
+        x, y = _xy(R_HOUSE_NUM, mid)
+        parts.append(
+            f'<text x="{x:.1f}" y="{y:.1f}" text-anchor="middle" dominant-baseline="central" '
+            f'font-size="11" fill="#888">{cusp["house"]}</text>'
+        )
+
+    # アスペクト線
+    for aspect in analysis.get("4.アスペクトの結果", []):
+        style = ASPECT_STYLES.get(aspect["aspect"])
+        if style is None:
+            continue
+        color, dash = style
+        x1, y1 = _xy(R_INNER, positions[aspect["planet1"]]["degree"] - rotation)
+        x2, y2 = _xy(R_INNER, positions[aspect["planet2"]]["degree"] - rotation)
+        parts.append(
+            f'<line x1="{x1:.1f}" y1="{y1:.1f}" x2="{x2:.1f}" y2="{y2:.1f}" '
+            f'stroke="{color}" stroke-opacity="0.7"{dash}/>'
+        )
+
+    # 天体（実際の位置に目盛り、記号は重ならないようにずらして配置）
+    bodies = [((positions[name]["degree"] - rotation) % 360, name)
+              for name in _PLANET_SYMBOL_IDS if name in positions]
+    for lon, shown, name in _spread(bodies):
+        parts.append(_line(R_TICK, R_ZODIAC, lon, ' stroke="#333"'))
+        x, y = _xy(R_PLANET, shown)
+        symbol = _PLANET_SYMBOL_IDS[name]
+        title = f'{name} {positions[name]["formatted"]}'
+        parts.append(
+            f'<use href="#{symbol}" xlink:href="#{symbol}" x="{x:.1f}" y="{y:.1f}">'
+            f'<title>{title}</title></use>'
+        )
+
+    parts.append("</svg>")
+    return "".join(parts)
+
+
+def chart_cache_key(birth) -> str:
+    return f"chart_svg:v{CHART_SVG_VERSION}:{birth.key}:{int(birth.unknown)}"
+
+
+def chart_etag(birth) -> str:
+    """チャートの ETag。入力と描画バージョンが同じなら SVG も同じになる。"""
+    return f"{birth.key}-{int(birth.unknown)}-v{CHART_SVG_VERSION}"
+
+
+def chart_svg_for(birth) -> str:
+    """BirthInput のチャート SVG を返す（キャッシュがあれば再描画しない）。"""
+    key = chart_cache_key(birth)
+    svg = cache.get(key)
+    if svg is None:
+        analysis = horoscope_for(birth, birth.unknown)["analysis"]
+        svg = render_chart_svg(analysis)
+        cache.set(key, svg, CHART_SVG_CACHE_TIMEOUT)
+    return svg
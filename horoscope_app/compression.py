@@ -0,0 +1,154 @@
+# horoscope_app/compression.py
+"""
+JSON レスポンスの圧縮 (brotli / gzip) と、複数チャートを返すレスポンスのストリーミング。
+
+- Accept-Encoding を見て br (Brotli パッケージがある場合) → gzip の順に選ぶ
+- 対象は JSON (application/json, application/x-ndjson) のみ。静的ファイルは WhiteNoise が
+  事前に圧縮したものを返すため、Content-Encoding 付きのレスポンスはそのまま通す
+- 短いレスポンス (COMPRESSION_MIN_SIZE 未満) は圧縮しない
+- ストリーミングのレスポンスは塊ごとに圧縮して flush する (全体を溜めずに送り始める)
+
+動的なレスポンスを毎回圧縮するため、圧縮率より速度を優先したレベルを既定にしている。
+"""
+import json
+import zlib
+
+from django.conf import settings
+from django.core.serializers.json import DjangoJSONEncoder
+from django.http import StreamingHttpResponse
+from django.utils.cache import patch_vary_headers
+
+from . import metrics
+
+try:
+    import brotli
+except ImportError:  # Brotli パッケージがなければ gzip のみ
+    brotli = None
+
+COMPRESSIBLE_TYPES = ("application/json", "application/x-ndjson")
+
+
+def _setting(name: str, default):
+    return getattr(settings, name, default)
+
+
+def choose_encoding(accept_encoding: str) -> str:
+    """Accept-Encoding から使う圧縮方式 ("br" / "gzip" / "") を選ぶ。q=0 は拒否とみなす。"""
+    accepted = set()
+    for item in accept_encoding.lower().split(","):
+        name, _, params = item.partition(";")
+        name = name.strip()
+        q = params.strip()
+        if q.startswith("q="):
+            try:
+                if float(q[2:]) <= 0:
+                    continue
+            except ValueError:
+                continue
+        accepted.add(name)
+    if brotli is not None and ("br" in accepted or "*" in accepted):
+        return "br"
+    if "gzip" in accepted or "*" in accepted:
+        return "gzip"
+    return ""
+
+
+class _Compressor:
+    """brotli / gzip の圧縮器を同じ操作 (compress / flush / finish) で扱う。"""
+
+    def __init__(self, encoding: str):
+        if encoding == "br":
+            self._br = brotli.Compressor(mode=brotli.MODE_TEXT,
+                                         quality=_setting("COMPRESSION_BROTLI_QUALITY", 5))
+        else:
+            self._br = None
+            # wbits=31: gzip 形式 (ヘッダー・CRC 付き)
+            self._gz = zlib.compressobj(_setting("COMPRESSION_GZIP_LEVEL", 6), zlib.DEFLATED, 31)
+
+    def compress(self, data: bytes) -> bytes:
+        return self._br.process(data) if self._br else self._gz.compress(data)
+
+    def flush(self) -> bytes:
+        return self._br.flush() if self._br else self._gz.flush(zlib.Z_SYNC_FLUSH)
+
+    def finish(self) -> bytes:
+        return self._br.finish() if self._br else self._gz.flush(zlib.Z_FINISH)
+
+
+def compress_bytes(data: bytes, encoding: str) -> bytes:
+    """data を encoding ("br" / "gzip") で圧縮する。"""
+    compressor = _Compressor(encoding)
+    return compressor.compress(data) + compressor.finish()
+
+
+def _compress_stream(chunks, encoding: str):
+    compressor = _Compressor(encoding)
+    for chunk in chunks:
+        data = compressor.compress(chunk) + compressor.flush()
+        if data:
+            yield data
+    yield compressor.finish()
+
+
+class JsonCompressionMiddleware:
+    """
+    JSON レスポンスを Accept-Encoding に応じて圧縮するミドルウェア。
+    本文を書き換えるため、MIDDLEWARE の先頭近く (SecurityMiddleware の直後) に置く。
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        response = self.get_response(request)
+        content_type = response.get("Content-Type", "").split(";")[0].strip()
+        if content_type not in COMPRESSIBLE_TYPES or response.has_header("Content-Encoding"):
+            return response
+        if not response.streaming and len(response.content) < _setting("COMPRESSION_MIN_SIZE", 1024):
+            return response
+
+        patch_vary_headers(response, ("Accept-Encoding",))
+        encoding = choose_encoding(request.META.get("HTTP_ACCEPT_ENCODING", ""))
+        if not encoding:
+            return response
+
+        if response.streaming:
+            if response.is_async:
+                return response
+            response.streaming_content = _compress_stream(response.streaming_content, encoding)
+            del response.headers["Content-Length"]
+        else:
+            compressed = compress_bytes(response.content, encoding)
+            if len(compressed) >= len(response.content):
+                return response
+            metrics.incr("compression.bytes_in", len(response.content))
+            metrics.incr("compression.bytes_out", len(compressed))
+            response.content = compressed
+            response.headers["Content-Length"] = str(len(compressed))
+
+        metrics.incr(f"compression.{encoding}")
+        # 強い ETag は圧縮後の本文と一致しなくなるため弱い ETag にする
+        etag = response.get("ETag")
+        if etag and etag.startswith('"'):
+            response.headers["ETag"] = "W/" + etag
+        response.headers["Content-Encoding"] = encoding
+        return response
+
+
+def _encode(value) -> bytes:
+    return json.dumps(value, cls=DjangoJSONEncoder).encode()
+
+
+def stream_json(head: dict, key: str, items) -> StreamingHttpResponse:
+    """
+    {**head, key: [items...]} の JSON を、items を1件ずつ符号化しながら返す。
+    items はジェネレーターでよく、全件を計算し終える前に送り始める (JsonResponse と同じ形式の本文)。
+    """
+    def chunks():
+        prefix = _encode(head)[:-1]
+        yield prefix + (b", " if head else b"") + _encode(key) + b": ["
+        for i, item in enumerate(items):
+            yield (b", " if i else b"") + _encode(item)
+        yield b"]}"
+
+    return StreamingHttpResponse(chunks(), content_type="application/json")
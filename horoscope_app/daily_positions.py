@@ -0,0 +1,178 @@
+# horoscope_app/daily_positions.py
+"""
+「今日の運勢」(sb 9/19/29) 用のトランジット天体位置。
+
+今日の位置は出生データによらず全ユーザー共通のため、毎回 swisseph で計算せず
+DailyPosition テーブル(1日1行・毎時の位置)から引いて線形補間する。
+- 月は1時間に約0.5°しか動かないため、1時間間隔の線形補間で誤差は 0.001° 程度
+- テーブルは refresh_daily_positions コマンドで定期的に作り直す（全ワーカーで同じ値になる）
+- テーブルに該当日がない場合(未生成・範囲外・DB未移行)は swisseph で直接計算する
+"""
+import datetime
+import threading
+
+import swisseph as swe
+from django.db import DatabaseError
+
+from .utils import ayanamsa_offset, ensure_ephemeris, sign_position
+
+HOURS_PER_ROW = 25   # 0時〜翌日0時（翌日の行を読まずに補間できるよう両端を含む）
+
+# (英語名, 日本語名, swisseph の天体番号) — 並びは analyze_horoscope_data の「1.天体の配置」と同じ
+BODIES = (
+    ("Sun", "太陽", swe.SUN),
+    ("Moon", "月", swe.MOON),
+    ("Mercury", "水星", swe.MERCURY),
+    ("Venus", "金星", swe.VENUS),
+    ("Mars", "火星", swe.MARS),
+    ("Jupiter", "木星", swe.JUPITER),
+    ("Saturn", "土星", swe.SATURN),
+    ("Uranus", "天王星", swe.URANUS),
+    ("Neptune", "海王星", swe.NEPTUNE),
+    ("Pluto", "冥王星", swe.PLUTO),
+    ("True Node", "ドラゴンヘッド", swe.TRUE_NODE),
+)
+
+# 読み込んだ行のプロセス内キャッシュ {date: positions}（見つからなかった日は保持しない）
+_row_cache: dict[datetime.date, dict] = {}
+_row_cache_lock = threading.Lock()
+_ROW_CACHE_MAX = 32
+
+
+def compute_day(date: datetime.date) -> dict:
+    """date(UTC) の0時〜翌日0時の毎時の位置を swisseph で計算する。"""
+    ensure_ephemeris()
+    jd0 = swe.julday(date.year, date.month, date.day, 0.0, swe.GREG_CAL)
+    flg = swe.FLG_SWIEPH | swe.FLG_SPEED
+    positions = {}
+    for name, _, code in BODIES:
+        samples = []
+        for hour in range(HOURS_PER_ROW):
+            values = swe.calc_ut(jd0 + hour / 24.0, code, flg)[0]
+            samples.append([round(values[0] % 360, 6), round(values[3], 6)])
+        positions[name] = samples
+    return positions
+
+
+def _load_row(date: datetime.date) -> dict | None:
+    positions = _row_cache.get(date)
+    if positions is not None:
+        return positions
+    from .models import DailyPosition
+
+    try:
+        positions = (DailyPosition.objects.filter(date=date)
+                     .values_list("positions", flat=True).first())
+    except DatabaseError:
+        return None
+    if positions is not None:
+        with _row_cache_lock:
+            if len(_row_cache) >= _ROW_CACHE_MAX:
+                _row_cache.clear()
+            _row_cache[date] = positions
+    return positions
+
+
+def clear_cache() -> None:
+    with _row_cache_lock:
+        _row_cache.clear()
+
+
+def _split(instant: datetime.datetime) -> tuple[datetime.date, float]:
+    """時刻を (UTC の日付, その日の0時からの時間数) にする (naive の場合は UTC とみなす)。"""
+    if instant.tzinfo is not None:
+        instant = instant.astimezone(datetime.timezone.utc).replace(tzinfo=None)
+    date = instant.date()
+    return date, (instant - datetime.datetime.combine(date, datetime.time())).total_seconds() / 3600.0
+
+
+def _compute_at(date: datetime.date, hours: float) -> dict[str, tuple[float, float]]:
+    ensure_ephemeris()
+    jd = swe.julday(date.year, date.month, date.day, hours, swe.GREG_CAL)
+    flg = swe.FLG_SWIEPH | swe.FLG_SPEED
+    result = {}
+    for name, _, code in BODIES:
+        values = swe.calc_ut(jd, code, flg)[0]
+        result[name] = (values[0] % 360, values[3])
+    return result
+
+
+def _interpolate(row: dict, hours: float) -> dict[str, tuple[float, float]]:
+    index = min(int(hours), HOURS_PER_ROW - 2)
+    frac = hours - index
+    result = {}
+    for name, _, _ in BODIES:
+        (lon0, speed0), (lon1, speed1) = row[name][index], row[name][index + 1]
+        # 0°/360° をまたぐ場合も短い方向に補間する
+        delta = (lon1 - lon0 + 180.0) % 360.0 - 180.0
+        result[name] = ((lon0 + delta * frac) % 360.0, speed0 + (speed1 - speed0) * frac)
+    return result
+
+
+def positions_at(instant: datetime.datetime) -> dict[str, tuple[float, float]]:
+    """
+    任意の時刻の {英語名: (経度, 速度)} を返す。
+
+    :param instant: タイムゾーン付きの日時（naive の場合は UTC とみなす）
+    """
+    date, hours = _split(instant)
+    row = _load_row(date)
+    if row is None:
+        return _compute_at(date, hours)
+    return _interpolate(row, hours)
+
+
+def positions_series(instants: list[datetime.datetime]):
+    """
+    複数の時刻の位置を positions_at と同じ形で順に返す。
+    テーブルの行は期間分を1回のクエリで読む (1日ごとに読むと時系列の計算時間の大半がクエリになる)。
+    """
+    split = [_split(instant) for instant in instants]
+    rows = {}
+    if split:
+        from .models import DailyPosition
+
+        dates = [date for date, _ in split]
+        try:
+            rows = dict(DailyPosition.objects.filter(date__range=(min(dates), max(dates)))
+                        .values_list("date", "positions"))
+        except DatabaseError:
+            rows = {}
+    for date, hours in split:
+        row = rows.get(date)
+        yield _compute_at(date, hours) if row is None else _interpolate(row, hours)
+
+
+def transit_positions(instant: datetime.datetime, ayanamsa: str = "") -> dict:
+    """
+    指定時刻のトランジット天体を「1.天体の配置」と同じ形式
+    ({"太陽": {"degree", "sign", "deg_in_sign", "formatted"}, ...}) で返す。ASC/MC は含まない。
+
+    :param ayanamsa: 指定するとサイデリアルの黄経にする（テーブルはトロピカルで保持し、アヤナムシャを引く）
+    """
+    positions = positions_at(instant)
+    offset = 0.0
+    if ayanamsa:
+        utc = instant.astimezone(datetime.timezone.utc) if instant.tzinfo else instant
+        jd = swe.julday(utc.year, utc.month, utc.day,
+                        utc.hour + utc.minute / 60.0 + utc.second / 3600.0, swe.GREG_CAL)
+        offset = ayanamsa_offset(jd, ayanamsa)
+    result = {}
+    for name, name_ja, _ in BODIES:
+        degree, speed = positions[name]
+        result[name_ja] = _placement((degree - offset) % 360.0, speed)
+    node_degree, node_speed = positions["True Node"]
+    result["ドラゴンテイル"] = _placement((node_degree - offset + 180.0) % 360.0, node_speed)
+    return result
+
+
+def _placement(degree: float, speed: float) -> dict:
+    sign_name, deg_in_sign, formatted = sign_position(degree)
+    if speed < 0:
+        formatted += " R"
+    return {
+        "degree": degree,
+        "sign": sign_name,
+        "deg_in_sign": deg_in_sign,
+        "formatted": formatted,
+    }
@@ -0,0 +1,103 @@
+# horoscope_app/fallback.py
+"""
+OpenAI が使えないとき (障害・タイムアウト・サーキットブレーカーが開いている間) に返す簡易版の鑑定文。
+
+チャートの解析結果 (compute_horoscope の analysis) から、太陽・月・アセンダントの星座と
+四区分の偏りを定型文に当てはめて作る。相性は scoring.score_pair のスコアを使う。
+"""
+from .utils import ZODIAC_ELEMENTS
+
+NOTICE = "※ただいまAIによる鑑定が混み合っているため、チャートから自動で作成した簡易版の鑑定をお届けします。"
+
+SIGN_KEYWORDS = {
+    "牡羊座": "まっすぐで行動が早い",
+    "牡牛座": "落ち着いていて粘り強い",
+    "双子座": "好奇心が旺盛で柔軟な",
+    "蟹座": "情に厚く身近な人を大切にする",
+    "獅子座": "明るく堂々とした",
+    "乙女座": "細やかで誠実な",
+    "天秤座": "バランス感覚に優れた",
+    "蠍座": "深く物事を見つめる",
+    "射手座": "おおらかで自由を好む",
+    "山羊座": "責任感が強く着実な",
+    "水瓶座": "独創的でこだわりのない",
+    "魚座": "感受性が豊かでやさしい",
+}
+
+ELEMENT_TRAITS = {
+    "火": "情熱と行動力",
+    "地": "現実的な安定感",
+    "風": "知性とコミュニケーション力",
+    "水": "共感力と感受性",
+}
+
+# 占いモード(sb)の1の位 → テーマ
+TOPICS = {
+    1: "性格", 2: "恋愛運", 3: "仕事運", 4: "金運", 5: "健康運", 6: "学業運",
+    9: "今日の運勢", 0: "今年の運勢",
+}
+
+TOPIC_ADVICE = {
+    "性格": "自分の持ち味を知ることで、迷ったときの判断がしやすくなるでしょう。",
+    "恋愛運": "気持ちを素直に言葉にすることが、関係を深めるきっかけになります。",
+    "仕事運": "得意なやり方を大切にしながら、一歩ずつ積み重ねることで評価につながります。",
+    "金運": "計画的にお金を使うことで、安心感と余裕が生まれます。",
+    "健康運": "無理をせず、生活のリズムを整えることを心がけてください。",
+    "学業運": "興味を持てることから取り組むと、理解が深まりやすいでしょう。",
+    "今日の運勢": "今日は自分のペースを守ることが、良い流れを呼び込みます。",
+    "今年の運勢": "今年は自分らしさを軸に、新しいことにも挑戦してみてください。",
+}
+
+
+def _sign_of(analysis: dict, body: str) -> str:
+    return analysis.get("1.天体の配置", {}).get(body, {}).get("sign", "")
+
+
+def _dominant_element(analysis: dict) -> str:
+    divisions = analysis.get("5.天体の四区分", {})
+    if not divisions:
+        return ""
+    return max(divisions, key=lambda element: len(divisions[element]))
+
+
+def topic_for(sb: int) -> str:
+    """占いモード(sb)のテーマ名を返す。"""
+    return TOPICS.get(sb % 10, "性格")
+
+
+def template_reading(analysis: dict, sb: int) -> str:
+    """1人分のチャートから定型文の鑑定文を作る。"""
+    topic = topic_for(sb)
+    sun, moon, asc = (_sign_of(analysis, body) for body in ("太陽", "月", "アセンダント"))
+    lines = [f"【{topic}（簡易版）】"]
+    if sun:
+        lines.append(f"太陽が{sun}にあるあなたは、{SIGN_KEYWORDS[sun]}人です。")
+    if moon:
+        lines.append(f"月は{moon}にあり、心の奥では{SIGN_KEYWORDS[moon]}一面を持っています。")
+    if asc:
+        lines.append(f"アセンダントが{asc}のため、周りからは{SIGN_KEYWORDS[asc]}印象を持たれやすいでしょう。")
+    element = _dominant_element(analysis)
+    if element:
+        lines.append(f"天体は{element}の星座に多く集まっており、{ELEMENT_TRAITS[element]}が強みです。")
+    lines.append(TOPIC_ADVICE[topic])
+    lines.append(NOTICE)
+    return "\n".join(lines)
+
+
+def template_compatibility(analysis1: dict, analysis2: dict, score: float, sb: int) -> str:
+    """二人のチャートと相性スコアから定型文の鑑定文を作る。"""
+    topic = "二人の今後" if sb % 10 == 8 else "二人の相性"
+    lines = [f"【{topic}（簡易版）】", f"チャートから計算した相性スコアは {score:.0f} 点です。"]
+    sun1, sun2 = _sign_of(analysis1, "太陽"), _sign_of(analysis2, "太陽")
+    if sun1 and sun2:
+        lines.append(f"あなたの太陽は{sun1}、お相手の太陽は{sun2}にあります。")
+        if ZODIAC_ELEMENTS[sun1] == ZODIAC_ELEMENTS[sun2]:
+            lines.append("同じ元素の星座どうしで、価値観や物事のペースが自然と合いやすい組み合わせです。")
+        else:
+            lines.append(f"{ELEMENT_TRAITS[ZODIAC_ELEMENTS[sun1]]}と{ELEMENT_TRAITS[ZODIAC_ELEMENTS[sun2]]}という"
+                         "異なる持ち味を補い合える組み合わせです。")
+    moon1, moon2 = _sign_of(analysis1, "月"), _sign_of(analysis2, "月")
+    if moon1 and moon2:
+        lines.append(f"月は{moon1}と{moon2}。気持ちが通じにくいときは、相手の感じ方を言葉で確かめ合うと安心です。")
+    lines.append(NOTICE)
+    return "\n".join(lines)
@@ -0,0 +1,209 @@
+# horoscope_app/geocoding.py
+"""
+オフライン地名辞書(ガゼティア)による出生地 → 緯度経度/タイムゾーンの解決。
+
+- data/gazetteer.tsv (都道府県・国内主要都市・世界の主要都市。市区町村の一覧ではない) を同梱し、ネットワーク不要
+- 初回利用時に読み込む（遅延ロード）
+- 地名の前方一致(オートコンプリート)は正規化した地名のソート済み配列 + bisect。
+  日本語名はよみ (ひらがな) でも引ける (IME で変換する前の入力)
+- 緯度経度 → 最寄りの都市 は単位球面上の3次元座標による KD 木で探索
+  （経度の折り返しや高緯度の歪みを気にせず、弦の長さ = 大円距離の単調関数で比較できる）
+"""
+import math
+import os
+import threading
+import unicodedata
+from bisect import bisect_left
+from dataclasses import dataclass
+from functools import lru_cache
+
+GAZETTEER_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "data", "gazetteer.tsv")
+EARTH_RADIUS_KM = 6371.0
+
+# 日本語名の末尾から取り除いて別名として登録する接尾辞とそのよみ (例: 東京都 → 東京, とうきょうと → とうきょう)
+_JA_SUFFIXES = {"都": "と", "府": "ふ", "県": "けん", "市": "し"}
+# カタカナ (ァ〜ヶ) → ひらがな
+_KATAKANA_TO_HIRAGANA = {code: code - 0x60 for code in range(ord("ァ"), ord("ヶ") + 1)}
+
+
+@dataclass(frozen=True, slots=True)
+class Place:
+    """地名1件。"""
+    name: str
+    name_ja: str
+    reading: str    # name_ja のよみ (ひらがな)
+    kind: str       # "prefecture" / "city"
+    country: str    # ISO 3166-1 alpha-2
+    lat: float
+    lon: float
+    tz: str         # IANA タイムゾーン名
+
+    def as_dict(self) -> dict:
+        return {
+            "name": self.name,
+            "name_ja": self.name_ja,
+            "reading": self.reading,
+            "kind": self.kind,
+            "country": self.country,
+            "lat": self.lat,
+            "lon": self.lon,
+            "tz": self.tz,
+        }
+
+
+def normalize(text: str) -> str:
+    """検索用に地名を正規化する（全角半角・大小文字・カタカナ/ひらがな・空白/記号の違いを吸収）。"""
+    text = unicodedata.normalize("NFKC", text).casefold().translate(_KATAKANA_TO_HIRAGANA)
+    return "".join(ch for ch in text if ch.isalnum())
+
+
+def _aliases(place: Place):
+    yield place.name
+    yield place.name_ja
+    yield place.reading
+    for suffix, reading in _JA_SUFFIXES.items():
+        if place.name_ja.endswith(suffix) and len(place.name_ja) > 2:
+            yield place.name_ja[:-len(suffix)]
+            if place.reading.endswith(reading):
+                yield place.reading[:-len(reading)]
+            break
+
+
+def _unit_vector(lat: float, lon: float) -> tuple[float, float, float]:
+    p, l = math.radians(lat), math.radians(lon)
+    return (math.cos(p) * math.cos(l), math.cos(p) * math.sin(l), math.sin(p))
+
+
+def _chord_to_km(chord: float) -> float:
+    return 2 * EARTH_RADIUS_KM * math.asin(min(1.0, chord / 2))
+
+
+def _build_kdtree(points: list[tuple], ids: list[int], depth: int = 0):
+    """(axis, 分割点, 地名index, 左部分木, 右部分木) の入れ子タプルで KD 木を作る。"""
+    if not ids:
+        return None
+    axis = depth % 3
+    ids = sorted(ids, key=lambda i: points[i][axis])
+    mid = len(ids) // 2
+    i = ids[mid]
+    return (axis, points[i][axis], i,
+            _build_kdtree(points, ids[:mid], depth + 1),
+            _build_kdtree(points, ids[mid + 1:], depth + 1))
+
+
+class Gazetteer:
+    """
+    地名辞書と、その前方一致索引・最寄り都市探索用の KD 木。
+
+    収録しているのは都道府県と国内外の主要都市 (約240件) だけで、市区町村すべては含まない。
+    含まれない地名は緯度経度を送るか、最寄りの主要都市で代用する。
+    """
+
+    def __init__(self, places: list[Place]):
+        self.places = places
+
+        pairs = sorted(
+            {(normalize(alias), i) for i, place in enumerate(places) for alias in _aliases(place)}
+        )
+        self._keys = [key for key, _ in pairs]
+        self._ids = [i for _, i in pairs]
+
+        self._points = [_unit_vector(place.lat, place.lon) for place in places]
+        self._tree = _build_kdtree(self._points, list(range(len(places))))
+
+    def lookup(self, name: str) -> Place | None:
+        """地名の完全一致(正規化後)で検索する。都道府県を都市より優先する。"""
+        key = normalize(name)
+        if not key:
+            return None
+        pos = bisect_left(self._keys, key)
+        best = None
+        while pos < len(self._keys) and self._keys[pos] == key:
+            place = self.places[self._ids[pos]]
+            if best is None or (place.kind == "prefecture" and best.kind != "prefecture"):
+                best = place
+            pos += 1
+        return best
+
+    def autocomplete(self, prefix: str, limit: int = 10) -> list[Place]:
+        """前方一致する地名を最大 limit 件返す。"""
+        key = normalize(prefix)
+        if not key:
+            return []
+        results = []
+        seen = set()
+        pos = bisect_left(self._keys, key)
+        while pos < len(self._keys) and self._keys[pos].startswith(key):
+            i = self._ids[pos]
+            if i not in seen:
+                seen.add(i)
+                results.append(self.places[i])
+                if len(results) >= limit:
+                    break
+            pos += 1
+        return results
+
+    def nearest(self, lat: float, lon: float, max_km: float | None = None) -> tuple[Place, float] | None:
+        """最寄りの地名と距離(km)を返す。max_km より遠ければ None。"""
+        q = _unit_vector(lat, lon)
+        points = self._points
+        best, best_d2 = -1, math.inf
+        stack = [self._tree]
+        while stack:
+            node = stack.pop()
+            if node is None:
+                continue
+            axis, split, i, left, right = node
+            p = points[i]
+            d2 = (p[0] - q[0]) ** 2 + (p[1] - q[1]) ** 2 + (p[2] - q[2]) ** 2
+            if d2 < best_d2:
+                best, best_d2 = i, d2
+            diff = q[axis] - split
+            near, far = (left, right) if diff < 0 else (right, left)
+            # 分割面までの距離が現在の最良より近い場合のみ反対側も調べる（後から pop）
+            if diff * diff < best_d2:
+                stack.append(far)
+            stack.append(near)
+        if best < 0:
+            return None
+        km = _chord_to_km(math.sqrt(best_d2))
+        if max_km is not None and km > max_km:
+            return None
+        return self.places[best], km
+
+
+def load_places(path: str = GAZETTEER_PATH) -> list[Place]:
+    places = []
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            if not line.strip() or line.startswith("#"):
+                continue
+            name, name_ja, reading, kind, country, lat, lon, tz = line.rstrip("\n").split("\t")
+            places.append(Place(name, name_ja, reading, kind, country, float(lat), float(lon), tz))
+    return places
+
+
+_gazetteer = None
+_load_lock = threading.Lock()
+
+
+def get_gazetteer() -> Gazetteer:
+    """地名辞書を返す（初回呼び出し時に読み込む）。"""
+    global _gazetteer
+    if _gazetteer is None:
+        with _load_lock:
+            if _gazetteer is None:
+                _gazetteer = Gazetteer(load_places())
+    return _gazetteer
+
+
+@lru_cache(maxsize=4096)
+def nearest_place(lat: float, lon: float, max_km: float | None = None) -> tuple[Place, float] | None:
+    """get_gazetteer().nearest のキャッシュ付き版（フォームの都道府県座標など同じ座標が多いため）。"""
+    return get_gazetteer().nearest(lat, lon, max_km)
+
+
+@lru_cache(maxsize=4096)
+def autocomplete_dicts(prefix: str, limit: int = 10) -> tuple[dict, ...]:
+    """オートコンプリート結果を JSON 化できる形でキャッシュして返す。"""
+    return tuple(place.as_dict() for place in get_gazetteer().autocomplete(prefix, limit))
@@ -0,0 +1,379 @@
+# horoscope_app/llm.py
+"""
+OpenAI クライアントの生成と、ChatCompletion の呼び出し (障害時の縮退を含む)。
+
+- クライアントはプロセスで1つを使い回す (HTTP 接続をリクエストごとに張り直さない)。
+  OpenAI クライアントはスレッドから同時に使ってよい
+- settings.OPENAI_BASE_URL を指定すると接続先を差し替えられる。
+  負荷試験では fake_openai コマンドで起動したローカルのサーバーを指す
+  (例: OPENAI_BASE_URL=http://127.0.0.1:8001/v1 OPENAI_API_KEY=fake)
+
+complete() は次のようにして OpenAI の遅延・障害がビューに波及しないようにする:
+
+- タイムアウトは直近の応答時間の p99 × LLM_TIMEOUT_FACTOR (LLM_TIMEOUT_MIN〜LLM_TIMEOUT_MAX)。
+  計測数が少ない間は LLM_TIMEOUT_MAX
+- ヘッジ: 直近の p95 を過ぎても応答がなければ同じリクエストをもう1本送り、先に返った方を使う。
+  1本目が再試行できるエラー (接続エラー・429・5xx) で終わった場合もすぐに2本目を送る
+- サーキットブレーカー: 連続 LLM_BREAKER_FAILURES 回失敗すると LLM_BREAKER_COOLDOWN 秒は
+  呼び出さずに即座に縮退する。その後は1件だけ試し、成功すれば元に戻す
+- 縮退時は同じプロンプトに対する過去の回答 (キャッシュ) があればそれを、なければ
+  呼び出し側が渡した定型文 (fallback.py) を返す
+
+送る前にプロンプトの大きさを見積もり (usage.fit_prompt)、呼び出しごとのトークン数を usage に記録する。
+
+状態 (応答時間・ブレーカー) はワーカープロセスごとに持つ。
+"""
+import hashlib
+import threading
+import time
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from dataclasses import dataclass
+
+import httpx
+import openai
+from django import db
+from django.conf import settings
+from django.core.cache import cache
+from openai import OpenAI
+
+from . import metrics, usage
+
+_client: OpenAI | None = None
+_client_config: tuple | None = None
+_client_lock = threading.Lock()
+
+
+def _setting(name: str, default):
+    return getattr(settings, name, default)
+
+
+def is_configured() -> bool:
+    """API キーが設定されているかどうか。"""
+    return bool(_setting("OPENAI_API_KEY", ""))
+
+
+def chat_model() -> str:
+    """ChatCompletion に使うモデル名。"""
+    return _setting("OPENAI_MODEL", "gpt-5-mini")
+
+
+def get_openai_client() -> OpenAI:
+    """
+    共有の OpenAI クライアントを返す。
+    設定 (API キー・接続先) が変わった場合は作り直す (テストや管理コマンドからの切り替え用)。
+    """
+    global _client, _client_config
+    config = (_setting("OPENAI_API_KEY", ""), _setting("OPENAI_BASE_URL", None),
+              _setting("OPENAI_MAX_CONNECTIONS", 100))
+    with _client_lock:
+        if _client is None or _client_config != config:
+            api_key, base_url, max_connections = config
+            _client = OpenAI(
+                api_key=api_key,
+                base_url=base_url or None,
+                # 再試行は complete() のヘッジで行う (SDK の再試行はタイムアウトの計算に含められない)
+                max_retries=0,
+                # 同時に待つリクエストの数だけ接続を保持できるようにする
+                http_client=httpx.Client(limits=httpx.Limits(max_connections=max_connections,
+                                                             max_keepalive_connections=max_connections)),
+            )
+            _client_config = config
+        return _client
+
+
+# ---------------------------
+# 応答時間の計測とタイムアウト
+# ---------------------------
+
+class LatencyTracker:
+    """直近の成功した呼び出しの応答時間 (秒)。"""
+
+    def __init__(self, window: int = 200):
+        self._lock = threading.Lock()
+        self._samples: deque[float] = deque(maxlen=window)
+
+    def record(self, seconds: float) -> None:
+        with self._lock:
+            self._samples.append(seconds)
+
+    def percentile(self, p: float) -> float | None:
+        """直近の応答時間の p 分位点 (計測数が LLM_MIN_SAMPLES 未満なら None)。"""
+        with self._lock:
+            if len(self._samples) < _setting("LLM_MIN_SAMPLES", 20):
+                return None
+            values = sorted(self._samples)
+        return values[min(len(values) - 1, int(len(values) * p))]
+
+    def timeout(self) -> float:
+        """次の呼び出しのタイムアウト(秒)。"""
+        maximum = _setting("LLM_TIMEOUT_MAX", 180.0)
+        p99 = self.percentile(0.99)
+        if p99 is None:
+            return maximum
+        return min(maximum, max(_setting("LLM_TIMEOUT_MIN", 20.0), p99 * _setting("LLM_TIMEOUT_FACTOR", 2.0)))
+
+    def hedge_delay(self) -> float | None:
+        """2本目を送るまでの秒数 (ヘッジしない場合は None)。"""
+        if not _setting("LLM_HEDGE_ENABLED", True):
+            return None
+        p95 = self.percentile(_setting("LLM_HEDGE_PERCENTILE", 0.95))
+        if p95 is None:
+            return None
+        return max(_setting("LLM_HEDGE_MIN_DELAY", 1.0), p95)
+
+    def reset(self) -> None:
+        with self._lock:
+            self._samples.clear()
+
+
+class CircuitBreaker:
+    """連続した失敗で開き、一定時間後に1件だけ試して閉じるサーキットブレーカー。"""
+
+    CLOSED, OPEN, HALF_OPEN = "closed", "open", "half_open"
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.state = self.CLOSED
+        self.failures = 0
+        self.opened_at = 0.0
+
+    def allow(self) -> bool:
+        """呼び出してよいかどうか。半開状態では最初の1件だけ許可する。"""
+        with self._lock:
+            if self.state == self.CLOSED:
+                return True
+            if (self.state == self.OPEN
+                    and time.monotonic() - self.opened_at >= _setting("LLM_BREAKER_COOLDOWN", 30.0)):
+                self.state = self.HALF_OPEN
+                metrics.incr("llm.breaker_half_open")
+                return True
+            return False
+
+    def record_success(self) -> None:
+        with self._lock:
+            if self.state != self.CLOSED:
+                metrics.incr("llm.breaker_closed")
+            self.state = self.CLOSED
+            self.failures = 0
+
+    def record_failure(self) -> None:
+        with self._lock:
+            self.failures += 1
+            if self.state == self.HALF_OPEN or (
+                    self.state == self.CLOSED and self.failures >= _setting("LLM_BREAKER_FAILURES", 5)):
+                self.state = self.OPEN
+                self.opened_at = time.monotonic()
+                metrics.incr("llm.breaker_opened")
+
+    def reset(self) -> None:
+        with self._lock:
+            self.state = self.CLOSED
+            self.failures = 0
+
+
+latency = LatencyTracker()
+breaker = CircuitBreaker()
+_executor = ThreadPoolExecutor(max_workers=64, thread_name_prefix="llm")
+# complete_parts で部分ごとの complete() を並列に実行する (complete() は _executor の完了を待つため別にする)
+_parts_executor = ThreadPoolExecutor(max_workers=32, thread_name_prefix="llm-parts")
+
+
+def status() -> dict:
+    """メトリクス表示用の現在の状態。"""
+    p50, p95 = latency.percentile(0.5), latency.percentile(0.95)
+    return {
+        "breaker": breaker.state,
+        "consecutive_failures": breaker.failures,
+        "latency_p50": round(p50, 3) if p50 is not None else None,
+        "latency_p95": round(p95, 3) if p95 is not None else None,
+        "timeout": round(latency.timeout(), 1),
+    }
+
+
+# ---------------------------
+# 呼び出し
+# ---------------------------
+
+@dataclass
+class Reply:
+    """complete() の結果。source は "llm" / "cache" (過去の回答) / "template" (定型文)。"""
+    text: str
+    source: str = "llm"
+
+    @property
+    def degraded(self) -> bool:
+        return self.source != "llm"
+
+
+def _retryable(error: Exception) -> bool:
+    """もう1本送れば成功しうるエラーかどうか (ブレーカーの失敗にも数える)。"""
+    if isinstance(error, (openai.APIConnectionError, TimeoutError)):
+        return True
+    return isinstance(error, openai.APIStatusError) and (error.status_code == 429 or error.status_code >= 500)
+
+
+def _create(kwargs: dict, timeout: float):
+    started = time.monotonic()
+    response = get_openai_client().chat.completions.create(**kwargs, timeout=timeout)
+    return response, time.monotonic() - started
+
+
+def _discard(futures: list, on_discarded) -> None:
+    """使わなかった呼び出しが後から成功した場合に on_discarded(レスポンス, 応答時間) を呼ぶ (トークンは消費している)。"""
+    def done(future):
+        if on_discarded is not None and not future.cancelled() and future.exception() is None:
+            on_discarded(*future.result())
+
+    for future in futures:
+        future.add_done_callback(done)
+
+
+def _hedged_create(kwargs: dict, on_discarded=None):
+    """
+    タイムアウトとヘッジ付きで ChatCompletion を呼び出し、(レスポンス, 応答時間) を返す。
+
+    :param on_discarded: 使わなかった呼び出し (ヘッジで負けた方・タイムアウト後に返った方) の
+        レスポンスを受け取る関数 (使用量の記録用)
+    """
+    deadline = time.monotonic() + latency.timeout()
+    hedge_delay = latency.hedge_delay()
+    first = _executor.submit(_create, kwargs, deadline - time.monotonic())
+    futures = [first]
+    pending = {first}
+    attempts = 1
+    hedged = False
+    error: Exception | None = None
+    while pending:
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            break
+        hedge_at = hedge_delay if attempts == 1 and hedge_delay is not None else None
+        done, pending = wait(pending, timeout=min(remaining, hedge_at) if hedge_at else remaining,
+                             return_when=FIRST_COMPLETED)
+        for future in done:
+            try:
+                result = future.result()
+            except Exception as e:
+                if not _retryable(e):
+                    _discard([f for f in futures if f is not future], on_discarded)
+                    raise
+                error = e
+                continue
+            if hedged:
+                metrics.incr("llm.hedge_won" if future is not first else "llm.hedge_lost")
+            _discard([f for f in futures if f is not future], on_discarded)
+            return result
+        if attempts == 1 and (error is not None or hedge_at is not None) and time.monotonic() < deadline:
+            # 1本目が再試行できるエラーで終わった、またはヘッジの待ち時間を過ぎた
+            hedged = error is None
+            metrics.incr("llm.hedged" if hedged else "llm.retried")
+            futures.append(_executor.submit(_create, kwargs, deadline - time.monotonic()))
+            pending.add(futures[-1])
+            attempts += 1
+    _discard(futures, on_discarded)
+    raise error or TimeoutError("OpenAI API の応答がタイムアウトしました。")
+
+
+def _cache_key(kwargs: dict) -> str:
+    raw = repr(sorted(kwargs.items())).encode("utf-8")
+    return f"llm:answer:{hashlib.sha256(raw).hexdigest()}"
+
+
+def complete(user_message: str, fallback, *, endpoint: str = "", sb: int | None = None, **options) -> Reply:
+    """
+    user_message を OpenAI に送り、回答を返す。失敗した場合は縮退した回答を返す。
+
+    :param fallback: 縮退時に呼ぶ、定型文を返す関数 (引数なし)
+    :param endpoint: 使用量の記録に使う呼び出し元の名前 ("analyze" など)
+    :param sb: 使用量の記録に使う占いモード
+    :param options: chat.completions.create に渡す追加の引数 (model など)
+    :raises usage.PromptTooLarge: プロンプトが LLM_PROMPT_TOKEN_LIMIT に収まらない場合
+    """
+    try:
+        return _complete(user_message, fallback, endpoint=endpoint, sb=sb, **options)
+    finally:
+        usage.maybe_flush()
+
+
+def _complete(user_message: str, fallback, *, endpoint: str, sb: int | None, **options) -> Reply:
+    """complete の本体。使用量は記録するだけで書き込まない (書き込みは呼び出し元のスレッドで行う)。"""
+    model = options.pop("model", None) or chat_model()
+    try:
+        user_message, estimated, trimmed = usage.fit_prompt(user_message)
+    except usage.PromptTooLarge as e:
+        usage.record(endpoint, sb, model, "rejected", estimated_prompt_tokens=e.estimated)
+        raise
+    kwargs = {"model": model, "messages": [{"role": "user", "content": user_message}], **options}
+    key = _cache_key(kwargs)
+    fields = {"endpoint": endpoint, "sb": sb, "model": model, "estimated_prompt_tokens": estimated,
+              "trimmed": trimmed}
+
+    def on_discarded(response, seconds):
+        usage.record_response(response, source="discarded", latency=seconds, **fields)
+
+    if breaker.allow():
+        try:
+            response, seconds = _hedged_create(kwargs, on_discarded)
+        except Exception as e:
+            if _retryable(e):
+                breaker.record_failure()
+            else:
+                breaker.record_success()  # 応答は返っている (リクエストの誤りなど)
+            metrics.incr(f"llm.failed.{type(e).__name__}")
+        else:
+            breaker.record_success()
+            latency.record(seconds)
+            metrics.incr("llm.succeeded")
+            usage.record_response(response, source="llm", latency=seconds, **fields)
+            answer = response.choices[0].message.content
+            cache.set(key, answer, timeout=_setting("LLM_ANSWER_CACHE_SECONDS", 86400))
+            return Reply(answer)
+    else:
+        metrics.incr("llm.short_circuited")
+
+    cached = cache.get(key)
+    if cached is not None:
+        metrics.incr("llm.fallback_cache")
+        usage.record(source="cache", **fields)
+        return Reply(cached, "cache")
+    metrics.incr("llm.fallback_template")
+    usage.record(source="template", **fields)
+    return Reply(fallback(), "template")
+
+
+def complete_parts(parts: list[tuple[str, str]], fallback, *, endpoint: str = "", sb: int | None = None,
+                   **options) -> Reply:
+    """
+    長い鑑定を部分ごとに並列に生成し、見出しを付けてつなげた回答を返す。
+    待ち時間は部分の数によらず、いちばん遅い部分の応答時間になる。
+
+    :param parts: (見出し, プロンプト) のリスト。見出しが空の部分は見出しを付けない
+    :param fallback: 縮退時に呼ぶ、全体の定型文を返す関数。1つでも定型文になった部分があれば全体をこれにする
+    :raises usage.PromptTooLarge: いずれかのプロンプトが LLM_PROMPT_TOKEN_LIMIT に収まらない場合
+    """
+    futures = [_parts_executor.submit(_complete_in_worker, message, lambda: None, endpoint=endpoint, sb=sb,
+                                      **options)
+               for _, message in parts]
+    try:
+        replies = [future.result() for future in futures]
+    finally:
+        usage.maybe_flush()
+    metrics.incr("llm.parts", len(parts))
+    if any(reply.source == "template" for reply in replies):
+        return Reply(fallback(), "template")
+    text = "\n\n".join(f"{heading}\n{reply.text}" if heading else reply.text
+                        for (heading, _), reply in zip(parts, replies))
+    return Reply(text, "llm" if all(reply.source == "llm" for reply in replies) else "cache")
+
+
+def _complete_in_worker(user_message: str, fallback, **options) -> Reply:
+    """
+    _parts_executor のスレッドで _complete を呼ぶ。
+    DB の接続はスレッドごとに開かれ、リクエストの終了時にも閉じられないため、
+    (キャッシュのバックエンド等が) このスレッドで開いた接続はここで閉じる。
+    """
+    try:
+        return _complete(user_message, fallback, **options)
+    finally:
+        db.connections.close_all()
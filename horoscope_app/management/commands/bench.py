@@ -0,0 +1,344 @@
+# horoscope_app/management/commands/bench.py
+"""
+マイクロベンチマーク。
+
+使い方:
+    python manage.py bench              # 全ケースを実行
+    python manage.py bench validation   # 指定したケースのみ
+"""
+import datetime
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from django.http import QueryDict
+
+
+def _timeit(func, number: int) -> float:
+    """func を number 回実行し、1回あたりのマイクロ秒を返す。"""
+    func()  # ウォームアップ
+    start = time.perf_counter()
+    for _ in range(number):
+        func()
+    return (time.perf_counter() - start) / number * 1e6
+
+
+def bench_validation(stdout, number: int):
+    """出生データの解析+検証 (parse_birth_input) 1リクエストあたりのコスト。"""
+    from horoscope_app.validation import parse_birth_input
+
+    single = QueryDict(
+        "year=1990&month=5&day=3&hour=14&minute=30&lat=35.6895&lon=139.6917"
+        "&tz=9.0&dst=0.0&prefecture=Tokyo&sb=1&unknown=on"
+    )
+    pair = QueryDict(
+        "year1=1990&month1=5&day1=3&hour1=14&minute1=30&lat1=35.6895&lon1=139.6917"
+        "&tz1=9.0&dst1=0.0&prefecture1=Tokyo"
+        "&year2=1992&month2=2&day2=29&hour2=8&minute2=5&lat2=34.68639&lon2=135.52"
+        "&tz2=9.0&dst2=0.0&prefecture2=Osaka&sb=7"
+    )
+    as_dict = {k: v for k, v in single.items()}
+
+    us = _timeit(lambda: parse_birth_input(single), number)
+    stdout.write(f"  QueryDict 1人分      : {us:8.2f} us/req")
+    us = _timeit(lambda: (parse_birth_input(pair, "1"), parse_birth_input(pair, "2")), number)
+    stdout.write(f"  QueryDict 2人分(相性): {us:8.2f} us/req")
+    us = _timeit(lambda: parse_birth_input(as_dict), number)
+    stdout.write(f"  dict(JSON) 1人分     : {us:8.2f} us/req")
+
+
+def bench_timezone(stdout, number: int):
+    """IANA タイムゾーンからのオフセット解決 (切替表の作成と bisect による解決)。"""
+    from horoscope_app import timezones
+
+    timezones.offset_table.cache_clear()
+    start = time.perf_counter()
+    timezones.offset_table("America/New_York")
+    stdout.write(f"  切替表の作成(初回のみ): {(time.perf_counter() - start) * 1e3:8.1f} ms")
+    us = _timeit(lambda: timezones.resolve_offset("America/New_York", 1975, 7, 4, 12, 30), number)
+    stdout.write(f"  オフセット解決        : {us:8.2f} us/call")
+    us = _timeit(lambda: timezones.resolve_offset("Asia/Tokyo", 1949, 8, 1, 9, 0), number)
+    stdout.write(f"  オフセット解決(日本)  : {us:8.2f} us/call")
+
+
+def bench_geocoding(stdout, number: int):
+    """オフライン地名辞書の読み込み・前方一致・最寄り都市検索。"""
+    from horoscope_app import geocoding
+
+    start = time.perf_counter()
+    gazetteer = geocoding.Gazetteer(geocoding.load_places())
+    stdout.write(f"  読み込み+索引作成(初回のみ): {(time.perf_counter() - start) * 1e3:8.2f} ms"
+                 f" ({len(gazetteer.places)}件)")
+    us = _timeit(lambda: gazetteer.lookup("Osaka"), number)
+    stdout.write(f"  完全一致             : {us:8.2f} us/call")
+    us = _timeit(lambda: gazetteer.autocomplete("大", 10), number)
+    stdout.write(f"  前方一致(10件)       : {us:8.2f} us/call")
+    us = _timeit(lambda: gazetteer.nearest(34.9, 135.6), number)
+    stdout.write(f"  最寄り都市(KD木)     : {us:8.2f} us/call")
+
+
+def bench_chart_svg(stdout, number: int):
+    """チャート SVG の描画 (目標: 1枚 10ms 未満) と、キャッシュ済みの場合の取得。"""
+    from django.core.cache import cache
+
+    from horoscope_app.chart_svg import chart_cache_key, chart_svg_for, render_chart_svg
+    from horoscope_app.utils import horoscope_for
+    from horoscope_app.validation import parse_birth_input
+
+    birth = parse_birth_input({"year": "1990", "month": "5", "day": "3", "hour": "14",
+                               "minute": "30", "prefecture": "Tokyo"})
+    analysis = horoscope_for(birth)["analysis"]
+    number = max(1, number // 10)
+    us = _timeit(lambda: render_chart_svg(analysis), number)
+    stdout.write(f"  描画(キャッシュなし)  : {us / 1000:8.3f} ms/枚"
+                 f" ({len(render_chart_svg(analysis).encode()) / 1024:.1f} KiB)")
+    cache.delete(chart_cache_key(birth))
+    us = _timeit(lambda: chart_svg_for(birth), number)
+    stdout.write(f"  キャッシュから取得    : {us / 1000:8.3f} ms/枚")
+
+
+def bench_returns(stdout, number: int):
+    """ソーラー・リターン100年分 (目標: 100ms 未満)・ルナー・リターン・進行チャート。"""
+    from horoscope_app import progressions
+    from horoscope_app.validation import parse_birth_input
+
+    birth = parse_birth_input({"year": "1990", "month": "5", "day": "3", "hour": "14",
+                               "minute": "30", "prefecture": "Tokyo"})
+    number = max(1, number // 1000)
+    us = _timeit(lambda: progressions.solar_returns(birth, 1991, 2090), number)
+    stdout.write(f"  ソーラー・リターン100年分         : {us / 1000:8.2f} ms")
+    us = _timeit(lambda: progressions.solar_returns(birth, 1991, 2090, with_chart=True), number)
+    stdout.write(f"  ソーラー・リターン100年分(チャート): {us / 1000:8.2f} ms")
+    start = datetime.date(2025, 1, 1)
+    us = _timeit(lambda: progressions.lunar_returns(birth, start, 13), number)
+    stdout.write(f"  ルナー・リターン13回分             : {us / 1000:8.2f} ms")
+    us = _timeit(lambda: progressions.secondary_progression(birth, start), number)
+    stdout.write(f"  進行チャート                       : {us / 1000:8.2f} ms")
+
+
+def bench_options(stdout, number: int):
+    """計算方式の指定 (サイデリアル・ハウスシステム・座標系) の有無による compute_horoscope のコスト。"""
+    from horoscope_app.utils import compute_horoscope
+
+    args = (1990, 5, 3, 14, 30, 35.6895, 139.6917, 9.0, 0.0, "Tokyo")
+    number = max(1, number // 10)
+    us = _timeit(lambda: compute_horoscope(*args), number)
+    stdout.write(f"  既定(トロピカル・プラシーダス): {us:8.1f} us/chart")
+    us = _timeit(lambda: compute_horoscope(*args, ayanamsa="", house_system="placidus"), number)
+    stdout.write(f"  既定値を明示                  : {us:8.1f} us/chart")
+    us = _timeit(lambda: compute_horoscope(*args, house_system="whole_sign"), number)
+    stdout.write(f"  ホールサイン                  : {us:8.1f} us/chart")
+    us = _timeit(lambda: compute_horoscope(*args, ayanamsa="lahiri"), number)
+    stdout.write(f"  サイデリアル(ラヒリ)          : {us:8.1f} us/chart")
+    us = _timeit(lambda: compute_horoscope(*args, frames=("equatorial",)), number)
+    stdout.write(f"  赤道座標を追加                : {us:8.1f} us/chart")
+    us = _timeit(lambda: compute_horoscope(*args, frames=("equatorial", "heliocentric")), number)
+    stdout.write(f"  赤道座標+日心座標を追加       : {us:8.1f} us/chart")
+
+
+def bench_scoring(stdout, number: int):
+    """相性スコア: 1人と候補10万人分の比較 (目標: 1秒未満) と top-k の選択。"""
+    import numpy as np
+
+    from horoscope_app import scoring
+    from horoscope_app.utils import horoscope_for
+    from horoscope_app.validation import parse_birth_input
+
+    birth = parse_birth_input({"year": "1990", "month": "5", "day": "3", "hour": "14",
+                               "minute": "30", "prefecture": "Tokyo"})
+    longitudes, cusps = scoring.chart_features(horoscope_for(birth))
+    rng = np.random.default_rng(0)
+    candidates = rng.uniform(0, 360, (100_000, scoring.N_BODIES)).astype(np.float32)
+    candidate_cusps = np.sort(rng.uniform(0, 360, (100_000, 12)), axis=1).astype(np.float32)
+    number = max(1, number // 2000)
+    us = _timeit(lambda: scoring.score_many(longitudes, cusps, candidates, candidate_cusps), number)
+    stdout.write(f"  10万人分のスコア計算 : {us / 1000:8.1f} ms")
+    scores = scoring.score_many(longitudes, cusps, candidates, candidate_cusps)
+    us = _timeit(lambda: scoring.top_k(scores, 10), number)
+    stdout.write(f"  上位10件の選択       : {us / 1000:8.2f} ms")
+
+
+def bench_formatting(stdout, number: int):
+    """チャート1枚分 (天体+ハウスカスプ) の星座・度数の文字列化: 都度組み立てる場合と表から引く場合。"""
+    from horoscope_app.utils import format_position, get_sign, horoscope_for, sign_position
+    from horoscope_app.validation import parse_birth_input
+
+    birth = parse_birth_input({"year": "1990", "month": "5", "day": "3", "hour": "14",
+                               "minute": "30", "prefecture": "Tokyo"})
+    analysis = horoscope_for(birth)["analysis"]
+    degrees = [position["degree"] for position in analysis["1.天体の配置"].values()]
+    degrees += [cusp["cusp_degree"] for cusp in analysis["8.ハウスカスプ"]]
+
+    def per_call():
+        return [format_position(deg_in_sign, sign) for sign, deg_in_sign in map(get_sign, degrees)]
+
+    number = max(1, number // 10)
+    us = _timeit(per_call, number)
+    stdout.write(f"  都度フォーマット : {us:8.2f} us/chart ({len(degrees)}件)")
+    us = _timeit(lambda: [sign_position(d) for d in degrees], number)
+    stdout.write(f"  表から引く       : {us:8.2f} us/chart")
+
+
+def bench_payload(stdout, number: int):
+    """/horoscope/ の JSON の項目ごとのサイズ (非圧縮/gzip/brotli) と、符号化+圧縮にかかる時間。"""
+    import json
+
+    from django.core.serializers.json import DjangoJSONEncoder
+
+    from horoscope_app.compression import brotli, compress_bytes
+    from horoscope_app.utils import horoscope_for
+    from horoscope_app.validation import parse_birth_input
+
+    birth = parse_birth_input({"year": "1990", "month": "5", "day": "3", "hour": "14",
+                               "minute": "30", "prefecture": "Tokyo"})
+    result = horoscope_for(birth)
+    sections = {**{f"analysis/{key}": value for key, value in result["analysis"].items()},
+                "raw_data": result["raw_data"], "(全体)": result}
+    encodings = ["gzip"] + (["br"] if brotli is not None else [])
+    number = max(1, number // 100)
+    stdout.write(f"  {'項目':24s} {'JSON':>8s} " + " ".join(f"{e:>8s}" for e in encodings)
+                 + f" {'符号化':>9s} " + " ".join(f"{e + '圧縮':>10s}" for e in encodings))
+    for name, value in sections.items():
+        body = json.dumps(value, cls=DjangoJSONEncoder).encode()
+        sizes = " ".join(f"{len(compress_bytes(body, e)):8d}" for e in encodings)
+        encode_us = _timeit(lambda: json.dumps(value, cls=DjangoJSONEncoder).encode(), number)
+        compress_us = " ".join(f"{_timeit(lambda: compress_bytes(body, e), number):8.1f}us"
+                               for e in encodings)
+        stdout.write(f"  {name:24s} {len(body):8d} {sizes} {encode_us:7.1f}us {compress_us}")
+
+
+def bench_compatibility(stdout, number: int):
+    """
+    /analyze_compatibility/ の前処理 (2人分のチャート+プロンプト用の JSON) と、OpenAI を
+    fake_openai のサーバーにした場合のリクエスト全体の時間。
+    """
+    import threading
+    from concurrent.futures import ThreadPoolExecutor
+
+    from django.conf import settings
+    from django.test import Client, override_settings
+
+    from horoscope_app import usage
+    from horoscope_app.management.commands.fake_openai import FakeOpenAI, make_server
+    from horoscope_app.utils import compute_horoscope, horoscope_for
+    from horoscope_app.validation import parse_birth_input
+    from horoscope_app.views import _chart_prompt
+
+    def birth(minute: int, year: str = "1990"):
+        return parse_birth_input({"year": year, "month": "5", "day": "3", "hour": "14",
+                                  "minute": str(minute % 60), "prefecture": "Tokyo"})
+
+    number = max(1, number // 100)
+    pairs = [(birth(i, "1990"), birth(i, "1992")) for i in range(number)]
+    # 2人分のチャートを順に計算する場合と、スレッドで並行に計算する場合 (キャッシュなし)
+    start = time.perf_counter()
+    for me, partner in pairs:
+        compute_horoscope(*me.horoscope_args()), compute_horoscope(*partner.horoscope_args())
+    stdout.write(f"  チャート2人分 (順に)       : {(time.perf_counter() - start) / number * 1e6:8.1f} us/req")
+    with ThreadPoolExecutor(max_workers=2) as pool:
+        start = time.perf_counter()
+        for me, partner in pairs:
+            future = pool.submit(compute_horoscope, *partner.horoscope_args())
+            compute_horoscope(*me.horoscope_args())
+            future.result()
+    stdout.write(f"  チャート2人分 (スレッド)   : {(time.perf_counter() - start) / number * 1e6:8.1f} us/req")
+
+    # 「私」を固定して相手だけ変える場合 (私のチャートと JSON はキャッシュから)
+    for label, make_pair in (("2人とも初めて", lambda i: (birth(i, "1970"), birth(i, "1972"))),
+                             ("私は2回目以降", lambda i: (birth(0, "1980"), birth(i, "1982")))):
+        horoscope_for.cache_clear()
+        _chart_prompt.cache_clear()
+        start = time.perf_counter()
+        for i in range(number):
+            for person in make_pair(i):
+                _chart_prompt(person, False, ())
+        stdout.write(f"  チャート+JSON ({label}) : {(time.perf_counter() - start) / number * 1e6:8.1f} us/req")
+
+    # リクエスト全体 (OpenAI はプロセス内の fake_openai。応答は 50ms)
+    fake = FakeOpenAI(latency=0.05, jitter=0.0, distribution="fixed", error_rate=0.0,
+                      error_statuses=[500], chars=400, stream_chunks=1, seed=0)
+    server = make_server(fake, "127.0.0.1", 0)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    requests = max(5, number // 5)
+    try:
+        with override_settings(OPENAI_API_KEY="fake", OPENAI_BASE_URL=f"http://127.0.0.1:{server.server_address[1]}/v1",
+                               RATELIMIT_ENABLED=False, LLM_USAGE_BATCH_SIZE=10 ** 9,
+                               ALLOWED_HOSTS=[*settings.ALLOWED_HOSTS, "testserver"]):
+            client = Client()
+            for label, me_year in (("2人とも初めて", None), ("私は2回目以降", 1980)):
+                start = time.perf_counter()
+                for i in range(requests):
+                    client.post("/analyze_compatibility/", {
+                        "year1": me_year or 1960 + i % 40, "month1": 1, "day1": 1, "hour1": 9, "minute1": i % 60,
+                        "prefecture1": "Tokyo",
+                        "year2": 1987, "month2": 1 + i % 12, "day2": 1 + i % 28, "hour2": 9, "minute2": i % 60,
+                        "prefecture2": "Osaka", "sb": 7})
+                stdout.write(f"  リクエスト全体 ({label}) : {(time.perf_counter() - start) / requests * 1e3:8.1f} ms/req")
+    finally:
+        server.shutdown()
+        server.server_close()
+        usage.reset()
+
+
+def bench_overlay(stdout, number: int):
+    """
+    トランジットと出生図の重ね合わせ (overlay.timeline) の1年分 (毎日正午) の時間。
+    天体が区間を出たときだけ状態を引き直す場合と、毎時刻すべての天体のハウス・アスペクトを求め直す場合を比べる。
+    """
+    from horoscope_app import overlay
+    from horoscope_app.daily_positions import BODIES, positions_series
+    from horoscope_app.validation import parse_birth_input
+
+    birth = parse_birth_input({"year": "1990", "month": "5", "day": "3", "hour": "14",
+                               "minute": "30", "prefecture": "Tokyo"})
+    moments = overlay.instants(datetime.date(2025, 1, 1), 365, 24, birth.tzid)
+    number = max(1, number // 1000)
+    overlay.natal_overlay.cache_clear()
+    start = time.perf_counter()
+    natal = overlay.natal_overlay(birth)
+    stdout.write(f"  出生図の表の作成 (初回のみ) : {(time.perf_counter() - start) * 1e3:8.2f} ms"
+                 f" (境目 {len(natal.boundaries)} 件)")
+    positions = list(positions_series(moments))
+    stdout.write(f"  トランジットの位置 (365日) : {_timeit(lambda: list(positions_series(moments)), number) / 1e3:8.2f} ms")
+
+    def brute_force():
+        for values in positions:
+            for name, name_ja, _ in BODIES:
+                if name_ja != "月":
+                    natal.state_at(values[name][0])
+
+    result = overlay.timeline(birth, moments)
+    stdout.write(f"  timeline (差分, 位置を含む) : {_timeit(lambda: overlay.timeline(birth, moments), number) / 1e3:8.2f} ms"
+                 f" (区間の引き直し {result['relocated']} 回 / {len(moments) * (len(BODIES) - 1)} 天体・時刻)")
+    stdout.write(f"  毎時刻すべて求め直す (位置を除く) : {_timeit(brute_force, number) / 1e3:8.2f} ms")
+
+
+CASES = {
+    "validation": bench_validation,
+    "timezone": bench_timezone,
+    "geocoding": bench_geocoding,
+    "chart_svg": bench_chart_svg,
+    "returns": bench_returns,
+    "options": bench_options,
+    "scoring": bench_scoring,
+    "formatting": bench_formatting,
+    "payload": bench_payload,
+    "compatibility": bench_compatibility,
+    "overlay": bench_overlay,
+}
+
+
+class Command(BaseCommand):
+    help = "ホロスコープ計算まわりのマイクロベンチマークを実行します。"
+
+    def add_arguments(self, parser):
+        parser.add_argument("cases", nargs="*", help=f"実行するケース ({', '.join(CASES)})")
+        parser.add_argument("-n", "--number", type=int, default=10000, help="反復回数")
+
+    def handle(self, *args, **options):
+        names = options["cases"] or list(CASES)
+        for name in names:
+            if name not in CASES:
+                raise CommandError(f"不明なケースです: {name}")
+        for name in names:
+            self.stdout.write(f"[{name}]")
+            CASES[name](self.stdout, options["number"])
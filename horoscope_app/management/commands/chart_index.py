@@ -0,0 +1,119 @@
+# horoscope_app/management/commands/chart_index.py
+"""
+似たチャートの検索インデックス (similarity.ChartIndex) の管理。
+
+使い方:
+    python manage.py chart_index build                # StoredChart 全件から作り直す
+    python manage.py chart_index sync                 # 前回以降に登録された分を追記する
+    python manage.py chart_index query year=1990 month=5 day=3 hour=14 minute=30 prefecture=Tokyo
+    python manage.py chart_index bench --rows 1000000 # 合成データで作成時間と検索レイテンシを測る
+
+store_charts で登録した後に sync を実行する。追記した分は検索時に全件調べるため、
+追記が増えてきたら build で作り直す (cron で1日1回など)。
+"""
+import tempfile
+import time
+
+import numpy as np
+from django.conf import settings
+from django.core.exceptions import ValidationError
+from django.core.management.base import BaseCommand, CommandError
+
+from horoscope_app.models import StoredChart
+from horoscope_app.scoring import N_BODIES, chart_features
+from horoscope_app.similarity import (DEFAULT_NPROBE, DIM, MAX_DISTANCE, ChartIndex,
+                                      feature_vectors, get_index, stored_chart_vectors)
+from horoscope_app.utils import horoscope_for
+from horoscope_app.validation import parse_birth_input
+
+
+class Command(BaseCommand):
+    help = "似たチャートの検索インデックスを作成・追記・検索します。"
+
+    def add_arguments(self, parser):
+        parser.add_argument("action", choices=["build", "sync", "query", "bench"])
+        parser.add_argument("params", nargs="*", help="query: 出生データ (key=value)")
+        parser.add_argument("--nlist", type=int, help="build: IVF のリスト数 (既定は件数の平方根)")
+        parser.add_argument("--nprobe", type=int, default=DEFAULT_NPROBE, help="query/bench: 調べるリスト数")
+        parser.add_argument("-k", type=int, default=10, help="query/bench: 返す件数")
+        parser.add_argument("--rows", type=int, default=1_000_000, help="bench: 合成データの件数")
+        parser.add_argument("--queries", type=int, default=1000, help="bench: 検索の回数")
+
+    def handle(self, *args, **options):
+        getattr(self, f"_{options['action']}")(options)
+
+    def _build(self, options):
+        started = time.perf_counter()
+        ids, vectors = [], []
+        for batch_ids, batch_vectors in stored_chart_vectors():
+            ids.append(batch_ids)
+            vectors.append(batch_vectors)
+        ids = np.concatenate(ids) if ids else np.empty(0, dtype=np.int64)
+        vectors = np.concatenate(vectors) if vectors else np.empty((0, DIM), dtype=np.float32)
+        index = ChartIndex.build(settings.CHART_INDEX_DIR, ids, vectors, options["nlist"])
+        self.stdout.write(f"{len(index)} 件のインデックスを作成 (nlist={index.meta['nlist']},"
+                          f" {time.perf_counter() - started:.1f} 秒)")
+
+    def _sync(self, options):
+        index = get_index()
+        if index is None:
+            raise CommandError("インデックスがありません。先に chart_index build を実行してください。")
+        added = 0
+        for batch_ids, batch_vectors in stored_chart_vectors(index.last_id):
+            index.add(batch_ids, batch_vectors)
+            added += len(batch_ids)
+        self.stdout.write(f"{added} 件を追記 (合計 {len(index)} 件, 未整理 "
+                          f"{len(index) - index.meta['indexed']} 件)")
+
+    def _query(self, options):
+        index = get_index()
+        if index is None:
+            raise CommandError("インデックスがありません。先に chart_index build を実行してください。")
+        params = dict(param.split("=", 1) for param in options["params"] if "=" in param)
+        try:
+            birth = parse_birth_input(params)
+        except ValidationError as e:
+            raise CommandError(f"入力エラー: {e.message_dict}")
+        longitudes, _ = chart_features(horoscope_for(birth, birth.unknown))
+        started = time.perf_counter()
+        results = index.search(feature_vectors(longitudes), options["k"], options["nprobe"])
+        elapsed = time.perf_counter() - started
+        labels = dict(StoredChart.objects.filter(id__in=[pk for pk, _ in results])
+                      .values_list("id", "label"))
+        for pk, distance in results:
+            self.stdout.write(f"  {pk:8d}  {labels.get(pk, ''):20s}  距離 {distance:.4f}"
+                              f"  類似度 {100 * (1 - distance / MAX_DISTANCE):5.1f}")
+        self.stdout.write(f"({elapsed * 1e3:.2f} ms)")
+
+    def _bench(self, options):
+        rows, k, nprobe = options["rows"], options["k"], options["nprobe"]
+        rng = np.random.default_rng(0)
+        vectors = feature_vectors(rng.uniform(0, 360, (rows, N_BODIES)))
+        queries = feature_vectors(rng.uniform(0, 360, (options["queries"], N_BODIES)))
+        with tempfile.TemporaryDirectory() as root:
+            started = time.perf_counter()
+            index = ChartIndex.build(root, np.arange(1, rows + 1), vectors)
+            self.stdout.write(f"作成: {rows} 件, nlist={index.meta['nlist']},"
+                              f" {time.perf_counter() - started:.1f} 秒")
+
+            latencies, hits = [], 0
+            for query in queries:
+                started = time.perf_counter()
+                found = index.search(query, k, nprobe)
+                latencies.append(time.perf_counter() - started)
+                # 全件検索の結果と比べた再現率
+                exact = np.argpartition(((vectors - query) ** 2).sum(axis=1), k - 1)[:k] + 1
+                hits += len(set(pk for pk, _ in found) & set(exact.tolist()))
+            latencies.sort()
+            self.stdout.write(f"検索 (k={k}, nprobe={nprobe}): p50 {latencies[len(latencies) // 2] * 1e3:.2f} ms"
+                              f" / p99 {latencies[int(len(latencies) * 0.99)] * 1e3:.2f} ms,"
+                              f" 再現率 {hits / (k * len(queries)):.3f}")
+
+            added = feature_vectors(rng.uniform(0, 360, (10_000, N_BODIES)))
+            started = time.perf_counter()
+            index.add(np.arange(rows + 1, rows + 1 + len(added)), added)
+            self.stdout.write(f"追記: {len(added)} 件, {(time.perf_counter() - started) * 1e3:.1f} ms")
+            started = time.perf_counter()
+            for query in queries:
+                index.search(query, k, nprobe)
+            self.stdout.write(f"追記後の検索: {(time.perf_counter() - started) / len(queries) * 1e3:.2f} ms")
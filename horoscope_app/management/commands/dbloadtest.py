@@ -0,0 +1,116 @@
+# horoscope_app/management/commands/dbloadtest.py
+"""
+データベースへの同時書き込みの負荷試験。
+
+以前のトップページと同じく「1訪問ごとにセッションを DB に保存する」処理を
+複数スレッドから同時に実行し、スループット・レイテンシ・ロックエラーの件数を表示する。
+settings.DATABASES (DATABASE_URL) の接続先に対して実行するため、
+SQLite(WAL あり/なし) と PostgreSQL を同じ条件で比較できる。
+
+使い方:
+    python manage.py dbloadtest                       # 8スレッド x 5秒
+    python manage.py dbloadtest --threads 32 --seconds 10
+    python manage.py dbloadtest --journal-mode delete # SQLite の WAL を無効にして比較
+    DATABASE_URL=postgres://... python manage.py dbloadtest
+
+試験で作ったセッションは終了時に削除する。
+"""
+import threading
+import time
+
+from django.contrib.sessions.backends.db import SessionStore
+from django.contrib.sessions.models import Session
+from django.core.management.base import BaseCommand
+from django.db import OperationalError, connection
+
+
+def _percentile(values: list[float], p: float) -> float:
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * p))]
+
+
+class Command(BaseCommand):
+    help = "セッション書き込みを同時実行し、DB の書き込み競合を測定します。"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--threads", type=int, default=8, help="同時実行数")
+        parser.add_argument("--seconds", type=float, default=5.0, help="実行時間(秒)")
+        parser.add_argument("--journal-mode", choices=["wal", "delete"],
+                            help="SQLite の journal_mode を指定して実行する")
+
+    def handle(self, *args, **options):
+        vendor = connection.vendor
+        journal_mode = options["journal_mode"]
+        if journal_mode and vendor != "sqlite":
+            self.stderr.write("--journal-mode は SQLite の場合のみ指定できます。")
+            journal_mode = None
+
+        def set_journal_mode():
+            if journal_mode:
+                with connection.cursor() as cursor:
+                    cursor.execute(f"PRAGMA journal_mode={journal_mode}")
+
+        set_journal_mode()
+        described = vendor
+        if vendor == "sqlite":
+            with connection.cursor() as cursor:
+                cursor.execute("PRAGMA journal_mode")
+                described += f" (journal_mode={cursor.fetchone()[0]})"
+        self.stdout.write(f"DB: {described}, threads={options['threads']}, seconds={options['seconds']}")
+
+        deadline = time.perf_counter() + options["seconds"]
+        latencies: list[float] = []
+        created: list[str] = []
+        errors: dict[str, int] = {}
+        lock = threading.Lock()
+        start_barrier = threading.Barrier(options["threads"])
+
+        def worker():
+            local_latencies = []
+            local_created = []
+            local_errors = {}
+            try:
+                set_journal_mode()
+                start_barrier.wait()
+                while time.perf_counter() < deadline:
+                    started = time.perf_counter()
+                    try:
+                        session = SessionStore()
+                        session["valid_token"] = "dbloadtest"
+                        session.create()
+                        local_latencies.append(time.perf_counter() - started)
+                        local_created.append(session.session_key)
+                    except OperationalError as e:
+                        message = str(e).split("\n")[0]
+                        local_errors[message] = local_errors.get(message, 0) + 1
+            finally:
+                connection.close()
+                with lock:
+                    latencies.extend(local_latencies)
+                    created.extend(local_created)
+                    for message, count in local_errors.items():
+                        errors[message] = errors.get(message, 0) + count
+
+        threads = [threading.Thread(target=worker) for _ in range(options["threads"])]
+        began = time.perf_counter()
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        elapsed = time.perf_counter() - began
+
+        deleted = 0
+        for i in range(0, len(created), 500):
+            deleted += Session.objects.filter(session_key__in=created[i:i + 500]).delete()[0]
+
+        total_errors = sum(errors.values())
+        self.stdout.write(f"  成功        : {len(latencies)} 件 ({len(latencies) / elapsed:8.1f} 件/秒)")
+        self.stdout.write(f"  レイテンシ  : p50 {_percentile(latencies, 0.5) * 1e3:7.2f} ms"
+                          f" / p95 {_percentile(latencies, 0.95) * 1e3:7.2f} ms"
+                          f" / max {max(latencies, default=0.0) * 1e3:7.2f} ms")
+        self.stdout.write(f"  エラー      : {total_errors} 件")
+        for message, count in sorted(errors.items(), key=lambda item: -item[1]):
+            self.stdout.write(f"    {count:6d}  {message}")
+        self.stdout.write(f"  後片付け    : {deleted} 件のセッションを削除")
@@ -0,0 +1,226 @@
+# horoscope_app/management/commands/fake_openai.py
+"""
+負荷試験用の OpenAI (chat completions) の代わりのローカルサーバー。
+
+実際の API を呼ばずに /analyze/ などに負荷をかけるため、応答までの待ち時間と
+エラーの発生率を指定できる。stream=true のリクエストには SSE で少しずつ返す。
+
+使い方:
+    python manage.py fake_openai --port 8001 --latency 3.0 --jitter 0.5 --error-rate 0.02
+    # 別の端末で Django をこのサーバーに向けて起動する
+    OPENAI_BASE_URL=http://127.0.0.1:8001/v1 OPENAI_API_KEY=fake python manage.py runserver
+
+待ち時間の分布:
+    fixed      常に --latency 秒
+    uniform    --latency ± --jitter 秒の一様分布
+    lognormal  中央値 --latency 秒、ばらつき --jitter (対数の標準偏差)。LLM の応答時間に近い裾の重い分布
+"""
+import json
+import random
+import sys
+import threading
+import time
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from django.core.management.base import BaseCommand
+
+# 応答本文 (文字数は --chars で指定した長さまで繰り返す)
+ANSWER_TEXT = ("太陽と月の配置から、あなたは穏やかさと行動力をあわせ持つ人です。"
+               "周囲の期待に応えようとする一方で、自分のペースを大切にします。")
+# 返すエラーのステータスと OpenAI のエラー type
+ERRORS = {
+    429: "rate_limit_exceeded",
+    500: "server_error",
+    503: "service_unavailable",
+}
+
+
+class FakeOpenAI:
+    """待ち時間・エラーの分布と、処理件数の集計。"""
+
+    def __init__(self, latency: float, jitter: float, distribution: str, error_rate: float,
+                 error_statuses: list[int], chars: int, stream_chunks: int, seed: int | None):
+        self.latency = latency
+        self.jitter = jitter
+        self.distribution = distribution
+        self.error_rate = error_rate
+        self.error_statuses = error_statuses
+        self.chars = chars
+        self.stream_chunks = stream_chunks
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+        self.counts: dict[str, int] = {}
+        self.in_flight = 0
+        self.max_in_flight = 0
+
+    def sample(self) -> tuple[float, int]:
+        """(待ち時間(秒), エラーにする場合のステータス or 0) を返す。"""
+        with self._lock:
+            if self.distribution == "fixed":
+                delay = self.latency
+            elif self.distribution == "uniform":
+                delay = self._random.uniform(self.latency - self.jitter, self.latency + self.jitter)
+            else:
+                delay = self.latency * self._random.lognormvariate(0.0, self.jitter)
+            status = 0
+            if self._random.random() < self.error_rate:
+                status = self._random.choice(self.error_statuses)
+            return max(0.0, delay), status
+
+    def count(self, name: str, delta_in_flight: int = 0) -> None:
+        with self._lock:
+            self.counts[name] = self.counts.get(name, 0) + 1
+            self.in_flight += delta_in_flight
+            self.max_in_flight = max(self.max_in_flight, self.in_flight)
+
+    def answer(self) -> str:
+        return (ANSWER_TEXT * (self.chars // len(ANSWER_TEXT) + 1))[:self.chars]
+
+
+def _handler(fake: FakeOpenAI):
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"  # keep-alive (クライアントは接続を使い回す)
+
+        def log_message(self, format, *args):
+            pass
+
+        def _send_json(self, status: int, body: dict) -> None:
+            data = json.dumps(body, ensure_ascii=False).encode()
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(data)))
+            if status == 429:
+                self.send_header("Retry-After", "1")
+            self.end_headers()
+            self.wfile.write(data)
+
+        def do_GET(self):
+            if self.path.rstrip("/").endswith("/models"):
+                self._send_json(200, {"object": "list", "data": [{"id": "fake", "object": "model"}]})
+            elif self.path.rstrip("/").endswith("/stats"):
+                self._send_json(200, {"counts": fake.counts, "in_flight": fake.in_flight,
+                                      "max_in_flight": fake.max_in_flight})
+            else:
+                self._send_json(404, {"error": {"message": "not found", "type": "invalid_request_error"}})
+
+        def do_POST(self):
+            length = int(self.headers.get("Content-Length") or 0)
+            try:
+                request = json.loads(self.rfile.read(length) or b"{}")
+            except ValueError:
+                self._send_json(400, {"error": {"message": "invalid json", "type": "invalid_request_error"}})
+                return
+            if not self.path.rstrip("/").endswith("/chat/completions"):
+                self._send_json(404, {"error": {"message": "not found", "type": "invalid_request_error"}})
+                return
+
+            delay, status = fake.sample()
+            fake.count("requests", +1)
+            try:
+                if status:
+                    time.sleep(delay / 2)  # エラーは応答の途中で返ることが多い
+                    fake.count(f"error_{status}")
+                    self._send_json(status, {"error": {"message": f"fake {ERRORS.get(status, 'error')}",
+                                                       "type": ERRORS.get(status, "server_error")}})
+                elif request.get("stream"):
+                    self._stream(request, delay)
+                    fake.count("streamed")
+                else:
+                    time.sleep(delay)
+                    self._send_json(200, self._completion(request, fake.answer()))
+                    fake.count("ok")
+            finally:
+                fake.count("finished", -1)
+
+        def _completion(self, request: dict, content: str) -> dict:
+            prompt_chars = sum(len(str(m.get("content", ""))) for m in request.get("messages", []))
+            return {
+                "id": f"chatcmpl-{uuid.uuid4().hex}",
+                "object": "chat.completion",
+                "created": int(time.time()),
+                "model": request.get("model", "fake"),
+                "choices": [{"index": 0, "finish_reason": "stop",
+                             "message": {"role": "assistant", "content": content}}],
+                # トークン数は文字数からの概算 (日本語はおおよそ1文字1トークン)
+                "usage": {"prompt_tokens": prompt_chars, "completion_tokens": len(content),
+                          "total_tokens": prompt_chars + len(content)},
+            }
+
+        def _stream(self, request: dict, delay: float) -> None:
+            """最初の塊までに delay の半分、残りを塊ごとに等分して SSE で返す。"""
+            self.send_response(200)
+            self.send_header("Content-Type", "text/event-stream")
+            self.send_header("Cache-Control", "no-cache")
+            self.send_header("Connection", "close")
+            self.end_headers()
+            self.close_connection = True
+            answer = fake.answer()
+            chunks = max(1, fake.stream_chunks)
+            size = -(-len(answer) // chunks)
+            base = {"id": f"chatcmpl-{uuid.uuid4().hex}", "object": "chat.completion.chunk",
+                    "created": int(time.time()), "model": request.get("model", "fake")}
+            time.sleep(delay / 2)
+            for i in range(0, len(answer), size):
+                delta = {"content": answer[i:i + size]}
+                if i == 0:
+                    delta["role"] = "assistant"
+                event = dict(base, choices=[{"index": 0, "delta": delta, "finish_reason": None}])
+                self.wfile.write(f"data: {json.dumps(event, ensure_ascii=False)}\n\n".encode())
+                self.wfile.flush()
+                time.sleep(delay / 2 / chunks)
+            event = dict(base, choices=[{"index": 0, "delta": {}, "finish_reason": "stop"}])
+            self.wfile.write(f"data: {json.dumps(event)}\n\ndata: [DONE]\n\n".encode())
+            self.wfile.flush()
+
+    return Handler
+
+
+class _Server(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def handle_error(self, request, client_address):
+        # クライアントが待つのをやめた (タイムアウト・ヘッジで捨てた) リクエストへの応答の失敗は表示しない
+        if isinstance(sys.exc_info()[1], ConnectionError):
+            return
+        super().handle_error(request, client_address)
+
+
+def make_server(fake: FakeOpenAI, host: str, port: int) -> ThreadingHTTPServer:
+    """fake の設定で応答するサーバーを作る (port=0 なら空いているポート)。"""
+    return _Server((host, port), _handler(fake))
+
+
+class Command(BaseCommand):
+    help = "負荷試験用に OpenAI の chat completions の代わりのサーバーを起動します。"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--host", default="127.0.0.1")
+        parser.add_argument("--port", type=int, default=8001)
+        parser.add_argument("--latency", type=float, default=3.0, help="応答までの秒数 (lognormal では中央値)")
+        parser.add_argument("--jitter", type=float, default=0.5, help="ばらつき (uniform: ±秒, lognormal: σ)")
+        parser.add_argument("--distribution", choices=["fixed", "uniform", "lognormal"], default="lognormal")
+        parser.add_argument("--error-rate", type=float, default=0.0, help="エラーにする割合 (0〜1)")
+        parser.add_argument("--error-status", default="500,429", help="返すエラーのステータス (カンマ区切り)")
+        parser.add_argument("--chars", type=int, default=400, help="応答本文の文字数")
+        parser.add_argument("--stream-chunks", type=int, default=20, help="stream=true のときの塊の数")
+        parser.add_argument("--seed", type=int, help="乱数の種 (再現したい場合)")
+
+    def handle(self, *args, **options):
+        fake = FakeOpenAI(
+            latency=options["latency"], jitter=options["jitter"], distribution=options["distribution"],
+            error_rate=options["error_rate"],
+            error_statuses=[int(s) for s in options["error_status"].split(",") if s.strip()],
+            chars=options["chars"], stream_chunks=options["stream_chunks"], seed=options["seed"],
+        )
+        server = make_server(fake, options["host"], options["port"])
+        self.stdout.write(f"fake OpenAI: http://{options['host']}:{options['port']}/v1"
+                          f" ({options['distribution']}, latency={options['latency']}s,"
+                          f" error_rate={options['error_rate']})")
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            server.server_close()
+            self.stdout.write(f"集計: {fake.counts} (最大同時 {fake.max_in_flight})")
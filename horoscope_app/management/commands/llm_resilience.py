@@ -0,0 +1,163 @@
+# horoscope_app/management/commands/llm_resilience.py
+"""
+OpenAI 呼び出しの縮退 (llm.complete のタイムアウト・ヘッジ・サーキットブレーカー・代替の回答) の確認。
+
+fake_openai のサーバーをプロセス内でローカルのポートに起動し、接続先をそこへ向けて
+次の場面を順に再現する。期待どおりでない項目があれば NG を表示して終了コード1で終わる。
+
+    正常        応答時間を計測し、タイムアウトが上限から縮む
+    裾の遅延    ヘッジあり/なしで p99 を比べる
+    応答なし    タイムアウトで定型文を返し、連続失敗でブレーカーが開く → 以降は即座に縮退
+    エラー      5xx が続いても例外を出さず、過去の回答 (キャッシュ) か定型文を返す
+    /analyze/   障害中でもビューが 200 と縮退した回答を返す
+    復旧        待ち時間の後に1件だけ試し、成功するとブレーカーが閉じる
+    使用量      呼び出しごとに使用量が記録され、上限を超えるプロンプトは縮めるか拒否する
+
+記録した使用量は DB に書き込まずに捨てる。
+同じ場面の確認は tests.py の LLMResilienceTests にもあり、manage.py test で実行される
+(このコマンドはヘッジあり/なしの応答時間も表示する)。
+
+使い方:
+    python manage.py llm_resilience
+"""
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.core.cache import cache
+from django.core.management.base import BaseCommand, CommandError
+from django.test import Client, override_settings
+
+from horoscope_app import llm, metrics, usage
+from horoscope_app.management.commands.fake_openai import FakeOpenAI, make_server
+
+FALLBACK_TEXT = "定型文"
+COOLDOWN = 1.0
+
+
+def _percentile(values: list[float], p: float) -> float:
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * p))]
+
+
+class Command(BaseCommand):
+    help = "OpenAI 呼び出しの縮退をローカルの代替サーバーで確認します。"
+
+    def handle(self, *args, **options):
+        fake = FakeOpenAI(latency=0.05, jitter=0.0, distribution="fixed", error_rate=0.0,
+                          error_statuses=[500, 503], chars=100, stream_chunks=1, seed=0)
+        server = make_server(fake, "127.0.0.1", 0)
+        port = server.server_address[1]
+        thread = ThreadPoolExecutor(max_workers=1)
+        thread.submit(server.serve_forever)
+        self.failed = 0
+        try:
+            with override_settings(
+                    OPENAI_API_KEY="fake", OPENAI_BASE_URL=f"http://127.0.0.1:{port}/v1",
+                    LLM_MIN_SAMPLES=10, LLM_TIMEOUT_MIN=0.3, LLM_HEDGE_MIN_DELAY=0.05,
+                    LLM_BREAKER_FAILURES=3, LLM_BREAKER_COOLDOWN=COOLDOWN,
+                    LLM_USAGE_BATCH_SIZE=10 ** 9, LLM_USAGE_FLUSH_SECONDS=float("inf"),
+                    RATELIMIT_ENABLED=False, ALLOWED_HOSTS=[*settings.ALLOWED_HOSTS, "testserver"]):
+                llm.latency.reset()
+                llm.breaker.reset()
+                metrics.reset()
+                cache.clear()
+                usage.reset()
+                self._run(fake)
+        finally:
+            usage.reset()
+            server.shutdown()
+            server.server_close()
+            thread.shutdown()
+        if self.failed:
+            raise CommandError(f"{self.failed} 件の確認が期待どおりではありません。")
+        self.stdout.write("すべて OK")
+
+    def _expect(self, ok: bool, label: str, detail: str = "") -> None:
+        self.stdout.write(f"  {'OK' if ok else 'NG'}  {label}" + (f"  ({detail})" if detail else ""))
+        if not ok:
+            self.failed += 1
+
+    def _call(self, prompt: str) -> tuple[llm.Reply, float]:
+        started = time.perf_counter()
+        reply = llm.complete(prompt, lambda: FALLBACK_TEXT)
+        return reply, time.perf_counter() - started
+
+    def _many(self, prompts: list[str], concurrency: int = 8) -> list[tuple[llm.Reply, float]]:
+        with ThreadPoolExecutor(max_workers=concurrency) as pool:
+            return list(pool.map(self._call, prompts))
+
+    def _run(self, fake: FakeOpenAI):
+        self.stdout.write("[正常]")
+        results = self._many([f"正常 {i}" for i in range(20)])
+        self._expect(all(reply.source == "llm" for reply, _ in results), "すべて OpenAI の回答")
+        timeout = llm.latency.timeout()
+        self._expect(timeout < settings.LLM_TIMEOUT_MAX, "タイムアウトが直近の応答時間から決まる",
+                   f"{timeout:.2f} 秒")
+
+        self.stdout.write("[裾の遅延]")
+        fake.distribution, fake.latency, fake.jitter = "lognormal", 0.05, 1.2
+        for hedge in (False, True):
+            with override_settings(LLM_HEDGE_ENABLED=hedge):
+                before = metrics.snapshot().get("llm.hedged", 0)
+                latencies = [seconds for _, seconds in self._many([f"裾 {hedge} {i}" for i in range(80)])]
+                hedged = metrics.snapshot().get("llm.hedged", 0) - before
+            self.stdout.write(f"      ヘッジ{'あり' if hedge else 'なし'}: p50 {_percentile(latencies, 0.5) * 1e3:6.0f} ms"
+                              f" / p99 {_percentile(latencies, 0.99) * 1e3:6.0f} ms (2本目 {hedged} 件)")
+        self._expect(metrics.snapshot().get("llm.hedged", 0) > 0, "遅い呼び出しに2本目を送る")
+
+        self.stdout.write("[応答なし]")
+        # 裾の遅延の計測分を捨て、速い応答の計測からタイムアウトを決め直す
+        fake.distribution = "fixed"
+        llm.latency.reset()
+        self._many([f"正常 {i}" for i in range(10)])
+        fake.latency = 5.0
+        results = [self._call(f"応答なし {i}") for i in range(3)]
+        self._expect(all(reply.source == "template" for reply, _ in results), "タイムアウトで定型文を返す")
+        self._expect(max(seconds for _, seconds in results) < 2.0, "上限 (180秒) まで待たない",
+                   f"最大 {max(seconds for _, seconds in results):.2f} 秒")
+        self._expect(llm.breaker.state == llm.CircuitBreaker.OPEN, "連続失敗でブレーカーが開く")
+        reply, seconds = self._call("遮断中")
+        self._expect(reply.source == "template" and seconds < 0.05, "遮断中は呼び出さずに即座に返す",
+                   f"{seconds * 1e3:.1f} ms")
+
+        self.stdout.write("[エラー]")
+        llm.breaker.reset()
+        fake.latency, fake.error_rate = 0.05, 1.0
+        reply, _ = self._call("正常 0")
+        self._expect(reply.source == "cache", "過去に答えたプロンプトはキャッシュの回答を返す")
+        reply, _ = self._call("初めてのプロンプト")
+        self._expect(reply.source == "template", "キャッシュがなければ定型文を返す")
+
+        self.stdout.write("[/analyze/]")
+        response = Client().post("/analyze/", {"year": 1990, "month": 5, "day": 3, "hour": 14,
+                                               "minute": 30, "prefecture": "Tokyo", "sb": 1})
+        body = response.json()
+        self._expect(response.status_code == 200 and body.get("fallback") == "template"
+                   and "太陽" in body.get("result", ""), "障害中も 200 とチャートから作った鑑定文を返す",
+                   f"status={response.status_code}, fallback={body.get('fallback')}")
+
+        self.stdout.write("[復旧]")
+        fake.error_rate = 0.0
+        self._expect(llm.breaker.state == llm.CircuitBreaker.OPEN, "障害が続いた間はブレーカーが開いている")
+        time.sleep(COOLDOWN)
+        reply, _ = self._call("復旧")
+        self._expect(reply.source == "llm" and llm.breaker.state == llm.CircuitBreaker.CLOSED,
+                   "待ち時間の後に試した1件が成功するとブレーカーが閉じる")
+
+        self.stdout.write("[使用量]")
+        self._expect(usage.pending_count() > 0, "呼び出しごとに使用量を記録する", f"{usage.pending_count()} 件")
+        prompt = "チャート:\n  {\n    \"degree\": 123.456, \"formatted\": \"牡羊座 3°27'\"\n  }\n" * 200
+        estimated = usage.estimate_tokens(prompt)
+        with override_settings(LLM_PROMPT_TOKEN_LIMIT=int(estimated * 0.8), LLM_PROMPT_OVERSIZE="trim"):
+            _, trimmed_estimate, trimmed = usage.fit_prompt(prompt)
+            self._expect(trimmed and trimmed_estimate < estimated, "上限を超えるプロンプトは縮めて送る",
+                       f"{estimated} → {trimmed_estimate} トークン")
+        with override_settings(LLM_PROMPT_TOKEN_LIMIT=int(estimated * 0.8), LLM_PROMPT_OVERSIZE="reject"):
+            try:
+                llm.complete(prompt, lambda: FALLBACK_TEXT)
+                rejected = False
+            except usage.PromptTooLarge:
+                rejected = True
+            self._expect(rejected, "LLM_PROMPT_OVERSIZE=reject なら送らずに PromptTooLarge にする")
+        self.stdout.write(f"  メトリクス: { {k: v for k, v in metrics.snapshot().items() if k.startswith('llm.')} }")
@@ -0,0 +1,159 @@
+# horoscope_app/management/commands/loadtest.py
+"""
+起動中の Django アプリに HTTP で負荷をかけ、画面遷移ごとのスループットとレイテンシを表示する。
+
+1回の流れ (flow) は利用者の操作と同じ順にリクエストを送る:
+    index (トップページ) → token (ワンタイムトークンと CSRF Cookie)
+    → horoscope_ai (/horoscope/ai/) → analyze (/analyze/ POST) → detail (/horoscope/detail/)
+
+OpenAI は fake_openai コマンドのサーバーに向けておく:
+    python manage.py fake_openai --port 8001 --latency 3 &
+    OPENAI_BASE_URL=http://127.0.0.1:8001/v1 OPENAI_API_KEY=fake RATELIMIT_ENABLED=false \\
+        EXTRA_ALLOWED_HOSTS=127.0.0.1 \\
+        gunicorn aihoroscope.wsgi -w 4 --threads 16 -b 127.0.0.1:8000 &
+    python manage.py loadtest --base-url http://127.0.0.1:8000 --concurrency 50 --seconds 60
+
+レート制限を有効にしたまま実行すると analyze は 429 になる (その件数も表示する)。
+出生データは flow ごとに乱数で変える。--same-birth で全員同じにすると、
+チャートのキャッシュとリクエストの合流が効いた場合を測れる。
+"""
+import random
+import threading
+import time
+
+import httpx
+from django.core.management.base import BaseCommand, CommandError
+
+STEPS = ("index", "token", "horoscope_ai", "analyze", "detail")
+PREFECTURES = ("Tokyo", "Osaka", "Hokkaido", "Fukuoka", "Aichi", "Okinawa", "Miyagi", "Hiroshima")
+
+
+def _percentile(values: list[float], p: float) -> float:
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * p))]
+
+
+def _birth_params(rng: random.Random) -> dict:
+    return {"year": rng.randint(1950, 2010), "month": rng.randint(1, 12), "day": rng.randint(1, 28),
+            "hour": rng.randint(0, 23), "minute": rng.randint(0, 59),
+            "prefecture": rng.choice(PREFECTURES)}
+
+
+class _Results:
+    """ステップごとのレイテンシとステータスの集計 (スレッド間で共有)。"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.latencies: dict[str, list[float]] = {step: [] for step in STEPS}
+        self.statuses: dict[str, dict[str, int]] = {step: {} for step in STEPS}
+        self.flows = 0
+        self.flow_latencies: list[float] = []
+
+    def add(self, step: str, seconds: float, status: str) -> None:
+        with self._lock:
+            self.latencies[step].append(seconds)
+            self.statuses[step][status] = self.statuses[step].get(status, 0) + 1
+
+    def add_flow(self, seconds: float) -> None:
+        with self._lock:
+            self.flows += 1
+            self.flow_latencies.append(seconds)
+
+
+class Command(BaseCommand):
+    help = "起動中のアプリに index → horoscope_ai → analyze → detail の流れで負荷をかけます。"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--base-url", default="http://127.0.0.1:8000")
+        parser.add_argument("--concurrency", type=int, default=10, help="同時に操作する利用者の数")
+        parser.add_argument("--seconds", type=float, default=30.0, help="実行時間(秒)")
+        parser.add_argument("--steps", default=",".join(STEPS),
+                            help=f"実行するステップ (カンマ区切り。{', '.join(STEPS)})")
+        parser.add_argument("--sb", type=int, default=1, help="analyze の占いモード")
+        parser.add_argument("--think", type=float, default=0.0, help="ステップ間の待ち時間(秒)")
+        parser.add_argument("--timeout", type=float, default=200.0, help="1リクエストのタイムアウト(秒)")
+        parser.add_argument("--same-birth", action="store_true", help="全員同じ出生データを使う")
+        parser.add_argument("--seed", type=int, default=0)
+
+    def handle(self, *args, **options):
+        steps = [step.strip() for step in options["steps"].split(",") if step.strip()]
+        unknown = [step for step in steps if step not in STEPS]
+        if unknown:
+            raise CommandError(f"不明なステップです: {', '.join(unknown)}")
+        base_url = options["base_url"].rstrip("/")
+        try:
+            httpx.get(base_url + "/token/", timeout=5.0)
+        except httpx.HTTPError as e:
+            raise CommandError(f"{base_url} に接続できません: {e}")
+
+        results = _Results()
+        deadline = time.perf_counter() + options["seconds"]
+        fixed_birth = _birth_params(random.Random(options["seed"])) if options["same_birth"] else None
+
+        def worker(number: int):
+            rng = random.Random(options["seed"] * 100_003 + number)
+            with httpx.Client(base_url=base_url, timeout=options["timeout"]) as client:
+                while time.perf_counter() < deadline:
+                    started = time.perf_counter()
+                    self._flow(client, steps, fixed_birth or _birth_params(rng), options, results)
+                    results.add_flow(time.perf_counter() - started)
+
+        self.stdout.write(f"{base_url}: concurrency={options['concurrency']},"
+                          f" seconds={options['seconds']}, steps={' → '.join(steps)}")
+        threads = [threading.Thread(target=worker, args=(i,)) for i in range(options["concurrency"])]
+        began = time.perf_counter()
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        elapsed = time.perf_counter() - began
+        self._report(results, steps, elapsed)
+
+    def _flow(self, client: httpx.Client, steps: list, birth: dict, options: dict, results: _Results):
+        """1人分の操作を順に実行する。途中で失敗したら残りのステップは行わない。"""
+        token = ""
+        for step in steps:
+            if options["think"]:
+                time.sleep(options["think"])
+            if step == "index":
+                request = client.build_request("GET", "/")
+            elif step == "token":
+                request = client.build_request("GET", "/token/")
+            elif step == "horoscope_ai":
+                request = client.build_request("GET", "/horoscope/ai/", params={**birth, "token": token})
+            elif step == "analyze":
+                csrf = client.cookies.get("csrftoken", "")
+                request = client.build_request("POST", "/analyze/", data={**birth, "sb": options["sb"]},
+                                               headers={"X-CSRFToken": csrf})
+            else:
+                request = client.build_request("GET", "/horoscope/detail/", params=birth)
+
+            started = time.perf_counter()
+            try:
+                response = client.send(request)
+                response.read()
+                status = str(response.status_code)
+            except httpx.HTTPError as e:
+                response, status = None, type(e).__name__
+            results.add(step, time.perf_counter() - started, status)
+            if response is None or response.status_code >= 400:
+                return
+            if step == "token":
+                token = response.json().get("token", "")
+
+    def _report(self, results: _Results, steps: list, elapsed: float) -> None:
+        self.stdout.write(f"  完了した流れ: {results.flows} 件 ({results.flows / elapsed:.2f} 件/秒),"
+                          f" 1件あたり p50 {_percentile(results.flow_latencies, 0.5):.2f} 秒")
+        self.stdout.write(f"  {'ステップ':14s} {'件数':>7s} {'件/秒':>8s} {'p50':>9s} {'p90':>9s}"
+                          f" {'p99':>9s} {'max':>9s}  ステータス")
+        for step in steps:
+            latencies = results.latencies[step]
+            statuses = ", ".join(f"{status}: {count}"
+                                 for status, count in sorted(results.statuses[step].items()))
+            self.stdout.write(
+                f"  {step:14s} {len(latencies):7d} {len(latencies) / elapsed:8.2f}"
+                f" {_percentile(latencies, 0.5) * 1e3:7.1f}ms {_percentile(latencies, 0.9) * 1e3:7.1f}ms"
+                f" {_percentile(latencies, 0.99) * 1e3:7.1f}ms {max(latencies, default=0.0) * 1e3:7.1f}ms"
+                f"  {statuses}")
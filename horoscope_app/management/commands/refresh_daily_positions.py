@@ -0,0 +1,54 @@
+# horoscope_app/management/commands/refresh_daily_positions.py
+"""
+DailyPosition テーブル(今日の運勢用の天体位置)を作り直す。
+cron 等で1日1回実行する想定。
+
+使い方:
+    python manage.py refresh_daily_positions               # 昨日〜400日後
+    python manage.py refresh_daily_positions --days-after 30
+"""
+import datetime
+import time
+
+from django.core.management.base import BaseCommand
+
+from horoscope_app.daily_positions import compute_day
+from horoscope_app.models import DailyPosition
+
+
+class Command(BaseCommand):
+    help = "今日の運勢用の天体位置テーブル(DailyPosition)を生成し、範囲外の古い行を削除します。"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--days-before", type=int, default=1, help="今日より前に保持する日数")
+        parser.add_argument("--days-after", type=int, default=400, help="今日より後に生成する日数")
+        parser.add_argument("--all", action="store_true",
+                            help="既にある日も計算し直す（既定では無い日だけ追加する）")
+
+    def handle(self, *args, **options):
+        today = datetime.datetime.now(datetime.timezone.utc).date()
+        first = today - datetime.timedelta(days=options["days_before"])
+        last = today + datetime.timedelta(days=options["days_after"])
+
+        started = time.perf_counter()
+        deleted, _ = DailyPosition.objects.exclude(date__range=(first, last)).delete()
+
+        existing = set()
+        if not options["all"]:
+            existing = set(DailyPosition.objects.filter(date__range=(first, last))
+                           .values_list("date", flat=True))
+        rows = []
+        date = first
+        while date <= last:
+            if date not in existing:
+                rows.append(DailyPosition(date=date, positions=compute_day(date)))
+            date += datetime.timedelta(days=1)
+
+        DailyPosition.objects.bulk_create(
+            rows, batch_size=100,
+            update_conflicts=True, unique_fields=["date"], update_fields=["positions", "updated_at"],
+        )
+        self.stdout.write(
+            f"{first} 〜 {last}: {len(rows)} 日分を生成, {deleted} 行を削除"
+            f" ({time.perf_counter() - started:.1f} 秒)"
+        )
@@ -0,0 +1,81 @@
+# horoscope_app/management/commands/store_charts.py
+"""
+相性スコアの候補となるチャート (StoredChart) を登録する。
+
+入力は1行に1人分の JSON (出生データの項目と任意の "label")。
+    {"label": "A", "year": 1990, "month": 5, "day": 3, "hour": 14, "minute": 30, "prefecture": "Tokyo"}
+
+使い方:
+    python manage.py store_charts charts.jsonl
+    python manage.py store_charts - < charts.jsonl
+
+同じ出生データ (BirthInput.key が同じ) のチャートは登録済みなら読み飛ばす。
+チャートはトロピカル・既定のハウスシステムで計算する (それ以外を指定した行は入力エラー)。
+似たチャートの検索に反映するには、登録後に chart_index sync (または build) を実行する。
+"""
+import json
+import sys
+import time
+
+from django.core.exceptions import ValidationError
+from django.core.management.base import BaseCommand, CommandError
+
+from horoscope_app.models import StoredChart
+from horoscope_app.scoring import comparable_birth, stored_chart_fields
+from horoscope_app.utils import horoscope_for
+from horoscope_app.validation import parse_birth_inputs
+
+BATCH_SIZE = 1000
+
+
+class Command(BaseCommand):
+    help = "JSON Lines の出生データからチャートを計算し、相性スコアの候補として登録します。"
+
+    def add_arguments(self, parser):
+        parser.add_argument("path", help="入力ファイル (- で標準入力)")
+
+    def handle(self, *args, **options):
+        stream = sys.stdin if options["path"] == "-" else open(options["path"], encoding="utf-8")
+        started = time.perf_counter()
+        created = invalid = 0
+        try:
+            records = []
+            for line_no, line in enumerate(stream, 1):
+                if not line.strip():
+                    continue
+                try:
+                    records.append(json.loads(line))
+                except json.JSONDecodeError as e:
+                    raise CommandError(f"{line_no}行目: JSON として読めません ({e})")
+                if len(records) >= BATCH_SIZE:
+                    batch_created, batch_invalid = self._store(records)
+                    created += batch_created
+                    invalid += batch_invalid
+                    records = []
+            batch_created, batch_invalid = self._store(records)
+            created += batch_created
+            invalid += batch_invalid
+        finally:
+            if stream is not sys.stdin:
+                stream.close()
+        self.stdout.write(f"{created} 件を登録, {invalid} 件は入力エラー"
+                          f" ({time.perf_counter() - started:.1f} 秒)")
+
+    def _store(self, records: list) -> tuple[int, int]:
+        rows = []
+        invalid = 0
+        for record, birth in zip(records, parse_birth_inputs(records)):
+            if not isinstance(birth, dict):
+                try:
+                    birth = comparable_birth(birth)
+                except ValidationError as e:
+                    birth = e.message_dict
+            if isinstance(birth, dict):
+                invalid += 1
+                self.stderr.write(f"入力エラー: {record} {birth}")
+                continue
+            fields = stored_chart_fields(birth, horoscope_for(birth, birth.unknown))
+            rows.append(StoredChart(label=str(record.get("label") or "")[:64], **fields))
+        before = StoredChart.objects.count()
+        StoredChart.objects.bulk_create(rows, batch_size=BATCH_SIZE, ignore_conflicts=True)
+        return StoredChart.objects.count() - before, invalid
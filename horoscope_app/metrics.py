@@ -0,0 +1,29 @@
+# horoscope_app/metrics.py
+"""
+プロセス内の簡易メトリクス(カウンタ)。
+
+gunicorn のワーカーごとに独立した値になるため、
+集計したい場合は各ワーカーの /metrics/ を合算してください。
+"""
+import threading
+
+_lock = threading.Lock()
+_counters: dict[str, int] = {}
+
+
+def incr(name: str, amount: int = 1) -> None:
+    """カウンタ name を amount だけ増やす。"""
+    with _lock:
+        _counters[name] = _counters.get(name, 0) + amount
+
+
+def snapshot() -> dict[str, int]:
+    """現在のカウンタ値のコピーを返す。"""
+    with _lock:
+        return dict(sorted(_counters.items()))
+
+
+def reset() -> None:
+    """全カウンタを 0 に戻す（ベンチマーク・動作確認用）。"""
+    with _lock:
+        _counters.clear()
@@ -0,0 +1,28 @@
+# Generated by Django 5.1.5 on 2026-10-19 17:41
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('horoscope_app', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='StoredChart',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('label', models.CharField(blank=True, max_length=64)),
+                ('key', models.CharField(max_length=32, unique=True)),
+                ('birth', models.JSONField()),
+                ('longitudes', models.JSONField()),
+                ('cusps', models.JSONField(blank=True, null=True)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+            ],
+            options={
+                'ordering': ['id'],
+            },
+        ),
+    ]
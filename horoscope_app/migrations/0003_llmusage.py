@@ -0,0 +1,33 @@
+# Generated by Django 5.1.5 on 2026-10-19 17:58
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('horoscope_app', '0002_storedchart'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='LLMUsage',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('created_at', models.DateTimeField()),
+                ('day', models.DateField(db_index=True)),
+                ('endpoint', models.CharField(max_length=32)),
+                ('sb', models.IntegerField(blank=True, null=True)),
+                ('model', models.CharField(max_length=64)),
+                ('source', models.CharField(max_length=16)),
+                ('prompt_tokens', models.IntegerField(default=0)),
+                ('completion_tokens', models.IntegerField(default=0)),
+                ('estimated_prompt_tokens', models.IntegerField(default=0)),
+                ('trimmed', models.BooleanField(default=False)),
+                ('latency_ms', models.IntegerField(blank=True, null=True)),
+            ],
+            options={
+                'ordering': ['id'],
+            },
+        ),
+    ]
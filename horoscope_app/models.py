@@ -1,3 +1,67 @@
 from django.db import models
 
 # Create your models here.
+
+
+class DailyPosition(models.Model):
+    """
+    1日(UTC)分の天体位置。毎時0分〜翌日0時の25点を保持し、任意の時刻は線形補間で求める。
+    refresh_daily_positions コマンドで昨日〜400日後の範囲を生成する。
+    """
+    date = models.DateField(unique=True)
+    # {"Sun": [[経度, 速度], ... 25点], "Moon": [...], ...}
+    positions = models.JSONField()
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        ordering = ["date"]
+
+    def __str__(self):
+        return f"DailyPosition({self.date})"
+
+
+class StoredChart(models.Model):
+    """
+    相性スコアの候補として保存したチャート。
+    スコア計算に必要な天体の経度とハウスカスプだけを持ち、scoring.CandidatePool が行列にして使う。
+    """
+    label = models.CharField(max_length=64, blank=True)
+    key = models.CharField(max_length=32, unique=True)   # BirthInput.key
+    birth = models.JSONField()                           # 正規化した出生データ
+    # [太陽, 月, ..., 冥王星] の黄経 (scoring.SCORE_BODIES の並び)
+    longitudes = models.JSONField()
+    # 12ハウスのカスプ。出生時刻不明の場合は null
+    cusps = models.JSONField(null=True, blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        ordering = ["id"]
+
+    def __str__(self):
+        return f"StoredChart({self.label or self.key})"
+
+
+class LLMUsage(models.Model):
+    """
+    OpenAI 呼び出し1回分の使用量。usage.record でメモリに溜め、まとめて bulk_create する。
+    占いモード(sb)・日付ごとの集計は usage.report で行う。
+    """
+    created_at = models.DateTimeField()
+    day = models.DateField(db_index=True)                # created_at の日付 (集計用)
+    endpoint = models.CharField(max_length=32)           # "analyze" / "analyze_compatibility"
+    sb = models.IntegerField(null=True, blank=True)
+    model = models.CharField(max_length=64)
+    # "llm" (回答を使った) / "discarded" (ヘッジ・タイムアウトで使わなかった回答)
+    # / "cache" / "template" (縮退) / "rejected" (プロンプトが大きすぎる)
+    source = models.CharField(max_length=16)
+    prompt_tokens = models.IntegerField(default=0)
+    completion_tokens = models.IntegerField(default=0)
+    estimated_prompt_tokens = models.IntegerField(default=0)  # 送信前の見積もり (usage.estimate_tokens)
+    trimmed = models.BooleanField(default=False)         # 見積もりが上限を超えたためプロンプトを縮めた
+    latency_ms = models.IntegerField(null=True, blank=True)
+
+    class Meta:
+        ordering = ["id"]
+
+    def __str__(self):
+        return f"LLMUsage({self.day} {self.endpoint} sb={self.sb} {self.source})"
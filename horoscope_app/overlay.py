@@ -0,0 +1,210 @@
+# horoscope_app/overlay.py
+"""
+トランジット天体と出生チャートの重ね合わせ (トランジット天体が入る出生のハウスと、出生天体へのアスペクト)。
+
+- 出生チャートからは一度だけ黄経の「境目」の表を作る (NatalOverlay)。境目は出生のハウスカスプと、
+  出生天体それぞれに対するアスペクトのオーブの端 (出生天体 ± アスペクトの角度 ± オーブ)。
+  隣り合う境目の間ではトランジット天体のハウスとアスペクトの組み合わせが変わらないため、
+  区間ごとの状態も前もって求めておく
+- 時系列では天体ごとに今いる区間を覚えておき、区間を出たときだけ状態を引き直す (bisect)。
+  動きの遅い天体はほとんどの時刻で区間を出ないため、比較2回で済む
+- 結果は時刻ごとの一覧ではなく、アスペクトとハウスの「期間」(始まり・終わり・最も近づいた時刻) の一覧にする。
+  逆行で同じアスペクトを何度か通る場合は期間が分かれる
+- トランジットの位置は daily_positions.positions_series から取る (テーブルがあれば swisseph を呼ばない)
+"""
+import datetime
+from bisect import bisect_right
+from functools import lru_cache
+from zoneinfo import ZoneInfo
+
+import swisseph as swe
+
+from .daily_positions import BODIES, positions_series
+from .timezones import JAPAN_ZONE
+from .utils import ASPECTS, ayanamsa_offset, get_house, horoscope_for
+
+# トランジットのアスペクトのオーブ (度)。出生チャート内のアスペクト (utils.aspect_orbs) より狭くする
+TRANSIT_ORBS = {
+    "コンジャンクション": 3.0,
+    "オポジション": 3.0,
+    "トライン": 2.0,
+    "スクエア": 2.0,
+    "セクスタイル": 1.5,
+}
+# 月は1日に約13°動くため、間隔がこれより長い時系列には含めない (アスペクトの期間を取りこぼす)
+MOON_MAX_STEP_HOURS = 2
+ANGLES = ("アセンダント", "ミッドヘヴェン")
+# 1年単位の運勢で扱う動きの遅い天体 (速い天体の期間は数日で、1年分だと数百件になる)
+SLOW_BODIES = ("木星", "土星", "天王星", "海王星", "冥王星", "ドラゴンヘッド")
+
+
+class NatalOverlay:
+    """出生チャートの天体・ハウスカスプから作った、トランジットの黄経 → (ハウス, アスペクト) の表。"""
+
+    def __init__(self, points: dict[str, float], cusps: list[float] | None, orbs: dict = TRANSIT_ORBS):
+        """
+        :param points: 出生天体の {名前: 黄経}
+        :param cusps: 出生のハウスカスプ (12個)。出生時刻不明なら None (ハウスを求めない)
+        """
+        self.points = points
+        self.cusps = cusps
+        self._aspects = tuple((name, float(ASPECTS[name]), float(orb)) for name, orb in orbs.items())
+        edges = set(cusps or ())
+        for degree in points.values():
+            for _, angle, orb in self._aspects:
+                for center in (degree + angle, degree - angle):
+                    edges.add((center - orb) % 360.0)
+                    edges.add((center + orb) % 360.0)
+        self.boundaries = sorted(edges)
+        n = len(self.boundaries)
+        self.states = tuple(self.state_at((self.boundaries[i] + self._width(i) / 2) % 360.0) for i in range(n))
+
+    def _width(self, index: int) -> float:
+        n = len(self.boundaries)
+        return (self.boundaries[(index + 1) % n] - self.boundaries[index]) % 360.0 or 360.0
+
+    def state_at(self, longitude: float) -> tuple:
+        """黄経 longitude のトランジット天体の (ハウス or None, ((出生天体, アスペクト), ...))。"""
+        house = get_house(longitude, self.cusps) if self.cusps else None
+        aspects = []
+        for point, degree in self.points.items():
+            for name, angle, orb in self._aspects:
+                if abs(_separation(longitude, degree) - angle) <= orb:
+                    aspects.append((point, name))
+        return house, tuple(aspects)
+
+    def locate(self, longitude: float) -> int:
+        """longitude を含む区間の番号 (最後の区間は 360° をまたいで最初の境目まで)。"""
+        return (bisect_right(self.boundaries, longitude) - 1) % len(self.boundaries)
+
+    def contains(self, index: int, longitude: float) -> bool:
+        return (longitude - self.boundaries[index]) % 360.0 < self._width(index)
+
+    def orb(self, longitude: float, point: str, aspect: str) -> float:
+        """アスペクトの正確な角度からのずれ (度)。"""
+        return abs(_separation(longitude, self.points[point]) - ASPECTS[aspect])
+
+
+def _separation(a: float, b: float) -> float:
+    angle = abs(a - b) % 360.0
+    return 360.0 - angle if angle > 180.0 else angle
+
+
+@lru_cache(maxsize=512)
+def natal_overlay(birth, time_unknown: bool = False) -> NatalOverlay:
+    """BirthInput の出生チャートから NatalOverlay を作る (同じ入力は作り直さない)。"""
+    result = horoscope_for(birth, time_unknown)
+    points = {name: info["degree"] for name, info in result["analysis"]["1.天体の配置"].items()
+              if not (time_unknown and name in ANGLES)}
+    cusps = None if time_unknown else list(result["raw_data"]["houses"]["cusp"])
+    return NatalOverlay(points, cusps)
+
+
+def instants(start: datetime.date, days: int, step_hours: int, tzid: str = "") -> list[datetime.datetime]:
+    """
+    start から days 日分の時刻を step_hours 時間おきに返す (出生地のタイムゾーン)。
+    24時間おきの場合は毎日の正午 (「今日の運勢」と同じ)。
+    """
+    zone = ZoneInfo(tzid or JAPAN_ZONE)
+    first = datetime.datetime.combine(start, datetime.time(12 if step_hours >= 24 else 0), tzinfo=zone)
+    count = days * 24 // step_hours
+    # 夏時間の切り替えをまたいでも現地時刻で等間隔にする
+    return [first + datetime.timedelta(hours=step_hours * i) for i in range(count)]
+
+
+def timeline(birth, moments: list[datetime.datetime], time_unknown: bool = False, step_hours: int = 24) -> dict:
+    """
+    moments の各時刻のトランジットを出生チャートに重ね、ハウスとアスペクトの期間の一覧を返す。
+
+    :return: {"houses": [{"transit", "house", "start", "end"}],
+              "aspects": [{"transit", "natal", "aspect", "start", "end", "exact", "orb"}],
+              "steps", "relocated"}
+              end は最後に該当した時刻 (最後の時刻まで続いている場合はその時刻)。
+              relocated は天体が区間を出て状態を引き直した回数
+    """
+    natal = natal_overlay(birth, time_unknown)
+    bodies = [(name, name_ja) for name, name_ja, _ in BODIES
+              if name_ja != "月" or step_hours <= MOON_MAX_STEP_HOURS]
+    located: dict[str, int] = {}
+    open_houses: dict[str, dict] = {}
+    open_aspects: dict[str, dict[tuple, dict]] = {name_ja: {} for _, name_ja in bodies}
+    houses, aspects = [], []
+    relocated = 0
+
+    for moment, positions in zip(moments, positions_series(moments)):
+        offset = 0.0
+        if birth.ayanamsa:
+            utc = moment.astimezone(datetime.timezone.utc)
+            offset = ayanamsa_offset(swe.julday(utc.year, utc.month, utc.day,
+                                                utc.hour + utc.minute / 60.0, swe.GREG_CAL), birth.ayanamsa)
+        for name, name_ja in bodies:
+            longitude = (positions[name][0] - offset) % 360.0
+            index = located.get(name_ja)
+            if index is None or not natal.contains(index, longitude):
+                relocated += 1
+                new_index = natal.locate(longitude)
+                _update(natal.states[new_index], natal.states[index] if index is not None else (None, ()),
+                        name_ja, moment, open_houses, open_aspects[name_ja], houses, aspects)
+                located[name_ja] = index = new_index
+            # 続いているアスペクトは最も近づいた時刻を更新する (区間が変わらなくても角度は動く)
+            for (point, aspect), record in open_aspects[name_ja].items():
+                orb = natal.orb(longitude, point, aspect)
+                if orb < record["orb"]:
+                    record["orb"], record["exact"] = orb, moment
+                record["end"] = moment
+            if name_ja in open_houses:
+                open_houses[name_ja]["end"] = moment
+
+    for record in aspects:
+        record["orb"] = round(record["orb"], 2)
+    houses.sort(key=lambda record: (record["start"], record["transit"]))
+    aspects.sort(key=lambda record: (record["start"], record["transit"]))
+    return {"houses": houses, "aspects": aspects, "steps": len(moments), "relocated": relocated}
+
+
+def _update(state: tuple, previous: tuple, body: str, moment: datetime.datetime, open_houses: dict,
+            open_aspects: dict, houses: list, aspects: list) -> None:
+    """区間が変わった天体の、終わった期間を閉じて新しい期間を始める。"""
+    house, active = state
+    if house != previous[0]:
+        open_houses.pop(body, None)
+        if house is not None:
+            open_houses[body] = {"transit": body, "house": house, "start": moment, "end": moment}
+            houses.append(open_houses[body])
+    for key in set(open_aspects) - set(active):
+        del open_aspects[key]
+    for point, aspect in active:
+        if (point, aspect) not in open_aspects:
+            record = {"transit": body, "natal": point, "aspect": aspect, "start": moment, "end": moment,
+                      "exact": moment, "orb": float("inf")}
+            open_aspects[(point, aspect)] = record
+            aspects.append(record)
+
+
+def between(result: dict, start: datetime.date, end: datetime.date) -> dict:
+    """timeline の結果のうち start〜end (日付) に重なる期間だけを返す。"""
+    def overlaps(record):
+        return record["start"].date() <= end and record["end"].date() >= start
+
+    return {**result, "houses": [r for r in result["houses"] if overlaps(r)],
+            "aspects": [r for r in result["aspects"] if overlaps(r)]}
+
+
+def describe(result: dict, bodies: tuple = ()) -> str:
+    """
+    timeline の結果をプロンプトに入れる文章にする (1期間1行)。
+
+    :param bodies: 指定するとこのトランジット天体の期間だけにする
+    """
+    def period(record):
+        start, end = record["start"].date(), record["end"].date()
+        return f"{start:%m/%d}" if start == end else f"{start:%m/%d}〜{end:%m/%d}"
+
+    def selected(records):
+        return [r for r in records if not bodies or r["transit"] in bodies]
+
+    lines = [f"トランジットの{r['transit']}が出生の{r['house']}ハウスにある: {period(r)}"
+             for r in selected(result["houses"])]
+    lines += [f"トランジットの{r['transit']}が出生の{r['natal']}と{r['aspect']}: {period(r)}"
+              f" (最も近づくのは {r['exact']:%m/%d}、オーブ {r['orb']}°)" for r in selected(result["aspects"])]
+    return "\n".join(lines)
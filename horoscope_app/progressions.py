@@ -0,0 +1,153 @@
+# horoscope_app/progressions.py
+"""
+予測技法: 二次進行(セカンダリー・プログレッション)とソーラー/ルナー・リターン。
+
+- 出生チャートは horoscope_for のキャッシュを使い、出生時の JD と太陽・月の経度だけを取り出す
+- リターンの瞬間は「太陽(月)の経度 = 出生時の経度」となる時刻を
+  ニュートン法(経度の差 / 日速度)で求める。通常2〜3回の swe.calc_ut で収束する
+- 複数年分のリターンは前回の解に平均周期を足したものを次の初期値にしてまとめて求める
+- チャートが必要な場合は求めた瞬間(UT)で compute_horoscope を呼ぶ。
+  iter_* は1件ずつ計算して返すため、ビューはチャートを計算しながらレスポンスを送り始められる
+- サイデリアル指定の出生データでは、リターンもサイデリアルの黄経で求める
+"""
+import datetime
+from functools import lru_cache
+from zoneinfo import ZoneInfo
+
+import swisseph as swe
+
+from .utils import compute_horoscope, horoscope_for, zodiac_flags
+
+TROPICAL_YEAR = 365.24219        # 太陽が同じ黄経に戻る平均日数
+SIDEREAL_MONTH = 27.321661       # 月が同じ黄経に戻る平均日数
+NEWTON_TOLERANCE = 1e-7          # 度（約0.01秒角。時刻にして太陽で約0.01秒）
+NEWTON_MAX_ITER = 8
+
+_FLAGS = swe.FLG_SWIEPH | swe.FLG_SPEED
+_UTC = datetime.timezone.utc
+
+
+@lru_cache(maxsize=2048)
+def natal_base(birth) -> tuple[float, float, float]:
+    """出生時の (JD(UT), 太陽の黄経, 月の黄経) を返す。"""
+    raw = horoscope_for(birth)["raw_data"]
+    return (raw["jd_ut"],
+            raw["planets"]["Sun"]["longitude"][0] % 360,
+            raw["planets"]["Moon"]["longitude"][0] % 360)
+
+
+def _find_longitude(body: int, target: float, jd: float, extra_flags: int = 0) -> float:
+    """初期値 jd の近くで body の黄経が target になる JD(UT) をニュートン法で求める。"""
+    for _ in range(NEWTON_MAX_ITER):
+        values = swe.calc_ut(jd, body, _FLAGS | extra_flags)[0]
+        diff = (values[0] - target + 180.0) % 360.0 - 180.0
+        jd -= diff / values[3]
+        if abs(diff) < NEWTON_TOLERANCE:
+            break
+    return jd
+
+
+def jd_to_datetime(jd: float, tzid: str = "") -> datetime.datetime:
+    """JD(UT) を(秒単位に丸めた)日時に変換する。tzid を指定すると現地時刻にする。"""
+    year, month, day, hours = swe.revjul(jd, swe.GREG_CAL)
+    moment = (datetime.datetime(year, month, day, tzinfo=_UTC)
+              + datetime.timedelta(seconds=round(hours * 3600)))
+    if tzid:
+        moment = moment.astimezone(ZoneInfo(tzid))
+    return moment
+
+
+def _chart_at(birth, jd: float) -> dict:
+    """
+    JD(UT) の瞬間の、出生地でのチャートの解析結果を返す (出生チャートと同じ天体・座標系)。
+
+    compute_horoscope は分単位のため最も近い分に丸める。「9.生年月日と出生地」の日時が
+    現地時刻になるよう、出生地のタイムゾーン (分からなければ出生時の tz/dst) の時刻で渡す。
+    """
+    moment = (jd_to_datetime(jd) + datetime.timedelta(seconds=30)).replace(second=0)
+    if birth.tzid:
+        moment = moment.astimezone(ZoneInfo(birth.tzid))
+        dst = moment.dst().total_seconds() / 3600
+        tz = moment.utcoffset().total_seconds() / 3600 - dst
+    else:
+        tz, dst = birth.tz, birth.dst
+        moment += datetime.timedelta(hours=tz + dst)
+    return compute_horoscope(moment.year, moment.month, moment.day, moment.hour, moment.minute,
+                             birth.lat, birth.lon, tz, dst, birth.prefecture, bodies=birth.bodies,
+                             ayanamsa=birth.ayanamsa, house_system=birth.house_system,
+                             frames=birth.frames)["analysis"]
+
+
+def _return_entry(birth, jd: float, with_chart: bool, **extra) -> dict:
+    entry = dict(extra)
+    entry["jd_ut"] = round(jd, 6)
+    entry["utc"] = jd_to_datetime(jd).isoformat()
+    if birth.tzid:
+        entry["local"] = jd_to_datetime(jd, birth.tzid).isoformat()
+    if with_chart:
+        entry["chart"] = _chart_at(birth, jd)
+    return entry
+
+
+def iter_solar_returns(birth, first_year: int, last_year: int, with_chart: bool = False):
+    """
+    first_year〜last_year 年のソーラー・リターン(太陽が出生時の黄経に戻る瞬間)を1年ずつ返す。
+
+    :return: {"year", "jd_ut", "utc", "local"(出生地のタイムゾーンが分かる場合), "chart"(任意)} のイテレーター
+    """
+    birth_jd, natal_sun, _ = natal_base(birth)
+    jd = birth_jd + (first_year - birth.year) * TROPICAL_YEAR
+    for year in range(first_year, last_year + 1):
+        with zodiac_flags(birth.ayanamsa) as flags:
+            jd = _find_longitude(swe.SUN, natal_sun, jd, flags)
+        yield _return_entry(birth, jd, with_chart, year=year)
+        jd += TROPICAL_YEAR
+
+
+def solar_returns(birth, first_year: int, last_year: int, with_chart: bool = False) -> list[dict]:
+    """iter_solar_returns の結果をリストで返す。"""
+    return list(iter_solar_returns(birth, first_year, last_year, with_chart))
+
+
+def iter_lunar_returns(birth, start: datetime.date, count: int, with_chart: bool = False):
+    """start 以降の count 回分のルナー・リターン(月が出生時の黄経に戻る瞬間)を1回ずつ返す。"""
+    birth_jd, _, natal_moon = natal_base(birth)
+    start_jd = swe.julday(start.year, start.month, start.day, 0.0, swe.GREG_CAL)
+    # start 直前の回を初期値にする
+    cycles = max(0, int((start_jd - birth_jd) / SIDEREAL_MONTH))
+    with zodiac_flags(birth.ayanamsa) as flags:
+        jd = _find_longitude(swe.MOON, natal_moon, birth_jd + cycles * SIDEREAL_MONTH, flags)
+        while jd < start_jd:
+            jd = _find_longitude(swe.MOON, natal_moon, jd + SIDEREAL_MONTH, flags)
+        moments = [jd]
+        for _ in range(count - 1):
+            moments.append(_find_longitude(swe.MOON, natal_moon, moments[-1] + SIDEREAL_MONTH, flags))
+    # チャートの計算はロックの外で1件ずつ行う
+    for jd in moments[:count]:
+        yield _return_entry(birth, jd, with_chart)
+
+
+def lunar_returns(birth, start: datetime.date, count: int, with_chart: bool = False) -> list[dict]:
+    """iter_lunar_returns の結果をリストで返す。"""
+    return list(iter_lunar_returns(birth, start, count, with_chart))
+
+
+def progressed_jd(birth, on: datetime.date) -> float:
+    """二次進行(1日=1年)で、on の日付に対応する進行チャートの JD(UT) を返す。"""
+    birth_jd, _, _ = natal_base(birth)
+    target_jd = swe.julday(on.year, on.month, on.day, 12.0, swe.GREG_CAL)
+    return birth_jd + (target_jd - birth_jd) / TROPICAL_YEAR
+
+
+def secondary_progression(birth, on: datetime.date) -> dict:
+    """
+    on の日付の進行チャートを返す。
+
+    :return: {"date", "progressed_utc", "chart"(compute_horoscope の analysis)}
+    """
+    jd = progressed_jd(birth, on)
+    return {
+        "date": on.isoformat(),
+        "progressed_utc": jd_to_datetime(jd).isoformat(),
+        "chart": _chart_at(birth, jd),
+    }
@@ -0,0 +1,207 @@
+# horoscope_app/ratelimit.py
+"""
+AIエンドポイント(/analyze/ など)向けのレート制限とリクエスト合流(coalescing)。
+
+- IPごと / 全体 の2段のトークンバケットで OpenAI への流量を制限する
+- 同一内容のリクエストが同時に来た場合は、先頭の1件だけを実行し、
+  後続はその結果を待って同じレスポンスを受け取る
+- 制限を超えた場合は 429 と Retry-After ヘッダーを返す
+
+バケットの状態は Django キャッシュ (settings.CACHES) に保存する。
+LocMemCache の場合はワーカープロセス単位、Redis/Memcached 等の共有キャッシュ
+を設定すれば全ワーカー共通の制限になる。
+
+制限事項:
+- バケットの読み出しと書き込みはプロセス内ではロックで1つにまとめるが、共有キャッシュでも
+  ワーカー間では不可分ではない。同時に来たリクエストが同じトークンを使うことがあり、
+  制限は最大でワーカー数の分だけ緩くなる (厳密な上限ではなく流量の目安として使う)
+- 合流はプロセス内 (threading.Event) でのみ行う。procfile の gunicorn のように
+  1ワーカー1スレッド (sync) で動かす場合は同時に処理中のリクエストが1件しかないため合流は起きない。
+  合流させるには --threads を指定してスレッドで並行に処理する
+"""
+import hashlib
+import math
+import threading
+import time
+from functools import wraps
+
+from django.conf import settings
+from django.core.cache import caches
+from django.http import HttpResponse, JsonResponse
+
+from . import metrics
+
+# 合流キーの計算から除外するパラメータ（リクエストごとに異なるが結果に影響しない）
+COALESCE_IGNORED_PARAMS = {"csrfmiddlewaretoken"}
+
+_bucket_lock = threading.Lock()
+_inflight_lock = threading.Lock()
+_inflight: dict[str, "_InFlight"] = {}
+
+
+def _setting(name: str, default):
+    return getattr(settings, name, default)
+
+
+def _cache():
+    return caches[_setting("RATELIMIT_CACHE_ALIAS", "default")]
+
+
+def get_client_ip(request) -> str:
+    """
+    クライアントIPを返す。
+
+    RATELIMIT_TRUST_X_FORWARDED_FOR が有効な場合は X-Forwarded-For の右から
+    RATELIMIT_PROXY_HOPS 番目 (自分のプロキシが付け加えた値) を使う。
+    左側の値はクライアントが自由に書けるため使わない。
+    """
+    if _setting("RATELIMIT_TRUST_X_FORWARDED_FOR", False):
+        forwarded = [entry.strip() for entry in request.META.get("HTTP_X_FORWARDED_FOR", "").split(",")
+                     if entry.strip()]
+        hops = max(1, _setting("RATELIMIT_PROXY_HOPS", 1))
+        if len(forwarded) >= hops:
+            return forwarded[-hops]
+    return request.META.get("REMOTE_ADDR", "") or "unknown"
+
+
+def take_token(bucket: str, rate: float, burst: int) -> tuple[bool, float]:
+    """
+    トークンバケット bucket から1トークン取得を試みる。
+
+    :param rate: 1秒あたりの補充トークン数
+    :param burst: バケットの容量
+    :return: (取得できたか, 取得できなかった場合に次のトークンまでの秒数)
+    """
+    cache = _cache()
+    key = f"ratelimit:{bucket}"
+    now = time.time()
+    timeout = int(burst / rate) + 60
+    with _bucket_lock:
+        tokens, last = cache.get(key, (float(burst), now))
+        tokens = min(float(burst), tokens + max(0.0, now - last) * rate)
+        if tokens >= 1.0:
+            cache.set(key, (tokens - 1.0, now), timeout=timeout)
+            return True, 0.0
+        cache.set(key, (tokens, now), timeout=timeout)
+        return False, (1.0 - tokens) / rate
+
+
+def refund_token(bucket: str, rate: float, burst: int) -> None:
+    """take_token で取得したトークンを1つ戻す（後段の制限で弾かれた場合）。"""
+    cache = _cache()
+    key = f"ratelimit:{bucket}"
+    with _bucket_lock:
+        state = cache.get(key)
+        if state is not None:
+            tokens, last = state
+            cache.set(key, (min(float(burst), tokens + 1.0), last),
+                      timeout=int(burst / rate) + 60)
+
+
+def too_many_requests(retry_after: float) -> JsonResponse:
+    """429 レスポンスを生成する。"""
+    seconds = max(1, math.ceil(retry_after))
+    response = JsonResponse(
+        {"error": "リクエストが集中しています。しばらく待ってから再度お試しください。",
+         "retry_after": seconds},
+        status=429,
+    )
+    response["Retry-After"] = str(seconds)
+    return response
+
+
+def coalesce_key(request) -> str:
+    """リクエストのパスとパラメータから合流キーを作る。"""
+    params = request.POST if request.method == "POST" else request.GET
+    items = sorted(
+        (k, tuple(params.getlist(k)))
+        for k in params.keys()
+        if k not in COALESCE_IGNORED_PARAMS
+    )
+    raw = repr((request.path, items)).encode("utf-8")
+    return hashlib.sha256(raw).hexdigest()
+
+
+class _InFlight:
+    """実行中のリクエスト1件分。後続リクエストは event を待つ。"""
+    __slots__ = ("event", "status", "content", "content_type", "retry_after")
+
+    def __init__(self):
+        self.event = threading.Event()
+        self.status = None
+        self.content = None
+        self.content_type = None
+        self.retry_after = None
+
+
+def _copy_response(call: _InFlight) -> HttpResponse:
+    # レスポンスオブジェクトはミドルウェアがヘッダーを書き換えるため共有しない
+    response = HttpResponse(call.content, status=call.status, content_type=call.content_type)
+    if call.retry_after:
+        response["Retry-After"] = call.retry_after
+    return response
+
+
+def throttle_and_coalesce(scope: str):
+    """
+    ビューに IP/全体のレート制限と同一リクエストの合流を適用するデコレータ。
+
+    - IPごとのバケットは合流した後続リクエストにも適用する
+    - 全体のバケットは実際に処理を行う先頭リクエストのみ消費する
+    """
+    def decorator(view_func):
+        @wraps(view_func)
+        def _wrapped(request, *args, **kwargs):
+            if request.method != "POST" or not _setting("RATELIMIT_ENABLED", True):
+                return view_func(request, *args, **kwargs)
+
+            ip_rate = _setting("RATELIMIT_IP_RATE", 0.2)
+            ip_burst = _setting("RATELIMIT_IP_BURST", 5)
+            global_rate = _setting("RATELIMIT_GLOBAL_RATE", 2.0)
+            global_burst = _setting("RATELIMIT_GLOBAL_BURST", 20)
+            wait_timeout = _setting("RATELIMIT_COALESCE_TIMEOUT", 200)
+
+            ip_bucket = f"{scope}:ip:{get_client_ip(request)}"
+            ok, retry_after = take_token(ip_bucket, ip_rate, ip_burst)
+            if not ok:
+                metrics.incr(f"ratelimit.{scope}.rejected_ip")
+                return too_many_requests(retry_after)
+
+            key = f"{scope}:{coalesce_key(request)}"
+            with _inflight_lock:
+                call = _inflight.get(key)
+                leader = call is None
+                if leader:
+                    call = _InFlight()
+                    _inflight[key] = call
+
+            if not leader:
+                metrics.incr(f"ratelimit.{scope}.coalesced")
+                if call.event.wait(wait_timeout) and call.content is not None:
+                    return _copy_response(call)
+                # 先頭リクエストが失敗・タイムアウトした場合は自分で処理する
+                metrics.incr(f"ratelimit.{scope}.coalesce_fallback")
+                return view_func(request, *args, **kwargs)
+
+            try:
+                ok, retry_after = take_token(f"{scope}:global", global_rate, global_burst)
+                if not ok:
+                    refund_token(ip_bucket, ip_rate, ip_burst)
+                    metrics.incr(f"ratelimit.{scope}.rejected_global")
+                    response = too_many_requests(retry_after)
+                else:
+                    metrics.incr(f"ratelimit.{scope}.allowed")
+                    response = view_func(request, *args, **kwargs)
+                if not getattr(response, "streaming", False):
+                    call.status = response.status_code
+                    call.content = response.content
+                    call.content_type = response.get("Content-Type")
+                    call.retry_after = response.get("Retry-After")
+                return response
+            finally:
+                with _inflight_lock:
+                    _inflight.pop(key, None)
+                call.event.set()
+
+        return _wrapped
+    return decorator
@@ -0,0 +1,75 @@
+# horoscope_app/routing.py
+"""
+占いモード(sb)ごとの OpenAI の呼び出し方 (モデル・出力トークンの上限・プロンプトに入れるチャートの項目・分割数)。
+
+settings.LLM_ROUTES[sb] に指定した項目が settings.LLM_ROUTE_DEFAULT より優先される
+(環境変数 LLM_ROUTES に JSON で書けばコードを変えずに切り替えられる)。
+
+    model                  使うモデル (None なら settings.OPENAI_MODEL)
+    max_completion_tokens  出力トークンの上限 (None なら指定しない)
+    reasoning_effort       推論の量 ("low" / "medium" / "high"。None なら指定しない)
+    sections               プロンプトに入れるチャートの項目 (番号 "1" か項目名。空ならすべて)。
+                           チャートに無い項目 (出生時刻不明のハウスなど) は入れない
+    parts                  1年の運勢を何期間に分けて並列に生成するか (1 なら分けない)
+
+400字程度の短い鑑定はチャートの一部と少ない推論で足り、1年分の長い鑑定は
+全体の流れと期間ごとの運勢を同時に生成してつなげることで待ち時間を短くする (llm.complete_parts)。
+"""
+from dataclasses import dataclass
+
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured, ValidationError
+
+from .validation import parse_fields
+
+# compute_horoscope の analysis の項目 (出生時刻不明のチャートは 2, 3, 8 が無く 10 がある)
+CHART_SECTIONS = ("1.天体の配置", "2.惑星のハウス", "3.ハウスの支配星", "4.アスペクトの結果", "5.天体の四区分",
+                  "6.天体の三区分", "7.天体の二区分", "8.ハウスカスプ", "9.生年月日と出生地", "10.出生日の月の範囲")
+
+
+@dataclass(frozen=True)
+class Route:
+    model: str | None = None
+    max_completion_tokens: int | None = None
+    reasoning_effort: str | None = None
+    sections: tuple = ()
+    parts: int = 1
+
+    def options(self) -> dict:
+        """llm.complete に渡す追加の引数 (None の項目は渡さない)。"""
+        options = {"model": self.model, "max_completion_tokens": self.max_completion_tokens,
+                   "reasoning_effort": self.reasoning_effort}
+        return {name: value for name, value in options.items() if value is not None}
+
+
+def select_sections(analysis: dict, sections: tuple) -> dict:
+    """analysis のうち sections (項目名。route_for で変換済み) の項目だけを返す。sections が空ならそのまま。"""
+    if not sections:
+        return analysis
+    return {key: analysis[key] for key in sections if key in analysis}
+
+
+def route_for(sb: int) -> Route:
+    """占いモード(sb)の呼び出し方を返す。sections は CHART_SECTIONS の項目名にする。"""
+    config = {**getattr(settings, "LLM_ROUTE_DEFAULT", {}), **getattr(settings, "LLM_ROUTES", {}).get(sb, {})}
+    unknown = set(config) - set(Route.__dataclass_fields__)
+    if unknown:
+        raise ImproperlyConfigured(f"LLM_ROUTES[{sb}] に不明な項目があります: {', '.join(sorted(unknown))}")
+    try:
+        config["sections"] = parse_fields({"fields": [str(section) for section in config.get("sections") or ()]},
+                                          CHART_SECTIONS)
+    except ValidationError as ve:
+        raise ImproperlyConfigured(f"LLM_ROUTES[{sb}] の sections が正しくありません: {ve.messages[0]}")
+    config["parts"] = max(1, min(12, int(config.get("parts") or 1)))
+    return Route(**config)
+
+
+def check_routes() -> None:
+    """設定されたすべての占いモードの LLM_ROUTES を確認する (起動時に AppConfig.ready から呼ぶ)。"""
+    for sb in getattr(settings, "LLM_ROUTES", {}):
+        route_for(sb)
+
+
+def month_groups(parts: int) -> list[list[int]]:
+    """1〜12月を parts 個の連続した期間に分ける (例: 4 → 1〜3月, 4〜6月, ...)。"""
+    return [list(range(1 + 12 * i // parts, 1 + 12 * (i + 1) // parts)) for i in range(parts)]
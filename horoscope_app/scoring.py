@@ -0,0 +1,332 @@
+# horoscope_app/scoring.py
+"""
+LLM を使わない相性スコア(0〜100点)の計算。
+
+- 二人の天体(太陽〜冥王星)どうしのアスペクト (utils.ASPECTS / aspect_orbs を使用)
+- 四区分・三区分のバランス
+- 相手の天体が自分のどのハウスに入るか (ハウス・オーバーレイ、双方向)
+
+1人のチャートを N 人分の候補 (経度の行列) とまとめて比較できるよう NumPy で計算する。
+候補は StoredChart テーブルから読み込み、プロセス内に行列として保持する (CandidatePool)。
+"""
+import dataclasses
+import math
+import threading
+
+import numpy as np
+from django.core.exceptions import ValidationError
+
+from .utils import ASPECTS, DEFAULT_BODIES, DEFAULT_HOUSE_SYSTEM, aspect_orbs
+
+# スコアに使う天体 (並びは行列の列の並び)
+SCORE_BODIES = tuple(body.name for body in DEFAULT_BODIES if body.group == "planets")
+N_BODIES = len(SCORE_BODIES)
+
+# 天体の重み (個人天体を重視する)。天体の組の重みは2つの積
+BODY_WEIGHTS = np.array([2.0, 2.0, 1.0, 2.0, 1.5, 1.0, 1.0, 0.5, 0.5, 0.5], dtype=np.float32)
+PAIR_WEIGHTS = np.outer(BODY_WEIGHTS, BODY_WEIGHTS)
+PAIR_WEIGHTS /= PAIR_WEIGHTS.sum()
+
+# アスペクトの良し悪し (+ は調和、- は緊張)
+ASPECT_WEIGHTS = {
+    "コンジャンクション": 1.0,
+    "セクスタイル": 0.6,
+    "スクエア": -0.8,
+    "トライン": 1.0,
+    "オポジション": -0.4,
+}
+_ASPECT_TABLE = tuple((name, float(angle), float(aspect_orbs.get(name, 8)), ASPECT_WEIGHTS[name])
+                      for name, angle in ASPECTS.items())
+
+# 四区分 (火・地・風・水) どうしの相性。火と風、地と水は補い合う
+ELEMENT_MATRIX = np.array([
+    [1.0, 0.3, 0.8, 0.2],
+    [0.3, 1.0, 0.3, 0.8],
+    [0.8, 0.3, 1.0, 0.3],
+    [0.2, 0.8, 0.3, 1.0],
+], dtype=np.float32)
+# 三区分 (活動・不動・柔軟) どうしの相性
+MODE_MATRIX = np.array([
+    [0.6, 0.8, 0.8],
+    [0.8, 0.6, 0.8],
+    [0.8, 0.8, 0.6],
+], dtype=np.float32)
+# 相手の天体が入るハウス(1〜12)の重み。1・5・7・8ハウスを重視する
+HOUSE_WEIGHTS = np.array([0.6, 0.2, 0.2, 0.4, 0.8, 0.2, 1.0, 0.7, 0.3, 0.3, 0.6, -0.2],
+                         dtype=np.float32)
+
+# 各項目の重みと中心値 (ランダムな組み合わせの平均が50点付近になるよう調整)
+COMPONENT_WEIGHTS = {"aspects": 20.0, "elements": 8.0, "modes": 8.0, "houses": 3.0}
+COMPONENT_CENTERS = {"aspects": 0.04, "elements": 0.59, "modes": 0.73, "houses": 0.43}
+
+# 行列をこの行数ずつに分けて計算する (一時配列のメモリを抑える)
+CHUNK_ROWS = 16384
+
+
+def chart_features(result: dict) -> tuple[np.ndarray, np.ndarray]:
+    """
+    compute_horoscope の結果から (天体の経度[N_BODIES], ハウスカスプ[12]) を取り出す。
+    出生時刻不明でハウスがない場合、カスプは NaN にする。
+    """
+    positions = result["analysis"]["1.天体の配置"]
+    longitudes = np.array([positions[name]["degree"] for name in SCORE_BODIES], dtype=np.float32)
+    cusps = result["raw_data"]["houses"].get("cusp")
+    if cusps is None or len(cusps) != 12:
+        cusps = np.full(12, np.nan, dtype=np.float32)
+    else:
+        cusps = np.asarray(cusps, dtype=np.float32) % 360
+    return longitudes, cusps
+
+
+def sign_distribution(longitudes: np.ndarray, groups: int) -> np.ndarray:
+    """各天体の星座を四区分(groups=4)/三区分(groups=3)に分け、重み付きの割合を返す (..., groups)。"""
+    kinds = (longitudes // 30).astype(np.int8) % groups
+    return np.stack([(kinds == g) @ BODY_WEIGHTS for g in range(groups)], axis=-1) / BODY_WEIGHTS.sum()
+
+
+def _aspect_table(resolution: int) -> np.ndarray:
+    """
+    2天体の経度差 (-360〜360°を 1/resolution 度刻み) ごとのアスペクトの点数表。
+    オーブの中でアスペクトが正確なほど強い (0〜1) ものに ASPECT_WEIGHTS を掛ける。
+    各アスペクトのオーブは重ならないため、点数は経度差だけで決まる。
+    負の経度差も表に含めておき、計算時に % 360 をしなくて済むようにする。
+    """
+    diff = (np.arange(-360 * resolution, 360 * resolution, dtype=np.float64) + 0.5) / resolution
+    angle = np.abs(diff) % 360
+    angle = np.minimum(angle, 360 - angle)
+    table = np.zeros_like(angle)
+    for _, asp_angle, orb, weight in _ASPECT_TABLE:
+        table += weight * np.maximum(1.0 - np.abs(angle - asp_angle) / orb, 0.0)
+    return table.astype(np.float32)
+
+
+# 経度差の表の刻み (0.1°)。オーブ(4〜10°)に対して十分細かい
+TABLE_RESOLUTION = 10
+ASPECT_SCORE_TABLE = _aspect_table(TABLE_RESOLUTION)
+
+
+def _aspect_scores(longitudes: np.ndarray, candidate_longitudes: np.ndarray) -> np.ndarray:
+    """天体の組ごとのアスペクトの点数を PAIR_WEIGHTS で重み付けして合計する (M,)。"""
+    # 経度は 0〜360 なので、差に 360 を足すと 0〜720 になり表の添字にそのまま使える
+    shifted = (longitudes + 360.0) * TABLE_RESOLUTION
+    index = (shifted[None, :, None] - candidate_longitudes[:, None, :] * TABLE_RESOLUTION).astype(np.int32)
+    np.clip(index, 0, len(ASPECT_SCORE_TABLE) - 1, out=index)
+    scores = ASPECT_SCORE_TABLE[index].reshape(len(candidate_longitudes), -1)
+    return scores @ PAIR_WEIGHTS.ravel()
+
+
+def _house_of(longitudes: np.ndarray, cusps: np.ndarray) -> np.ndarray:
+    """
+    経度 (..., P) がカスプ (..., 12) のどのハウスに入るか (0〜11) を返す。
+    第1ハウスのカスプから測った角度で、天体より手前にあるカスプの数を数える。
+    """
+    first = cusps[..., :1]
+    relative_cusps = (cusps - first) % 360
+    relative = (longitudes - first) % 360
+    return (relative_cusps[..., None, :] <= relative[..., :, None]).sum(axis=-1) - 1
+
+
+def _overlay(longitudes: np.ndarray, cusps: np.ndarray) -> np.ndarray:
+    """
+    天体がカスプの持ち主のハウスに入ることによる重み付きの点数。
+    カスプが NaN (出生時刻不明) の場合は加点も減点もしないよう中心値にする。
+    """
+    houses = _house_of(longitudes, np.nan_to_num(cusps))
+    score = HOUSE_WEIGHTS[houses] @ BODY_WEIGHTS / BODY_WEIGHTS.sum()
+    known = ~np.isnan(cusps).any(axis=-1)
+    return np.where(known, score, COMPONENT_CENTERS["houses"]).astype(np.float32)
+
+
+def _overlay_fixed(longitudes: np.ndarray, cusps: np.ndarray) -> np.ndarray:
+    """
+    _overlay のカスプが1人分 (12,) の場合。経度(0.1°刻み)ごとのハウスの重みの表を作って引く。
+    """
+    if np.isnan(cusps).any():
+        return np.full(len(longitudes), COMPONENT_CENTERS["houses"], dtype=np.float32)
+    grid = (np.arange(360 * TABLE_RESOLUTION, dtype=np.float32) + 0.5) / TABLE_RESOLUTION
+    house_weight = HOUSE_WEIGHTS[_house_of(grid, cusps)]
+    index = (longitudes * TABLE_RESOLUTION).astype(np.int32)
+    np.clip(index, 0, len(house_weight) - 1, out=index)
+    return house_weight[index] @ BODY_WEIGHTS / BODY_WEIGHTS.sum()
+
+
+def score_components(longitudes: np.ndarray, cusps: np.ndarray,
+                     candidate_longitudes: np.ndarray, candidate_cusps: np.ndarray) -> dict:
+    """
+    1人分のチャートと候補 M 人分のチャートの各項目の点数を返す。
+
+    :param longitudes: (N_BODIES,) の経度
+    :param cusps: (12,) のカスプ (不明なら NaN)
+    :param candidate_longitudes: (M, N_BODIES)
+    :param candidate_cusps: (M, 12)
+    :return: {"aspects", "elements", "modes", "houses"} それぞれ (M,) の配列
+    """
+    aspects = _aspect_scores(longitudes, candidate_longitudes)
+
+    elements = sign_distribution(candidate_longitudes, 4) @ (ELEMENT_MATRIX
+                                                             @ sign_distribution(longitudes, 4))
+    modes = sign_distribution(candidate_longitudes, 3) @ (MODE_MATRIX @ sign_distribution(longitudes, 3))
+
+    # 相手の天体が自分のハウスに入る場合と、自分の天体が相手のハウスに入る場合の平均
+    into_mine = _overlay_fixed(candidate_longitudes, cusps)
+    into_theirs = _overlay(np.broadcast_to(longitudes, candidate_longitudes.shape), candidate_cusps)
+    houses = (into_mine + into_theirs) / 2
+
+    return {"aspects": aspects, "elements": elements, "modes": modes, "houses": houses}
+
+
+def combine(components: dict) -> np.ndarray:
+    """各項目の点数を 0〜100 の総合点にする。"""
+    raw = sum(COMPONENT_WEIGHTS[name] * (values - COMPONENT_CENTERS[name])
+              for name, values in components.items())
+    return 100.0 / (1.0 + np.exp(-raw))
+
+
+def score_many(longitudes: np.ndarray, cusps: np.ndarray,
+               candidate_longitudes: np.ndarray, candidate_cusps: np.ndarray) -> np.ndarray:
+    """1人分のチャートと候補 M 人分との総合点 (M,) を返す。"""
+    scores = np.empty(len(candidate_longitudes), dtype=np.float32)
+    for start in range(0, len(candidate_longitudes), CHUNK_ROWS):
+        stop = start + CHUNK_ROWS
+        scores[start:stop] = combine(score_components(
+            longitudes, cusps, candidate_longitudes[start:stop], candidate_cusps[start:stop]))
+    return scores
+
+
+def top_k(scores: np.ndarray, k: int) -> np.ndarray:
+    """点数の高い順に k 件のインデックスを返す。"""
+    k = min(k, len(scores))
+    if k <= 0:
+        return np.empty(0, dtype=np.int64)
+    index = np.argpartition(-scores, k - 1)[:k]
+    return index[np.argsort(-scores[index], kind="stable")]
+
+
+def cross_aspects(longitudes1: np.ndarray, longitudes2: np.ndarray) -> list[dict]:
+    """二人の天体どうしのアスペクトの一覧 (「4.アスペクトの結果」と同じ形式)。"""
+    results = []
+    for i, p1 in enumerate(SCORE_BODIES):
+        for j, p2 in enumerate(SCORE_BODIES):
+            angle = abs(float(longitudes1[i]) - float(longitudes2[j]))
+            angle = angle if angle <= 180 else 360 - angle
+            for asp_name, asp_angle, orb, _ in _ASPECT_TABLE:
+                orb_diff = angle - asp_angle
+                if abs(orb_diff) <= orb:
+                    results.append({
+                        "aspect": asp_name,
+                        "planet1": p1,
+                        "planet2": p2,
+                        "angle": round(angle, 2),
+                        "orb": round(abs(orb_diff), 2),
+                        "orb_sign": "+" if orb_diff >= 0 else "-",
+                    })
+    return results
+
+
+def score_pair(result1: dict, result2: dict) -> dict:
+    """
+    二人の compute_horoscope の結果から相性スコアを計算する。
+
+    :return: {"score", "components": {項目: 点数}, "aspects": [二人の天体どうしのアスペクト]}
+    """
+    longitudes1, cusps1 = chart_features(result1)
+    longitudes2, cusps2 = chart_features(result2)
+    components = score_components(longitudes1, cusps1, longitudes2[None, :], cusps2[None, :])
+    score = combine(components)[0]
+    return {
+        "score": round(float(score), 1),
+        "components": {name: round(float(values[0]), 4) for name, values in components.items()},
+        "aspects": cross_aspects(longitudes1, longitudes2),
+    }
+
+
+def comparable_birth(birth):
+    """
+    登録済みのチャート (StoredChart) と比べる出生データを返す。
+
+    StoredChart はトロピカル・既定のハウスシステムで計算するため、それ以外の指定は ValidationError にする。
+    追加の天体・座標系はスコアに使わないため外す (BirthInput.key を登録時と揃える)。
+    """
+    errors = {}
+    if birth.ayanamsa:
+        errors["zodiac"] = ["登録済みのチャートとの比較では tropical のみ指定できます。"]
+    if birth.house_system != DEFAULT_HOUSE_SYSTEM:
+        errors["house_system"] = [f"登録済みのチャートとの比較では {DEFAULT_HOUSE_SYSTEM} のみ指定できます。"]
+    if errors:
+        raise ValidationError(errors)
+    return dataclasses.replace(birth, bodies=(), frames=())
+
+
+def stored_chart_fields(birth, result: dict) -> dict:
+    """BirthInput と compute_horoscope の結果から StoredChart の項目を作る。"""
+    longitudes, cusps = chart_features(result)
+    return {
+        "key": birth.key,
+        "birth": {
+            "year": birth.year, "month": birth.month, "day": birth.day,
+            "hour": birth.hour, "minute": birth.minute,
+            "lat": birth.lat, "lon": birth.lon, "tz": birth.tz, "dst": birth.dst,
+            "prefecture": birth.prefecture, "unknown": birth.unknown, "tzid": birth.tzid,
+        },
+        "longitudes": [round(float(value), 4) for value in longitudes],
+        "cusps": None if np.isnan(cusps).any() else [round(float(value), 4) for value in cusps],
+    }
+
+
+class CandidatePool:
+    """スコアを計算する候補のチャート (StoredChart) を行列にまとめたもの。"""
+
+    def __init__(self, ids, labels, longitudes, cusps):
+        self.ids = np.asarray(ids, dtype=np.int64)
+        self.labels = list(labels)
+        self.longitudes = np.asarray(longitudes, dtype=np.float32).reshape(-1, N_BODIES)
+        self.cusps = np.asarray(cusps, dtype=np.float32).reshape(-1, 12)
+
+    def __len__(self):
+        return len(self.ids)
+
+    @classmethod
+    def from_database(cls) -> "CandidatePool":
+        from .models import StoredChart
+
+        ids, labels, longitudes, cusps = [], [], [], []
+        rows = StoredChart.objects.order_by("id").values_list("id", "label", "longitudes", "cusps")
+        for pk, label, lons, chart_cusps in rows.iterator(chunk_size=5000):
+            ids.append(pk)
+            labels.append(label)
+            longitudes.append(lons)
+            cusps.append(chart_cusps if chart_cusps else [math.nan] * 12)
+        return cls(ids, labels, longitudes, cusps)
+
+    def top_matches(self, longitudes: np.ndarray, cusps: np.ndarray, k: int,
+                    exclude_id: int | None = None) -> list[dict]:
+        scores = score_many(longitudes, cusps, self.longitudes, self.cusps)
+        if exclude_id is not None:
+            scores[self.ids == exclude_id] = -1.0
+        return [
+            {"id": int(self.ids[i]), "label": self.labels[i], "score": round(float(scores[i]), 1)}
+            for i in top_k(scores, k) if scores[i] >= 0
+        ]
+
+
+_pool: CandidatePool | None = None
+_pool_state = None
+_pool_lock = threading.Lock()
+
+
+def candidate_pool() -> CandidatePool:
+    """
+    StoredChart の行列を返す。件数か最大 ID が変わった場合だけ読み込み直す
+    (1リクエストあたりの DB アクセスは集計クエリ1回)。
+    """
+    global _pool, _pool_state
+    from django.db.models import Count, Max
+
+    from .models import StoredChart
+
+    state = StoredChart.objects.aggregate(count=Count("id"), last=Max("id"))
+    with _pool_lock:
+        if _pool is None or state != _pool_state:
+            _pool = CandidatePool.from_database()
+            _pool_state = state
+        return _pool
@@ -0,0 +1,270 @@
+# horoscope_app/similarity.py
+"""
+「あなたに似たチャートの人」を探すための近傍検索インデックス。
+
+- チャートを特徴ベクトルにする: 天体(太陽〜冥王星)の経度の cos/sin (重みは scoring.BODY_WEIGHTS)
+  と四区分・三区分の割合。経度を cos/sin にすることで 359° と 1° が近いと扱える
+- インデックスは IVF (k-means で求めた nlist 個の代表点ごとにベクトルをまとめたもの)。
+  検索時はクエリに近い nprobe 個のリストだけを調べる。件数が少ない間は全件を調べる
+- ファイルは世代ディレクトリ (CHART_INDEX_DIR/<世代>/) に置き、CURRENT に現在の世代名を書く。
+  ベクトルは np.memmap で読むため、複数のワーカーでもページキャッシュを共有する
+- 作り直し (build) の後に追加した分 (add) はリストの後ろに追記し、検索時に全件調べる。
+  追記が増えたら build し直す
+
+書き込みは chart_index コマンド (1プロセス) からのみ行い、Web プロセスは読み込むだけにする。
+"""
+import json
+import os
+import shutil
+import threading
+import time
+from pathlib import Path
+
+import numpy as np
+
+from .scoring import BODY_WEIGHTS, N_BODIES, sign_distribution
+
+FEATURE_VERSION = 1
+DIM = 2 * N_BODIES + 4 + 3
+# 特徴ベクトルの距離の最大値 (cos/sin の部分が 2²、四区分・三区分が各 2)。類似度の換算に使う
+MAX_DISTANCE = float(np.sqrt(4.0 + 2.0 + 2.0))
+
+IVF_MIN_ROWS = 20_000        # これより少なければ IVF を作らず全件を調べる
+DEFAULT_NPROBE = 16
+KMEANS_SAMPLE = 65_536
+KMEANS_ITERATIONS = 10
+ASSIGN_CHUNK = 65_536
+
+_BODY_SCALE = np.sqrt(BODY_WEIGHTS / BODY_WEIGHTS.sum()).astype(np.float32)
+
+
+def feature_vectors(longitudes: np.ndarray) -> np.ndarray:
+    """経度 (..., N_BODIES) から特徴ベクトル (..., DIM) を作る。"""
+    longitudes = np.asarray(longitudes, dtype=np.float32)
+    radians = np.radians(longitudes)
+    return np.concatenate([
+        np.cos(radians) * _BODY_SCALE,
+        np.sin(radians) * _BODY_SCALE,
+        sign_distribution(longitudes, 4),
+        sign_distribution(longitudes, 3),
+    ], axis=-1).astype(np.float32)
+
+
+def _nearest_centroid(vectors: np.ndarray, centroids: np.ndarray) -> np.ndarray:
+    """各ベクトルに最も近い代表点の番号を返す (メモリを抑えるため分割して計算する)。"""
+    centroid_norms = (centroids ** 2).sum(axis=1)
+    result = np.empty(len(vectors), dtype=np.int32)
+    for start in range(0, len(vectors), ASSIGN_CHUNK):
+        chunk = np.asarray(vectors[start:start + ASSIGN_CHUNK])
+        # |v - c|² = |v|² - 2 v・c + |c|² の |v|² は比較に関係ないので省く
+        result[start:start + len(chunk)] = np.argmin(centroid_norms - 2.0 * chunk @ centroids.T, axis=1)
+    return result
+
+
+def _kmeans(vectors: np.ndarray, nlist: int, seed: int = 0) -> np.ndarray:
+    """vectors から標本を取り、nlist 個の代表点を k-means で求める。"""
+    rng = np.random.default_rng(seed)
+    if len(vectors) > KMEANS_SAMPLE:
+        sample = np.asarray(vectors[np.sort(rng.choice(len(vectors), KMEANS_SAMPLE, replace=False))])
+    else:
+        sample = np.asarray(vectors)
+    centroids = sample[rng.choice(len(sample), nlist, replace=False)].copy()
+    for _ in range(KMEANS_ITERATIONS):
+        assign = _nearest_centroid(sample, centroids)
+        counts = np.bincount(assign, minlength=nlist)
+        filled = counts > 0
+        for d in range(sample.shape[1]):
+            sums = np.bincount(assign, weights=sample[:, d], minlength=nlist)
+            centroids[filled, d] = sums[filled] / counts[filled]
+    return centroids.astype(np.float32)
+
+
+def _write_array(path: Path, array: np.ndarray, dtype) -> None:
+    with open(path, "wb") as f:
+        f.write(np.ascontiguousarray(array, dtype=dtype).tobytes())
+
+
+def _write_json(path: Path, data: dict) -> None:
+    tmp = path.with_suffix(".tmp")
+    tmp.write_text(json.dumps(data), encoding="utf-8")
+    os.replace(tmp, path)
+
+
+class ChartIndex:
+    """CHART_INDEX_DIR のインデックス1世代分。"""
+
+    def __init__(self, root):
+        self.root = Path(root)
+        current = (self.root / "CURRENT").read_text(encoding="utf-8").strip()
+        self.dir = self.root / current
+        self._meta_mtime = None
+        self._load()
+
+    # --- 読み込み ---
+
+    def _load(self) -> None:
+        meta_path = self.dir / "meta.json"
+        self._meta_mtime = meta_path.stat().st_mtime_ns
+        self.meta = json.loads(meta_path.read_text(encoding="utf-8"))
+        if self.meta["feature_version"] != FEATURE_VERSION:
+            raise ValueError("特徴ベクトルの形式が異なるため、chart_index build で作り直してください。")
+        count, nlist = self.meta["count"], self.meta["nlist"]
+        self.vectors = self._memmap("vectors.f32", np.float32, (count, DIM))
+        self.ids = self._memmap("ids.i64", np.int64, (count,))
+        self.centroids = self._memmap("centroids.f32", np.float32, (nlist, DIM))
+        self.offsets = np.asarray(self._memmap("offsets.i64", np.int64, (nlist + 1,) if nlist else (0,)))
+
+    def _memmap(self, name: str, dtype, shape: tuple) -> np.ndarray:
+        if not np.prod(shape):
+            return np.zeros(shape, dtype=dtype)
+        return np.memmap(self.dir / name, dtype=dtype, mode="r", shape=shape)
+
+    def is_stale(self) -> bool:
+        """別のプロセスが追加・作り直しをしたかどうか。"""
+        try:
+            current = (self.root / "CURRENT").read_text(encoding="utf-8").strip()
+            return (self.root / current != self.dir
+                    or (self.dir / "meta.json").stat().st_mtime_ns != self._meta_mtime)
+        except OSError:
+            return True
+
+    def __len__(self):
+        return self.meta["count"]
+
+    @property
+    def last_id(self) -> int:
+        return self.meta["last_id"]
+
+    # --- 検索 ---
+
+    def search(self, vector: np.ndarray, k: int, nprobe: int = DEFAULT_NPROBE,
+               exclude_id: int | None = None) -> list[tuple[int, float]]:
+        """
+        vector に近い順に k 件の (ID, 距離) を返す。
+
+        :param nprobe: 調べる IVF のリストの数 (多いほど正確で遅い)
+        """
+        vector = np.asarray(vector, dtype=np.float32)
+        parts = []
+        nlist = self.meta["nlist"]
+        if nlist:
+            centroid_distances = ((self.centroids - vector) ** 2).sum(axis=1)
+            nprobe = min(nprobe, nlist)
+            for c in np.argpartition(centroid_distances, nprobe - 1)[:nprobe]:
+                start, stop = self.offsets[c], self.offsets[c + 1]
+                if stop > start:
+                    parts.append((start, stop))
+        # 作り直し後に追加した分 (IVF なしの場合は全件)
+        if self.meta["indexed"] < len(self):
+            parts.append((self.meta["indexed"], len(self)))
+        if not parts:
+            return []
+
+        positions = np.concatenate([np.arange(start, stop) for start, stop in parts])
+        vectors = np.concatenate([self.vectors[start:stop] for start, stop in parts])
+        distances = ((vectors - vector) ** 2).sum(axis=1)
+        if exclude_id is not None:
+            distances[np.asarray(self.ids[positions]) == exclude_id] = np.inf
+        k = min(k, len(distances))
+        best = np.argpartition(distances, k - 1)[:k]
+        best = best[np.argsort(distances[best], kind="stable")]
+        return [(int(self.ids[positions[i]]), float(np.sqrt(distances[i])))
+                for i in best if np.isfinite(distances[i])]
+
+    # --- 書き込み (chart_index コマンドのみ) ---
+
+    @classmethod
+    def build(cls, root, ids: np.ndarray, vectors: np.ndarray, nlist: int | None = None) -> "ChartIndex":
+        """新しい世代としてインデックスを作り、CURRENT を切り替える。古い世代は削除する。"""
+        root = Path(root)
+        root.mkdir(parents=True, exist_ok=True)
+        ids = np.asarray(ids, dtype=np.int64)
+        vectors = np.asarray(vectors, dtype=np.float32).reshape(-1, DIM)
+        count = len(ids)
+        if nlist is None:
+            nlist = int(np.sqrt(count)) if count >= IVF_MIN_ROWS else 0
+        nlist = min(nlist, count)
+
+        generation = f"gen-{time.time_ns()}"
+        directory = root / generation
+        directory.mkdir()
+        if nlist:
+            centroids = _kmeans(vectors, nlist)
+            assign = _nearest_centroid(vectors, centroids)
+            order = np.argsort(assign, kind="stable")
+            offsets = np.searchsorted(assign[order], np.arange(nlist + 1)).astype(np.int64)
+            ids, vectors = ids[order], vectors[order]
+            _write_array(directory / "centroids.f32", centroids, np.float32)
+            _write_array(directory / "offsets.i64", offsets, np.int64)
+        _write_array(directory / "vectors.f32", vectors, np.float32)
+        _write_array(directory / "ids.i64", ids, np.int64)
+        _write_json(directory / "meta.json", {
+            "feature_version": FEATURE_VERSION,
+            "dim": DIM,
+            "nlist": nlist,
+            "indexed": count if nlist else 0,
+            "count": count,
+            "last_id": int(ids.max()) if count else 0,
+        })
+
+        (root / "CURRENT.tmp").write_text(generation, encoding="utf-8")
+        os.replace(root / "CURRENT.tmp", root / "CURRENT")
+        for old in root.glob("gen-*"):
+            if old.name != generation:
+                # 読み込み中のプロセスは開いたファイルをそのまま使える (削除されても内容は残る)
+                shutil.rmtree(old, ignore_errors=True)
+        return cls(root)
+
+    def add(self, ids: np.ndarray, vectors: np.ndarray) -> None:
+        """チャートを追記する (IVF のリストには入れず、検索時に全件調べる部分に加える)。"""
+        ids = np.asarray(ids, dtype=np.int64)
+        if not len(ids):
+            return
+        vectors = np.asarray(vectors, dtype=np.float32).reshape(-1, DIM)
+        if len(vectors) != len(ids):
+            raise ValueError("ids と vectors の件数が一致しません。")
+        # ベクトルと ID を書き終えてから meta.json の件数を増やす (読み込み側は件数分しか読まない)
+        with open(self.dir / "vectors.f32", "ab") as f:
+            f.write(vectors.tobytes())
+        with open(self.dir / "ids.i64", "ab") as f:
+            f.write(ids.tobytes())
+        meta = dict(self.meta, count=self.meta["count"] + len(ids),
+                    last_id=max(self.meta["last_id"], int(ids.max())))
+        _write_json(self.dir / "meta.json", meta)
+        self._load()
+
+
+def stored_chart_vectors(min_id: int = 0, batch_size: int = 10_000):
+    """StoredChart のうち ID が min_id より大きいものを (IDの配列, 特徴ベクトル) の組で順に返す。"""
+    from .models import StoredChart
+
+    last = min_id
+    while True:
+        rows = list(StoredChart.objects.filter(id__gt=last).order_by("id")
+                    .values_list("id", "longitudes")[:batch_size])
+        if not rows:
+            return
+        ids = np.array([pk for pk, _ in rows], dtype=np.int64)
+        yield ids, feature_vectors(np.array([lons for _, lons in rows], dtype=np.float32))
+        last = int(ids[-1])
+
+
+_index: ChartIndex | None = None
+_index_lock = threading.Lock()
+
+
+def get_index() -> ChartIndex | None:
+    """
+    CHART_INDEX_DIR のインデックスを返す (まだ作られていなければ None)。
+    chart_index コマンドで追加・作り直しされた場合は読み込み直す。
+    """
+    global _index
+    from django.conf import settings
+
+    with _index_lock:
+        if _index is None or _index.is_stale():
+            try:
+                _index = ChartIndex(settings.CHART_INDEX_DIR)
+            except FileNotFoundError:
+                _index = None
+        return _index
@@ -0,0 +1,1095 @@
+// horoscope_app/static/horoscope_app/js/compatibility.js
+// 相性占いページ(compatibility.html)のスクリプト。
+// ページ本体はキャッシュして配信するため、訪問ごとに変わる CSRF Cookie は token エンドポイントで設定させ、
+// URL はテンプレートの <body data-*> から受け取る。
+const pageUrls = document.body.dataset;
+
+// 生年月日のプルダウンをクライアント側で生成する（サーバーでの毎回の描画をやめたため）
+function fillNumberOptions(select, from, to) {
+    if (!select) return;
+    const fragment = document.createDocumentFragment();
+    for (let value = from; value <= to; value++) {
+        const option = document.createElement('option');
+        option.value = String(value);
+        option.textContent = String(value);
+        fragment.appendChild(option);
+    }
+    select.appendChild(fragment);
+}
+['1', '2'].forEach(suffix => {
+    fillNumberOptions(document.getElementById('year-select' + suffix), 1900, 2099);
+    fillNumberOptions(document.getElementById('month-select' + suffix), 1, 12);
+    fillNumberOptions(document.getElementById('day-select' + suffix), 1, 31);
+});
+
+// token エンドポイントを呼んで CSRF Cookie を設定させる（ページはキャッシュされるため）。
+// 返るワンタイムトークンは /horoscope/ai/ 用で、このページでは使わない
+fetch(pageUrls.tokenUrl, { credentials: 'same-origin' }).catch(() => {});
+
+
+// 既存の getCookie があればそのままでOK（無ければ下を使用）
+function getCookie(name) {
+    const m = document.cookie.match('(^|;)\\s*' + name + '\\s*=\\s*([^;]+)');
+    return m ? decodeURIComponent(m.pop()) : '';
+}
+
+// prefix = "1" or "2"
+function buildParamsFromForm(prefix) {
+    const form = document.getElementById('horoscope-form');
+    const fd = new FormData(form);
+    const year  = fd.get('year' + prefix);
+    const month = fd.get('month' + prefix);
+    const day   = fd.get('day' + prefix);
+    const time  = fd.get('time' + prefix) || "12:00";
+    const prefecture = fd.get('prefecture' + prefix);
+    const lat   = fd.get('lat' + prefix);
+    const lon   = fd.get('lon' + prefix);
+    const tz    = fd.get('tz' + prefix);
+    const dst   = fd.get('dst' + prefix);
+
+    const [hour, minute] = time.split(':');
+
+    return new URLSearchParams({
+    year, month, day,
+    hour, minute,
+    lat, lon,
+    tz, dst,
+    prefecture
+    });
+}
+
+async function fetchHoroscopeAndDraw(prefix, containerId, canvasId) {
+    const params = buildParamsFromForm(prefix);
+    const url = pageUrls.horoscopeUrl;
+
+    const response = await fetch(url, {
+    method: 'POST',
+    credentials: 'same-origin',
+    headers: {
+        'Content-Type': 'application/x-www-form-urlencoded',
+        'X-CSRFToken': getCookie('csrftoken')
+    },
+    body: params.toString()
+    });
+
+    if (!response.ok) {
+    throw new Error("ホロスコープデータの取得に失敗しました");
+    }
+    const data = await response.json();
+
+    const chartContainer = document.getElementById(containerId);
+    chartContainer.style.display = 'block';
+    drawHoroscopeWheel(data, containerId, canvasId);
+
+    // 既存の保存関数があるなら呼び出し
+    const form = document.getElementById('horoscope-form');
+    if (typeof saveFormDataToCookies === 'function') {
+    saveFormDataToCookies(new FormData(form));
+    }
+}
+
+// POST で別ページへ遷移（Django CSRF 対応）
+function postRedirect(actionUrl, params) {
+    const form = document.createElement('form');
+    form.method = 'POST';
+    form.action = actionUrl;
+
+    // CSRF
+    const csrf = document.createElement('input');
+    csrf.type = 'hidden';
+    csrf.name = 'csrfmiddlewaretoken';
+    csrf.value = getCookie('csrftoken');
+    form.appendChild(csrf);
+
+    // params（URLSearchParams）を hidden にして追加
+    for (const [k, v] of params.entries()) {
+    const input = document.createElement('input');
+    input.type = 'hidden';
+    input.name = k;
+    input.value = v;
+    form.appendChild(input);
+    }
+
+    document.body.appendChild(form);
+    form.submit();
+}
+
+
+// (A) 時刻不明チェックボックスの自動処理
+
+document.addEventListener('DOMContentLoaded', function () {
+    const timeInput = document.getElementById('time1');
+    const unknownCheckbox = document.getElementById('unknown1');
+
+    unknownCheckbox.addEventListener('change', function () {
+        if (this.checked) {
+            timeInput.value = '';
+        } else {
+            // timeInput.value = '';
+        }
+    });
+});
+document.addEventListener('DOMContentLoaded', function () {
+    const timeInput = document.getElementById('time2');
+    const unknownCheckbox = document.getElementById('unknown2');
+
+    unknownCheckbox.addEventListener('change', function () {
+        if (this.checked) {
+            timeInput.value = '';
+        } else {
+            // timeInput.value = '';
+        }
+    });
+});
+
+
+// (C) クッキー周りのヘルパー関数 (必要な場合)
+
+function setCookie(name, value, days) {
+    const d = new Date();
+    d.setTime(d.getTime() + (days*24*60*60*1000));
+    const expires = "expires="+ d.toUTCString();
+    document.cookie = `${name}=${value};${expires};path=/`;
+}
+function getCookie(name) {
+    let cookieValue = null;
+    if (document.cookie && document.cookie !== '') {
+        const cookies = document.cookie.split(';');
+        for (let i = 0; i < cookies.length; i++) {
+            const cookie = cookies[i].trim();
+            if (cookie.substring(0, name.length + 1) === (name + '=')) {
+                cookieValue = decodeURIComponent(cookie.substring(name.length + 1));
+                break;
+            }
+        }
+    }
+    return cookieValue;
+}
+
+
+// (D) フォームの入力値をクッキーに保存＆復元 (必要に応じて)
+
+document.addEventListener('DOMContentLoaded', () => {
+    const yearSelect = document.getElementById('year-select1');
+    const monthSelect = document.getElementById('month-select1');
+    const daySelect = document.getElementById('day-select1');
+    const timeInput = document.querySelector('input[name="time1"]');
+    const prefectureSelect = document.getElementById('prefecture1');
+    const checkboxSelect = document.getElementById('unknown1');
+
+    // クッキーから読み込む例 (省略可)
+    const savedYear = getCookie('horoscope_year1');
+    const savedMonth = getCookie('horoscope_month1');
+    const savedDay = getCookie('horoscope_day1');
+    const savedTime = getCookie('horoscope_time1');
+    const savedPrefecture = getCookie('horoscope_prefecture1');
+    const savedCheckbox = getCookie('horoscope_checkbox1');
+
+    if (yearSelect && savedYear) {
+        yearSelect.value = savedYear;
+    }
+    if (monthSelect && savedMonth) {
+        monthSelect.value = savedMonth;
+    }
+    if (daySelect && savedDay) {
+        daySelect.value = savedDay;
+    }
+    if (timeInput && savedTime !== null) {
+        timeInput.value = savedTime;
+    }
+    if (checkboxSelect && savedCheckbox !== null) {
+        checkboxSelect.checked = (savedCheckbox === 'true');
+    }
+    if (prefectureSelect && savedPrefecture) {
+        const options = prefectureSelect.options;
+        for (let i = 0; i < options.length; i++) {
+            if (options[i].value === savedPrefecture) {
+                prefectureSelect.selectedIndex = i;
+                break;
+            }
+        }
+    }
+
+    // デフォルト値の設定（Cookieに該当値がない場合のみ）
+    if (!savedYear || !savedMonth || !savedDay) {
+        const now = new Date();
+        if (yearSelect && !savedYear)  yearSelect.value  = now.getFullYear();
+        if (monthSelect && !savedMonth) monthSelect.value = String(now.getMonth() + 1);
+        if (daySelect && !savedDay)     daySelect.value   = String(now.getDate());
+    }
+    if (!savedTime && savedCheckbox == null) {
+        const now = new Date();
+        const hours   = String(now.getHours()).padStart(2, '0');
+        const minutes = String(now.getMinutes()).padStart(2, '0');
+        if (timeInput) timeInput.value = `${hours}:${minutes}`;
+    }
+    // 都道府県切り替え
+    if (prefectureSelect) {
+        function updateLatLon(e) {
+            const selected = e.target.selectedOptions[0];
+            document.getElementById('lat1').value = selected.getAttribute('data-lat');
+            document.getElementById('lon1').value = selected.getAttribute('data-lon');
+        }
+        // 初期化
+        const defaultSelected = prefectureSelect.selectedOptions[0];
+        document.getElementById('lat1').value = defaultSelected.getAttribute('data-lat');
+        document.getElementById('lon1').value = defaultSelected.getAttribute('data-lon');
+        // 変更イベント
+        prefectureSelect.addEventListener('change', updateLatLon);
+    }
+});
+document.addEventListener('DOMContentLoaded', () => {
+    const yearSelect = document.getElementById('year-select2');
+    const monthSelect = document.getElementById('month-select2');
+    const daySelect = document.getElementById('day-select2');
+    const timeInput = document.querySelector('input[name="time2"]');
+    const prefectureSelect = document.getElementById('prefecture2');
+    const checkboxSelect = document.getElementById('unknown2');
+
+    // クッキーから読み込む例 (省略可)
+    const savedYear = getCookie('horoscope_year2');
+    const savedMonth = getCookie('horoscope_month2');
+    const savedDay = getCookie('horoscope_day2');
+    const savedTime = getCookie('horoscope_time2');
+    const savedPrefecture = getCookie('horoscope_prefecture2');
+    const savedCheckbox = getCookie('horoscope_checkbox2');
+
+    if (yearSelect && savedYear) {
+        yearSelect.value = savedYear;
+    }
+    if (monthSelect && savedMonth) {
+        monthSelect.value = savedMonth;
+    }
+    if (daySelect && savedDay) {
+        daySelect.value = savedDay;
+    }
+    if (timeInput && savedTime !== null) {
+        timeInput.value = savedTime;
+    }
+    if (checkboxSelect && savedCheckbox !== null) {
+        checkboxSelect.checked = (savedCheckbox === 'true');
+    }
+    if (prefectureSelect && savedPrefecture) {
+        const options = prefectureSelect.options;
+        for (let i = 0; i < options.length; i++) {
+            if (options[i].value === savedPrefecture) {
+                prefectureSelect.selectedIndex = i;
+                break;
+            }
+        }
+    }
+
+    // デフォルト値の設定（Cookieに該当値がない場合のみ）
+    if (!savedYear || !savedMonth || !savedDay) {
+        const now = new Date();
+        if (yearSelect && !savedYear)  yearSelect.value  = now.getFullYear();
+        if (monthSelect && !savedMonth) monthSelect.value = String(now.getMonth() + 1);
+        if (daySelect && !savedDay)     daySelect.value   = String(now.getDate());
+    }
+    if (!savedTime && savedCheckbox == null) {
+        const now = new Date();
+        const hours   = String(now.getHours()).padStart(2, '0');
+        const minutes = String(now.getMinutes()).padStart(2, '0');
+        if (timeInput) timeInput.value = `${hours}:${minutes}`;
+    }
+    // 都道府県切り替え
+    if (prefectureSelect) {
+        function updateLatLon(e) {
+            const selected = e.target.selectedOptions[0];
+            document.getElementById('lat2').value = selected.getAttribute('data-lat');
+            document.getElementById('lon2').value = selected.getAttribute('data-lon');
+        }
+        // 初期化
+        const defaultSelected = prefectureSelect.selectedOptions[0];
+        document.getElementById('lat2').value = defaultSelected.getAttribute('data-lat');
+        document.getElementById('lon2').value = defaultSelected.getAttribute('data-lon');
+        // 変更イベント
+        prefectureSelect.addEventListener('change', updateLatLon);
+    }
+});
+
+
+// (E) フォーム送信（ボタンクリック）本番運用
+
+// CSRFトークンは送信時に Cookie から読む（Cookie は token エンドポイントで設定される）
+
+// 送信ボタンの要素（例: 3つのボタン）
+const submitButtons = [
+document.getElementById('submit-button7'),
+document.getElementById('submit-button8'),
+document.getElementById('submit-button17'),
+document.getElementById('submit-button18')
+];
+const resultDiv = document.getElementById('result');
+
+// フォームデータをオブジェクトに変換するヘルパー関数
+const formDataToObject = formData => {
+    const data = {};
+    formData.forEach((value, key) => data[key] = value);
+    return data;
+};
+
+// クッキーに保存する関数
+function saveFormDataToCookies(formData) {
+    const data = formDataToObject(formData);
+    setCookie('horoscope_year1', data.year1, 30); // 30日間有効
+    setCookie('horoscope_month1', data.month1, 30); // 30日間有効
+    setCookie('horoscope_day1', data.day1, 30); // 30日間有効
+    setCookie('horoscope_time1', data.time1, 30);
+    setCookie('horoscope_prefecture1', data.prefecture1, 30);
+
+    // チェックボックスの状態を 'true' または 'false' で保存
+    const isChecked1 = formData.has('unknown1') ? 'true' : 'false';
+    setCookie('horoscope_checkbox1', isChecked1, 30);
+
+
+    setCookie('horoscope_year2', data.year2, 30); // 30日間有効
+    setCookie('horoscope_month2', data.month2, 30); // 30日間有効
+    setCookie('horoscope_day2', data.day2, 30); // 30日間有効
+    setCookie('horoscope_time2', data.time2, 30);
+    setCookie('horoscope_prefecture2', data.prefecture2, 30);
+
+    // チェックボックスの状態を 'true' または 'false' で保存
+    const isChecked2 = formData.has('unknown2') ? 'true' : 'false';
+    setCookie('horoscope_checkbox2', isChecked2, 30);
+}
+
+// 送信ハンドラー生成関数
+const createSubmitHandler = (sbValue, spinnerId) => async e => {
+    e.preventDefault();
+
+    const form = e.target.form;
+    if (!form) return;
+
+    try {
+        // フォームデータ処理
+        const formData = new FormData(form);
+        const data = formDataToObject(formData);
+
+        // 日付と時刻の分解
+        const year1 = data.year1;
+        const month1 = data.month1;
+        const day1 = data.day1;
+        const time1  = data.time1 || "12:00";
+        const [hour1, minute1] = time1.split(':');
+        const unknown1 = data.unknown1;
+        const prefecture1 = data.prefecture1;
+
+        const year2 = data.year2;
+        const month2 = data.month2;
+        const day2 = data.day2;
+        const time2  = data.time2 || "12:00";
+        const [hour2, minute2] = time2.split(':');
+        const unknown2 = data.unknown2;
+        const prefecture2 = data.prefecture2;
+
+        // 送信データの組み立て
+        const sendData = {
+            year1: year1,
+            month1: month1,
+            day1: day1,
+            hour1: hour1,
+            minute1: minute1,
+            lat1: data.lat1,
+            lon1: data.lon1,
+            tz1: data.tz1,
+            dst1: data.dst1,
+            unknown1: unknown1,
+            prefecture1: prefecture1,
+            year2: year2,
+            month2: month2,
+            day2: day2,
+            hour2: hour2,
+            minute2: minute2,
+            lat2: data.lat2,
+            lon2: data.lon2,
+            tz2: data.tz2,
+            dst2: data.dst2,
+            unknown2: unknown2,
+            prefecture2: prefecture2,
+            sb: sbValue
+        };
+
+        // UI状態更新
+        submitButtons.forEach(btn => btn.disabled = true);
+        const spinner = document.getElementById(spinnerId);
+        if (spinner) spinner.style.display = 'inline-block';
+
+        // APIリクエスト
+        const response = await fetch(pageUrls.analyzeUrl, {
+        method: 'POST',
+        credentials: 'same-origin',  // これを追加
+        headers: {
+            'Content-Type': 'application/x-www-form-urlencoded',
+            'X-CSRFToken': getCookie('csrftoken')
+        },
+        body: new URLSearchParams(sendData)
+        });
+
+        // レスポンス処理
+        const content = await response.json();
+        if (!response.ok) throw new Error(content.error || 'Unknown error');
+
+        // Markdown処理とサニタイズ
+        const cleanHtml = DOMPurify.sanitize(marked.parse(content.result));
+        resultDiv.innerHTML = cleanHtml;
+
+        // クッキーに保存
+        saveFormDataToCookies(formData);
+
+    } catch (error) {
+        const errorMessage = error.name === 'SyntaxError' 
+        ? 'Invalid server response'
+        : error.message;
+        resultDiv.textContent = error.response ?
+         `エラー: ${error.message}` 
+        : `通信エラー: ${errorMessage}`;
+    } finally {
+        submitButtons.forEach(btn => btn.disabled = false);
+        const spinner = document.getElementById(spinnerId);
+        if (spinner) spinner.style.display = 'none';
+    }
+};
+
+// ボタン設定とイベントリスナーの登録
+const buttonConfigs = [
+{ id: 'submit-button7', spinner: 'spinner7', sb: 7 },
+{ id: 'submit-button8', spinner: 'spinner8', sb: 8 },
+{ id: 'submit-button17', spinner: 'spinner17', sb: 17 },
+{ id: 'submit-button18', spinner: 'spinner18', sb: 18 }
+];
+
+buttonConfigs.forEach(({ id, spinner, sb }) => {
+const button = document.getElementById(id);
+if (button) {
+    button.addEventListener('click', createSubmitHandler(sb, spinner));
+}
+});
+
+
+// (F) ホロスコープを生成・描画するスクリプト
+
+// 惑星英名 => 惑星和名
+const planetNameMap = {
+    "Sun"     : "太陽",
+    "Moon"    : "月",
+    "Mercury" : "水星",
+    "Venus"   : "金星",
+    "Mars"    : "火星",
+    "Jupiter" : "木星",
+    "Saturn"  : "土星",
+    "Uranus"  : "天王星",
+    "Neptune" : "海王星",
+    "Pluto"   : "冥王星"
+};
+// 惑星英名 => シンボル
+const planetSymbolMap = {
+    "Sun"     : "☉",
+    "Moon"    : "☾",
+    "Mercury" : "☿",
+    "Venus"   : "♀",
+    "Mars"    : "♂",
+    "Jupiter" : "♃",
+    "Saturn"  : "♄",
+    "Uranus"  : "♅",
+    "Neptune" : "♆",
+    "Pluto"   : "♇"
+};
+// アスペクト色（高級感のある金・銀・深紅・濃緑・ダークゴールド）
+const aspectColorMap = {
+    "コンジャンクション": "#FFD700",  // 明るいゴールド（ゴールド）
+    "オポジション": "#0000FF",        // ブルー（青）
+    "スクエア": "#FF6347",            // 明るいレッド（トマトレッド）
+    "トライン": "#32CD32",            // 明るいグリーン（ライムグリーン）
+    "セクスタイル": "#FFCC33",        // 明るいゴールデンロッド（ライトゴールデンロッド）
+    "Conjunction": "#FFD700",
+    "Opposition": "#0000FF",
+    "Square": "#FF6347",
+    "Trine": "#32CD32",
+    "Sextile": "#FFCC33"
+};
+// 星座のシンボル
+const zodiacSymbols = {
+    0: "♈", 1: "♉", 2: "♊", 3: "♋",
+    4: "♌", 5: "♍", 6: "♎", 7: "♏",
+    8: "♐", 9: "♑", 10: "♒", 11: "♓"
+};
+
+/**
+ * ホロスコープを描画する関数
+ * @param {Object} horoscopeData サーバー等から取得したホロスコープ情報
+ */
+function drawHoroscopeWheel(horoscopeData, name1, name2) {
+    const chartContainer = document.getElementById(name1);
+    const canvas = document.getElementById(name2);
+
+    // canvas のサイズ調整
+    let containerWidth = chartContainer.offsetWidth; 
+    if (containerWidth > 300) {
+        containerWidth = 300; 
+    }
+    canvas.width = containerWidth;
+    canvas.height = containerWidth;
+    chartContainer.style.width  = containerWidth + "px";
+    chartContainer.style.height = containerWidth + "px";
+
+    const ctx = canvas.getContext('2d');
+    ctx.clearRect(0, 0, canvas.width, canvas.height);
+    const centerX = canvas.width / 2;
+    const centerY = canvas.height / 2;
+    const radius  = canvas.width * 0.4;
+
+    // ハウスデータの処理（rotationOffset 等）
+    const houseData = horoscopeData?.raw_data?.houses;
+    let rotationOffset = 0;
+    if (houseData && houseData.cusp && houseData.cusp.length > 0) {
+        const firstCuspDeg = houseData.cusp[0];
+        rotationOffset = (90 - firstCuspDeg) % 360;
+    }
+    function degToRad(deg) {
+        return (360 - (deg + rotationOffset) - 90) * Math.PI / 180;
+    }
+
+    // 背景グラデーション（中心から薄い青がかかるグラデーション）
+    const bgGradient = ctx.createRadialGradient(
+        centerX, centerY, 0,
+        centerX, centerY, radius * 1.5
+    );
+    bgGradient.addColorStop(0,   "#f0f8ff");
+    bgGradient.addColorStop(0.7, "#cceeff");
+    bgGradient.addColorStop(1,   "#99bbff");
+    ctx.fillStyle = bgGradient;
+    ctx.fillRect(0, 0, canvas.width, canvas.height);
+
+    // 外円描画（ゴールドの外枠）
+    ctx.save();
+    ctx.beginPath();
+    ctx.arc(centerX, centerY, radius + 10, 0, 2 * Math.PI);
+    ctx.shadowColor = 'rgba(30, 144, 255, 0.5)'; // 濃い青色のシャドウ
+    ctx.shadowBlur = 10;
+    ctx.strokeStyle = '#E0FFFF'; // プラチナシルバー
+    ctx.lineWidth = 4;
+    ctx.stroke();
+    ctx.restore();
+
+    // ハウス線とハウス番号（ハウス番号の色を黒に変更）
+    if (houseData && houseData.cusp) {
+        for (let i = 0; i < houseData.cusp.length; i++) {
+            const cuspAngleDeg = houseData.cusp[i];
+            const angleRad = degToRad(cuspAngleDeg);
+
+            const x2 = centerX + (radius + 10) * Math.cos(angleRad);
+            const y2 = centerY + (radius + 10) * Math.sin(angleRad);
+
+            ctx.save();
+            ctx.beginPath();
+            ctx.moveTo(centerX, centerY);
+            ctx.lineTo(x2, y2);
+            ctx.strokeStyle = 'rgba(0, 0, 0, 0.5)'; // 黒
+            ctx.lineWidth = 1;
+            ctx.setLineDash([6, 4]); // 点線
+            ctx.stroke();
+            ctx.restore();
+
+            // ハウス番号を白で描画
+            const labelRadius = radius * 0.5;
+            const labelX = centerX + labelRadius * Math.cos(angleRad - 0.26);
+            const labelY = centerY + labelRadius * Math.sin(angleRad - 0.26);
+
+            ctx.save();
+            ctx.font = Math.floor(canvas.width * 0.025) + "px 'Times New Roman'";
+            ctx.fillStyle = "#000000"; // 黒
+            ctx.textAlign = "center";
+            ctx.textBaseline = "middle";
+            ctx.fillText((i + 1).toString(), labelX, labelY);
+            ctx.restore();
+        }
+    }
+
+    // ★ 惑星配置
+    const planets = horoscopeData?.raw_data?.planets;
+    if (!planets) {
+        alert("惑星データが見つかりません。");
+        return;
+    }
+    const planetPositions = {};
+    // drawnSymbols 配列は adjust 関数用（シンボル位置の調整用）
+    const drawnSymbols = [];
+    // planetSymbolsToDraw 配列にシンボル描画情報を保存し、後で最前面に描画する
+    const planetSymbolsToDraw = [];
+
+    /**
+     * adjust 関数
+     * 惑星シンボル同士が重なっている場合、元の位置から offset ずらした位置を返し、
+     * その位置と元の位置を線分で結びます。
+     *
+     * @param {CanvasRenderingContext2D} ctx - canvas のコンテキスト
+     * @param {number} x - 元の x 座標
+     * @param {number} y - 元の y 座標
+     * @param {number} angle - 惑星配置の角度 (ラジアン)
+     * @param {Array} drawnSymbols - 既に描画済みのシンボルの位置リスト
+     * @returns {Object} 調整後の {x, y} 座標
+     */
+    function adjust(ctx, x, y, angle, drawnSymbols) {
+        const offsetStep = 30;         // 30px ずつずらす
+        let offset = 0;
+        let newX = x;
+        let newY = y;
+        const collisionThreshold = 15; // 中心間距離が15px未満なら重なっていると判定
+
+        while (true) {
+            let collision = false;
+            for (let pos of drawnSymbols) {
+                const dx = pos.x - newX;
+                const dy = pos.y - newY;
+                const distance = Math.sqrt(dx * dx + dy * dy);
+                if (distance < collisionThreshold) {
+                    collision = true;
+                    break;
+                }
+            }
+            if (!collision) {
+                break;
+            }
+            offset += offsetStep;
+            newX = x - offset * Math.cos(angle);
+            newY = y - offset * Math.sin(angle);
+            // 無限ループ防止のための上限
+            if (offset > 100) break;
+        }
+
+        // ずらしが発生していた場合、元の位置と調整後の位置を線分で結ぶ
+        if (offset > 0) {
+            ctx.save();
+            ctx.beginPath();
+            ctx.moveTo(x, y);
+            ctx.lineTo(newX, newY);
+            ctx.strokeStyle = "rgba(255,255,255,0.5)";
+            ctx.lineWidth = 0.5;
+            ctx.stroke();
+            ctx.restore();
+        }
+        drawnSymbols.push({ x: newX, y: newY });
+        return { x: newX, y: newY };
+    }
+
+    // 各惑星の描画（惑星の円はそのまま描く）
+    for (const planetName of Object.keys(planets)) {
+        const planetObj = planets[planetName];
+        if (planetObj.longitude === undefined) continue;
+
+        let lonDeg = Array.isArray(planetObj.longitude)
+            ? planetObj.longitude[0]
+            : parseFloat(planetObj.longitude);
+        if (isNaN(lonDeg)) continue;
+
+        const angleRad = degToRad(lonDeg);
+        const x = centerX + radius * Math.cos(angleRad);
+        const y = centerY + radius * Math.sin(angleRad);
+
+        // 惑星の円を描画（高級感のある色合い）
+        ctx.save();
+        ctx.beginPath();
+        ctx.arc(x, y, canvas.width * 0.008, 0, 2 * Math.PI);
+        let fillColor = '#dd3333';
+        switch (planetName) {
+            case 'Sun'     : fillColor = '#D4AF37'; break;  // ゴールド
+            case 'Moon'    : fillColor = '#C0C0C0'; break;  // シルバー
+            case 'Mercury' : fillColor = '#708090'; break;  // スレートグレー
+            case 'Venus'   : fillColor = '#B87333'; break;  // カッパー
+            case 'Mars'    : fillColor = '#8B0000'; break;  // ダークレッド
+            case 'Jupiter' : fillColor = '#CD7F32'; break;  // ブロンズ
+            case 'Saturn'  : fillColor = '#A67B5B'; break;  // ブロンズ系
+            case 'Uranus'  : fillColor = '#008080'; break;  // ティール
+            case 'Neptune' : fillColor = '#00008B'; break;  // ネイビー
+            case 'Pluto'   : fillColor = '#800080'; break;  // パープル
+        }
+        ctx.fillStyle = fillColor;
+        ctx.shadowColor = 'rgba(0, 0, 0, 0.3)'; // 黒色のシャドウ
+        ctx.shadowBlur = 6;
+        ctx.fill();
+        ctx.restore();
+
+        // adjust 関数でシンボルの位置を調整（重なりがあれば線分も描画）
+        const symbol = planetSymbolMap[planetName] || planetName;
+        const adjustedPos = adjust(ctx, x, y, angleRad, drawnSymbols);
+        // ※ 惑星シンボルは黒で描画（fillStyle を "#000000" に変更）
+        planetSymbolsToDraw.push({
+            symbol: symbol,
+            x: adjustedPos.x,
+            y: adjustedPos.y,
+            font: Math.floor(canvas.width * 0.08) + "px sans-serif",
+            fillStyle: "#000000" // 黒
+        });
+
+        planetPositions[planetName] = { x, y };
+    }
+    // ノード情報を取得
+    const nodes = horoscopeData?.raw_data?.nodes;
+    if (nodes && nodes["True Node"] && Array.isArray(nodes["True Node"].longitude)) {
+        const rawNodeLon = nodes["True Node"].longitude[0];
+        const nodeLon    = parseFloat(rawNodeLon);
+        if (!isNaN(nodeLon)) {
+            // ドラゴンヘッド（North Node）
+            const headDeg = nodeLon % 360;
+            // ドラゴンテイル（South Node）
+            const tailDeg = (headDeg + 180) % 360;
+
+            // 共通の描画関数
+            function drawNode(deg, symbol, fillColor) {
+                const angleRad = degToRad(deg);
+                const x = centerX + radius * Math.cos(angleRad);
+                const y = centerY + radius * Math.sin(angleRad);
+
+                // 円を描く
+                ctx.save();
+                ctx.beginPath();
+                ctx.arc(x, y, canvas.width * 0.008, 0, 2 * Math.PI);
+                ctx.fillStyle = fillColor;
+                ctx.shadowColor = 'rgba(0,0,0,0.3)';
+                ctx.shadowBlur = 6;
+                ctx.fill();
+                ctx.restore();
+
+                // シンボルを adjust して描画
+                const adjusted = adjust(ctx, x, y, angleRad, drawnSymbols);
+                planetSymbolsToDraw.push({
+                    symbol: symbol,
+                    x: adjusted.x,
+                    y: adjusted.y,
+                    font: Math.floor(canvas.width * 0.08) + "px sans-serif",
+                    fillStyle: "#000000"
+                });
+
+                // 位置を planetPositions にも保存してアスペクト線で使う
+                planetPositions[symbol] = { x, y };
+            }
+
+            // ドラゴンヘッド：シンボル ☊、色を紫（例）に
+            drawNode(headDeg, "☊", "#800080");
+            // ドラゴンテイル：シンボル ☋、色を濃緑（例）に
+            drawNode(tailDeg, "☋", "#008000");
+        }
+    }
+
+
+    // アスペクト描画
+    const aspects = horoscopeData?.analysis?.["4.アスペクトの結果"] || [];
+    aspects.forEach(aspect => {
+        const planet1Ja = aspect.planet1;
+        const planet2Ja = aspect.planet2;
+        const aspectName = aspect.aspect;
+        let p1En = null, p2En = null;
+        for (const [en, ja] of Object.entries(planetNameMap)) {
+            if (ja === planet1Ja) p1En = en;
+            if (ja === planet2Ja) p2En = en;
+        }
+        if (!p1En || !p2En) return;
+
+        const pos1 = planetPositions[p1En];
+        const pos2 = planetPositions[p2En];
+        // ② フォールバックでノードを symbol キーにマッピング
+        if (!p1En) {
+            if (planet1Ja === "ドラゴンヘッド")  p1En = "☊";
+            if (planet1Ja === "ドラゴンテイル") p1En = "☋";
+        }
+        if (!p2En) {
+            if (planet2Ja === "ドラゴンヘッド")  p2En = "☊";
+            if (planet2Ja === "ドラゴンテイル") p2En = "☋";
+        }
+        if (!pos1 || !pos2) return;
+
+        let lineColor = aspectColorMap[aspectName] || "#AAAAAA"; // パステル調の色
+
+        ctx.save();
+        ctx.beginPath();
+        ctx.moveTo(pos1.x, pos1.y);
+        ctx.lineTo(pos2.x, pos2.y);
+        ctx.strokeStyle = lineColor;
+        ctx.lineWidth = canvas.width * 0.002;
+        if (aspectName === "スクエア" || aspectName === "Square") {
+            ctx.setLineDash([5, 3]);
+        }
+        ctx.stroke();
+        ctx.restore();
+    });
+
+    const zodiacColors = [
+        "#FF0000", // Red (牡羊座)
+        "#808000", // Dark Yellow (牡牛座)　
+        "#008000", // Green (双子座)
+        "#0000FF", // Blue (蟹座)
+        "#FF0000", // Red (獅子座)
+        "#808000", // Dark Yellow (乙女座)　
+        "#008000", // Green (天秤座)
+        "#0000FF", // Blue (蠍座)
+        "#FF0000", // Red (射手座)
+        "#808000", // Dark Yellow (山羊座)　
+        "#008000", // Green (水瓶座)
+        "#0000FF", // Blue (魚座)
+    ];
+
+    // ★ 星座の区分線およびシンボルの描画（修正版）
+    ctx.save();
+    // 内側のホロスコープ円（radius）はそのまま利用
+    // 内側の区分線の開始位置（ホロスコープ円から少し外側）
+    const innerDividingRadius = radius + (canvas.width * 0.017);
+    // 星座シンボルを描く半径（内側と外側の中間あたり）
+    const zodiacSymbolRadius = radius + (canvas.width * 0.06);
+    // 外側に描く大きな円の半径（星座シンボルの外側＋余白）
+    const outerCircleRadius = zodiacSymbolRadius + (canvas.width * 0.03);
+
+    for (let i = 0; i < 12; i++) {
+        // degToRad が反転しているので、開始角度と終了角度を入れ替えています
+        const startAngle = degToRad((i + 1) * 30);
+        const endAngle   = degToRad(i * 30);
+
+        ctx.beginPath();
+        // 外側円弧の開始点に移動
+        ctx.moveTo(
+            centerX + outerCircleRadius * Math.cos(startAngle),
+            centerY + outerCircleRadius * Math.sin(startAngle)
+        );
+        // 外側の円弧を描く（startAngle ～ endAngle）
+        ctx.arc(centerX, centerY, outerCircleRadius, startAngle, endAngle, false);
+        // 外側の円弧の終点と内側の円弧の開始点を直接結ぶ
+        ctx.lineTo(
+            centerX + innerDividingRadius * Math.cos(endAngle),
+            centerY + innerDividingRadius * Math.sin(endAngle)
+        );
+        // 内側の円弧を描く（endAngle ～ startAngle を逆方向に）
+        ctx.arc(centerX, centerY, innerDividingRadius, endAngle, startAngle, true);
+        // パスを閉じる（自動的に内側の円弧の終点と外側の円弧の開始点を結ぶ）
+        ctx.closePath();
+
+        // ctx.fillStyle = zodiacColors[i];
+        ctx.fill();
+    }
+
+    // ① 外側の大円の外周を描画（ゴールドのライン）
+    ctx.beginPath();
+    ctx.arc(centerX, centerY, outerCircleRadius, 0, 2 * Math.PI);
+    ctx.strokeStyle = '#D4AF37';
+    ctx.lineWidth = 4;
+    ctx.stroke();
+
+    // ② 星座区分線と星座シンボルの描画
+    for (let i = 0; i < 12; i++) {
+        // 各星座の境界線の角度（0～360°）
+        const lineAngle = degToRad(i * 30);
+        // 区分線は内側（innerDividingRadius）から外側の大円（outerCircleRadius）まで
+        ctx.beginPath();
+        ctx.moveTo(
+            centerX + innerDividingRadius * Math.cos(lineAngle),
+            centerY + innerDividingRadius * Math.sin(lineAngle)
+        );
+        ctx.lineTo(
+            centerX + outerCircleRadius * Math.cos(lineAngle),
+            centerY + outerCircleRadius * Math.sin(lineAngle)
+        );
+        ctx.strokeStyle = "rgba(50, 50, 50, 0.8)"; // 濃いグレー
+        ctx.lineWidth = 1;
+        ctx.stroke();
+
+        // 星座シンボルは区分線の中央あたりに配置（色を黒に変更）
+        const midAngleRad = degToRad(i * 30 + 15);
+        // シンボルを配置する半径は内側と外側の中間
+        const symbolRadius = (innerDividingRadius + outerCircleRadius) / 2;
+        const textX = centerX + symbolRadius * Math.cos(midAngleRad);
+        const textY = centerY + symbolRadius * Math.sin(midAngleRad);
+
+        ctx.save();
+        ctx.translate(textX, textY);
+        ctx.font = Math.floor(canvas.width * 0.05) + "px 'Segoe UI Symbol', 'Arial', sans-serif"; 
+        ctx.fillStyle = "#000000";
+        ctx.textAlign = "center";
+        ctx.textBaseline = "middle";
+        ctx.fillText(zodiacSymbols[i], 0, 0);
+        ctx.restore();
+    }
+    ctx.restore();
+
+    // ★ 最後に、保存しておいた惑星シンボルを再描画して最前面に表示（色を黒に変更）
+    planetSymbolsToDraw.forEach(item => {
+        ctx.save();
+        ctx.font = item.font;
+        ctx.fillStyle = item.fillStyle;
+        ctx.textAlign = "center";
+        ctx.textBaseline = "middle";
+        ctx.fillText(item.symbol, item.x, item.y);
+        ctx.restore();
+    });
+}
+
+// prefix = "1" or "2"（フォームから送信用パラメータを作る）
+function buildParamsFromForm(prefix) {
+    const form = document.getElementById('horoscope-form');
+    const fd = new FormData(form);
+
+    const year  = fd.get('year' + prefix);
+    const month = fd.get('month' + prefix);
+    const day   = fd.get('day' + prefix);
+    const time  = fd.get('time' + prefix) || '12:00';
+    const prefecture = fd.get('prefecture' + prefix);
+    const lat   = fd.get('lat' + prefix);
+    const lon   = fd.get('lon' + prefix);
+    const tz    = fd.get('tz' + prefix);
+    const dst   = fd.get('dst' + prefix);
+
+    const [hour, minute] = time.split(':');
+
+    return new URLSearchParams({
+    year, month, day,
+    hour, minute,
+    lat, lon,
+    tz, dst,
+    prefecture
+    });
+}
+
+// POST で取得 → キャンバス描画 → Cookie 保存（必要なら）
+async function fetchHoroscopeAndDraw(prefix, containerId, canvasId, alsoSaveCookies = true) {
+    const params = buildParamsFromForm(prefix);
+    const url = pageUrls.horoscopeUrl;
+
+    const response = await fetch(url, {
+    method: 'POST',
+    credentials: 'same-origin',
+    headers: {
+        'Content-Type': 'application/x-www-form-urlencoded',
+        'X-CSRFToken': getCookie('csrftoken')
+    },
+    body: params.toString()
+    });
+
+    if (!response.ok) {
+    throw new Error('ホロスコープデータの取得に失敗しました');
+    }
+
+    const data = await response.json();
+
+    const chartContainer = document.getElementById(containerId);
+    chartContainer.style.display = 'block';
+    // 既存の drawHoroscopeWheel(horoscopeData, containerId, canvasId) を使用
+    drawHoroscopeWheel(data, containerId, canvasId);
+
+    if (alsoSaveCookies && typeof saveFormDataToCookies === 'function') {
+    const form = document.getElementById('horoscope-form');
+    saveFormDataToCookies(new FormData(form));
+    }
+}
+
+// ---------- イベント: ボタン（1人目） ----------
+const btn1 = document.getElementById('draw-button1');
+if (btn1) {
+    btn1.addEventListener('click', async function () {
+    try {
+        await fetchHoroscopeAndDraw('1', 'chart-container1', 'horoscope-canvas1', true);
+    } catch (e) {
+        alert(e.message);
+        console.error(e);
+    }
+    });
+}
+
+// ---------- イベント: 画面読み込み時（1人目） ----------
+document.addEventListener('DOMContentLoaded', async function () {
+    try {
+    await fetchHoroscopeAndDraw('1', 'chart-container1', 'horoscope-canvas1', true);
+    } catch (e) {
+    // 初回は静かに
+    console.warn(e);
+    }
+});
+
+// ---------- イベント: ボタン（2人目） ----------
+const btn2 = document.getElementById('draw-button2');
+if (btn2) {
+    btn2.addEventListener('click', async function () {
+    try {
+        await fetchHoroscopeAndDraw('2', 'chart-container2', 'horoscope-canvas2', true);
+    } catch (e) {
+        alert(e.message);
+        console.error(e);
+    }
+    });
+}
+
+// ---------- イベント: 画面読み込み時（2人目） ----------
+document.addEventListener('DOMContentLoaded', async function () {
+    try {
+    await fetchHoroscopeAndDraw('2', 'chart-container2', 'horoscope-canvas2', true);
+    } catch (e) {
+    console.warn(e);
+    }
+});
+
+
+// 詳細画面へリンク
+
+document.getElementById('view-button1').addEventListener('click', function() {
+const form = document.getElementById('horoscope-form');
+const formData = new FormData(form);
+const year  = formData.get('year1');
+const month = formData.get('month1');
+const day   = formData.get('day1');
+const time  = formData.get('time1') || "12:00";
+const prefecture = formData.get('prefecture1');
+const lat   = formData.get('lat1');
+const lon   = formData.get('lon1');
+const tz    = formData.get('tz1');
+const dst   = formData.get('dst1');
+
+const [hour, minute] = time.split(':');
+
+const params = new URLSearchParams({
+    year, month, day,
+    hour, minute,
+    lat, lon,
+    tz, dst,
+    prefecture
+});
+
+saveFormDataToCookies(formData);
+
+const horoscopeUrl = pageUrls.detailUrl + "?" + params.toString();
+window.location.href = horoscopeUrl;
+});
+document.getElementById('view-button2').addEventListener('click', function() {
+const form = document.getElementById('horoscope-form');
+const formData = new FormData(form);
+const year  = formData.get('year2');
+const month = formData.get('month2');
+const day   = formData.get('day2');
+const time  = formData.get('time2') || "12:00";
+const prefecture = formData.get('prefecture2');
+const lat   = formData.get('lat2');
+const lon   = formData.get('lon2');
+const tz    = formData.get('tz2');
+const dst   = formData.get('dst2');
+
+const [hour, minute] = time.split(':');
+
+const params = new URLSearchParams({
+    year, month, day,
+    hour, minute,
+    lat, lon,
+    tz, dst,
+    prefecture
+});
+
+saveFormDataToCookies(formData);
+
+const horoscopeUrl = pageUrls.detailUrl + "?" + params.toString();
+window.location.href = horoscopeUrl;
+});
+
+document.getElementById("copyBtn").addEventListener("click", function (event) {
+    event.preventDefault(); // デフォルト動作を防ぐ（フォーム内などで有効）
+    const text = document.getElementById("result").innerText;
+    navigator.clipboard.writeText(text).then(() => {
+        alert("コピーしました！");
+    }).catch(err => {
+        alert("コピーに失敗しました: " + err);
+    });
+});
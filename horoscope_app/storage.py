@@ -0,0 +1,21 @@
+# horoscope_app/storage.py
+"""
+静的ファイルのストレージ。
+"""
+from whitenoise.storage import CompressedManifestStaticFilesStorage
+
+
+class HashedStaticFilesStorage(CompressedManifestStaticFilesStorage):
+    """
+    collectstatic でファイル名に内容のハッシュを付け、gzip/brotli 圧縮版も作るストレージ。
+
+    collectstatic を実行する前(開発環境など)はハッシュ名が求まらないため、
+    エラーにせず元のファイル名で参照する。
+    """
+    manifest_strict = False
+
+    def hashed_name(self, name, content=None, filename=None):
+        try:
+            return super().hashed_name(name, content, filename)
+        except ValueError:
+            return name
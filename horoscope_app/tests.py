@@ -1,3 +1,235 @@
-from django.test import TestCase
+import json
+import threading
+import time
 
-# Create your tests here.
+import swisseph as swe
+from django.conf import settings
+from django.core.cache import cache
+from django.test import TestCase, override_settings
+
+from . import llm, metrics, progressions, usage
+from .management.commands.fake_openai import FakeOpenAI, make_server
+from .geocoding import get_gazetteer
+from .timezones import JAPAN_ZONE, resolve_offset, zone_for
+from .utils import DEFAULT_AYANAMSA, ayanamsa_offset
+from .validation import parse_birth_input
+from .views import _yearly_transits
+
+FALLBACK_TEXT = "定型文"
+COOLDOWN = 0.3
+BIRTH = {"year": 1990, "month": 5, "day": 3, "hour": 14, "minute": 30, "prefecture": "Tokyo"}
+
+
+class LLMResilienceTests(TestCase):
+    """
+    llm.complete の縮退 (タイムアウト・ヘッジ・サーキットブレーカー・代替の回答) の確認。
+    fake_openai のサーバーをローカルのポートに起動し、接続先をそこへ向ける (llm_resilience コマンドと同じ場面)。
+    """
+
+    def setUp(self):
+        self.fake = FakeOpenAI(latency=0.05, jitter=0.0, distribution="fixed", error_rate=0.0,
+                               error_statuses=[500, 503], chars=100, stream_chunks=1, seed=0)
+        server = make_server(self.fake, "127.0.0.1", 0)
+        thread = threading.Thread(target=server.serve_forever, daemon=True)
+        thread.start()
+        self.addCleanup(server.server_close)
+        self.addCleanup(server.shutdown)
+
+        overrides = self.settings(
+            OPENAI_API_KEY="fake", OPENAI_BASE_URL=f"http://127.0.0.1:{server.server_address[1]}/v1",
+            LLM_MIN_SAMPLES=10, LLM_TIMEOUT_MIN=0.3, LLM_HEDGE_MIN_DELAY=0.05,
+            LLM_BREAKER_FAILURES=3, LLM_BREAKER_COOLDOWN=COOLDOWN,
+            LLM_USAGE_BATCH_SIZE=10 ** 9, LLM_USAGE_FLUSH_SECONDS=float("inf"),
+            RATELIMIT_ENABLED=False, ALLOWED_HOSTS=[*settings.ALLOWED_HOSTS, "testserver"])
+        overrides.enable()
+        self.addCleanup(overrides.disable)
+
+        llm.latency.reset()
+        llm.breaker.reset()
+        metrics.reset()
+        cache.clear()
+        usage.reset()
+        self.addCleanup(usage.reset)
+
+    def _call(self, prompt: str) -> tuple[llm.Reply, float]:
+        started = time.perf_counter()
+        reply = llm.complete(prompt, lambda: FALLBACK_TEXT)
+        return reply, time.perf_counter() - started
+
+    def _warm_up(self, count: int = 10) -> None:
+        """速い応答を count 件計測させる (タイムアウトの調整・ヘッジが有効になる)。"""
+        for i in range(count):
+            self._call(f"正常 {i}")
+
+    def _open_breaker(self) -> None:
+        self.fake.error_rate = 1.0
+        for i in range(settings.LLM_BREAKER_FAILURES):
+            self._call(f"エラー {i}")
+        self.assertEqual(llm.breaker.state, llm.CircuitBreaker.OPEN)
+
+    def test_normal_call(self):
+        reply, _ = self._call("正常")
+        self.assertEqual(reply.source, "llm")
+        self.assertFalse(reply.degraded)
+        self.assertTrue(reply.text)
+        self.assertEqual(usage.pending_count(), 1)
+
+    def test_timeout_follows_recent_latency(self):
+        self.assertEqual(llm.latency.timeout(), settings.LLM_TIMEOUT_MAX)
+        self._warm_up()
+        self.assertLess(llm.latency.timeout(), settings.LLM_TIMEOUT_MAX)
+
+    def test_slow_call_is_hedged(self):
+        with self.settings(LLM_TIMEOUT_MIN=2.0):
+            self._warm_up()
+            self.fake.latency = 0.4
+            reply, _ = self._call("遅い")
+        self.assertEqual(reply.source, "llm")
+        self.assertGreater(metrics.snapshot().get("llm.hedged", 0), 0)
+
+    def test_hang_times_out_and_opens_breaker(self):
+        self._warm_up()
+        self.fake.latency = 5.0
+        results = [self._call(f"応答なし {i}") for i in range(settings.LLM_BREAKER_FAILURES)]
+        self.assertTrue(all(reply.source == "template" for reply, _ in results))
+        self.assertLess(max(seconds for _, seconds in results), 2.0)
+        self.assertEqual(llm.breaker.state, llm.CircuitBreaker.OPEN)
+
+        reply, seconds = self._call("遮断中")
+        self.assertEqual(reply.source, "template")
+        self.assertLess(seconds, 0.05)
+
+    def test_server_errors_fall_back_to_cached_answer(self):
+        answered, _ = self._call("答えたことのあるプロンプト")
+        self.fake.error_rate = 1.0
+        reply, _ = self._call("答えたことのあるプロンプト")
+        self.assertEqual(reply.source, "cache")
+        self.assertEqual(reply.text, answered.text)
+
+    def test_server_errors_fall_back_to_template(self):
+        self.fake.error_rate = 1.0
+        reply, _ = self._call("初めてのプロンプト")
+        self.assertEqual(reply.source, "template")
+        self.assertEqual(reply.text, FALLBACK_TEXT)
+
+    def test_breaker_closes_after_successful_trial(self):
+        self._open_breaker()
+        self.fake.error_rate = 0.0
+        reply, _ = self._call("遮断中")
+        self.assertEqual(reply.source, "template")
+
+        time.sleep(COOLDOWN)
+        reply, _ = self._call("復旧")
+        self.assertEqual(reply.source, "llm")
+        self.assertEqual(llm.breaker.state, llm.CircuitBreaker.CLOSED)
+
+    def test_oversized_prompt(self):
+        prompt = "チャート:\n  {\n    \"degree\": 123.456, \"formatted\": \"牡羊座 3°27'\"\n  }\n" * 200
+        estimated = usage.estimate_tokens(prompt)
+        with self.settings(LLM_PROMPT_TOKEN_LIMIT=int(estimated * 0.8), LLM_PROMPT_OVERSIZE="trim"):
+            _, trimmed_estimate, trimmed = usage.fit_prompt(prompt)
+            self.assertTrue(trimmed)
+            self.assertLess(trimmed_estimate, estimated)
+        with self.settings(LLM_PROMPT_TOKEN_LIMIT=int(estimated * 0.8), LLM_PROMPT_OVERSIZE="reject"):
+            with self.assertRaises(usage.PromptTooLarge):
+                llm.complete(prompt, lambda: FALLBACK_TEXT)
+
+    def test_analyze_returns_template_during_outage(self):
+        self._open_breaker()
+        response = self.client.post("/analyze/", {**BIRTH, "sb": 1})
+        self.assertEqual(response.status_code, 200)
+        body = response.json()
+        self.assertEqual(body.get("fallback"), "template")
+        self.assertIn("太陽", body["result"])
+
+    def test_analyze_time_unknown(self):
+        # 出生時刻不明のチャートにはハウスの項目が無い (LLM_ROUTES の sections にあっても飛ばす)
+        for sb in (1, 2, 3, 4, 5, 6, 9, 10, 19, 20):
+            with self.subTest(sb=sb):
+                response = self.client.post("/analyze/", {**BIRTH, "sb": sb, "unknown": "on"})
+                self.assertEqual(response.status_code, 200)
+                self.assertNotIn("fallback", response.json())
+
+
+@override_settings(ALLOWED_HOSTS=[*settings.ALLOWED_HOSTS, "testserver"])
+class GeocodingTests(TestCase):
+    """地名辞書の検索 (geocoding.Gazetteer)。"""
+
+    def test_autocomplete_by_reading(self):
+        # IME で変換する前のひらがな・カタカナ・半角カナでも引ける
+        for q in ("おおさ", "オオサ", "ｵｵｻ", "大阪", "osa"):
+            with self.subTest(q=q):
+                response = self.client.get("/geocode/autocomplete/", {"q": q, "limit": 5})
+                self.assertEqual(response.status_code, 200)
+                names = [place["name_ja"] for place in response.json()["results"]]
+                self.assertEqual(names[:2], ["大阪府", "大阪市"])
+
+    def test_lookup_by_reading(self):
+        gazetteer = get_gazetteer()
+        self.assertEqual(gazetteer.lookup("とうきょう").name_ja, "東京都")
+        self.assertEqual(gazetteer.lookup("よこはまし").name_ja, "横浜市")
+        self.assertEqual(gazetteer.lookup("ぺきん").name_ja, "北京")
+
+
+class TimezoneTests(TestCase):
+    """出生地のタイムゾーンの推定 (timezones.zone_for) とオフセットの解決 (resolve_offset)。"""
+
+    def test_korea_is_not_japan(self):
+        for name, lat, lon in (("済州", 33.4996, 126.5312), ("釜山", 35.1796, 129.0756),
+                               ("木浦", 34.8118, 126.3922), ("麗水", 34.7604, 127.6622)):
+            with self.subTest(name=name):
+                self.assertEqual(zone_for("", lat, lon), "Asia/Seoul")
+
+    def test_japanese_islands_near_korea(self):
+        for name, lat, lon in (("対馬", 34.2026, 129.2878), ("対馬の北端", 34.68, 129.43),
+                               ("五島", 32.6955, 128.8412)):
+            with self.subTest(name=name):
+                self.assertEqual(zone_for("", lat, lon), JAPAN_ZONE)
+
+    def test_coordinates_win_over_prefecture(self):
+        self.assertEqual(zone_for("Tokyo", 33.4996, 126.5312), "Asia/Seoul")
+        self.assertEqual(zone_for("Tokyo"), JAPAN_ZONE)
+
+    def test_japanese_dst_1948_1951(self):
+        # 日本のサマータイム: 1948〜1951年の5月 (1949年は4月) 上旬〜9月中旬。1952年以降は無い
+        for args, expected in (((1948, 5, 1, 12, 0), (9.0, 0.0)), ((1948, 5, 2, 12, 0), (9.0, 1.0)),
+                               ((1948, 9, 11, 12, 0), (9.0, 1.0)), ((1948, 9, 12, 12, 0), (9.0, 0.0)),
+                               ((1949, 4, 3, 12, 0), (9.0, 1.0)), ((1950, 7, 1, 12, 0), (9.0, 1.0)),
+                               ((1951, 9, 9, 12, 0), (9.0, 0.0)), ((1952, 7, 1, 12, 0), (9.0, 0.0))):
+            with self.subTest(date=args[:3]):
+                self.assertEqual(resolve_offset(JAPAN_ZONE, *args), expected)
+
+    def test_birth_in_jeju_uses_korean_history(self):
+        birth = parse_birth_input({"year": 1988, "month": 7, "day": 1, "hour": 12, "minute": 0,
+                                   "lat": 33.4996, "lon": 126.5312, "tz": 9.0, "dst": 0.0})
+        self.assertEqual(birth.tzid, "Asia/Seoul")
+        self.assertEqual((birth.tz, birth.dst), (9.0, 1.0))
+        self.assertEqual(resolve_offset("Asia/Seoul", 1958, 1, 1, 12, 0), (8.5, 0.0))
+
+
+class YearlyTransitTests(TestCase):
+    """1年の運勢 (sb 10/20) に使うトランジットが出生チャートの黄道帯に合っているか。"""
+
+    def test_sidereal_birth_gets_sidereal_transits(self):
+        params = {"year": 1990, "month": 5, "day": 3, "hour": 14, "minute": 30, "prefecture": "Tokyo"}
+        tropical, _ = _yearly_transits(parse_birth_input(params), 2025, False)
+        sidereal, _ = _yearly_transits(parse_birth_input({**params, "zodiac": "sidereal"}), 2025, False)
+        sun_tropical = json.loads(tropical[1])["太陽"]["degree"]
+        sun_sidereal = json.loads(sidereal[1])["太陽"]["degree"]
+        expected = ayanamsa_offset(swe.julday(2025, 1, 1, 3.0, swe.GREG_CAL), DEFAULT_AYANAMSA)
+        self.assertAlmostEqual((sun_tropical - sun_sidereal) % 360, expected, delta=0.01)
+
+
+class ReturnChartTests(TestCase):
+    """リターン・進行のチャート (progressions._chart_at)。"""
+
+    def test_return_chart_uses_local_time_and_extra_bodies(self):
+        birth = parse_birth_input({"year": 1990, "month": 7, "day": 1, "hour": 12, "minute": 0,
+                                   "prefecture": "Tokyo", "bodies": "chiron"})
+        entry = next(progressions.iter_solar_returns(birth, 2026, 2026, with_chart=True))
+        info = entry["chart"]["9.生年月日と出生地"]
+        self.assertEqual((info["timezone"], info["dst"]), (9.0, 0.0))
+        # UT 2026-06-30 19:56:55 → 現地時刻 2026-07-01 04:57 (分に丸める)
+        self.assertEqual(entry["local"][:16], "2026-07-01T04:56")
+        self.assertEqual((info["month"], info["day"], info["hour"], info["minute"]), (7, 1, 4, 57))
+        self.assertIn("キロン", entry["chart"]["1.天体の配置"])
@@ -0,0 +1,152 @@
+# horoscope_app/timezones.py
+"""
+出生地と現地時刻から UTC オフセット(タイムゾーン・サマータイム)を求める。
+
+クライアントから送られる tz/dst をそのまま使うと、
+日本のサマータイム(1948〜1951年)や海外の出生地で誤った時刻になるため、
+IANA タイムゾーン(zoneinfo)から正しいオフセットを求める。
+
+ゾーンごとに 1900〜2100年のオフセット切替表を一度だけ作ってメモリに保持し、
+以降の解決は二分探索(bisect)だけで行う。大量レコードのバッチ処理向け。
+"""
+from bisect import bisect_right
+from datetime import datetime, timedelta, timezone
+from functools import lru_cache
+from zoneinfo import ZoneInfo, ZoneInfoNotFoundError
+
+from .geocoding import get_gazetteer, nearest_place
+
+TABLE_START_YEAR = 1899   # 1900年1月1日の現地時刻が UTC では前年になる場合があるため
+TABLE_END_YEAR = 2101
+JAPAN_ZONE = "Asia/Tokyo"
+NEAREST_CITY_MAX_KM = 150   # 緯度経度から都市のタイムゾーンを採用する最大距離
+
+# フォームの出生地(都道府県)の値
+JAPAN_PREFECTURES = frozenset({
+    "Hokkaido", "Aomori", "Iwate", "Miyagi", "Akita", "Yamagata", "Fukushima",
+    "Ibaraki", "Tochigi", "Gunma", "Saitama", "Tokyo", "Chiba", "Kanagawa",
+    "Niigata", "Toyama", "Ishikawa", "Fukui", "Yamanashi", "Nagano", "Gifu",
+    "Shizuoka", "Aichi", "Mie", "Shiga", "Kyoto", "Osaka", "Hyogo", "Nara",
+    "Wakayama", "Tottori", "Shimane", "Okayama", "Hiroshima", "Yamaguchi",
+    "Tokushima", "Kagawa", "Ehime", "Kochi", "Fukuoka", "Saga", "Nagasaki",
+    "Kumamoto", "Oita", "Miyazaki", "Kagoshima", "Okinawa",
+})
+
+_EPOCH = datetime(1970, 1, 1, tzinfo=timezone.utc)
+
+
+def _days_from_civil(y: int, m: int, d: int) -> int:
+    """グレゴリオ暦の日付を 1970-01-01 からの通日に変換する（datetime を作らない高速版）。"""
+    y -= m <= 2
+    era = (y if y >= 0 else y - 399) // 400
+    yoe = y - era * 400
+    doy = (153 * (m + (-3 if m > 2 else 9)) + 2) // 5 + d - 1
+    doe = yoe * 365 + yoe // 4 - yoe // 100 + doy
+    return era * 146097 + doe - 719468
+
+
+def _offsets_at(zone: ZoneInfo, utc_seconds: int) -> tuple[int, int]:
+    local = (_EPOCH + timedelta(seconds=utc_seconds)).astimezone(zone)
+    return (int(local.utcoffset().total_seconds()),
+            int((local.dst() or timedelta(0)).total_seconds()))
+
+
+@lru_cache(maxsize=64)
+def offset_table(zone_name: str) -> tuple[list[int], list[tuple[int, int]]]:
+    """
+    ゾーンの切替表を返す。
+
+    :return: (local_starts, offsets)
+        local_starts[i] 以降の現地時刻(1970年からの秒, 壁時計基準)には
+        offsets[i] = (UTCオフセット秒, うちサマータイム分の秒) が適用される。
+        存在しない時刻・重複する時刻は zoneinfo の fold=0 と同じく切替前のオフセットになる。
+    """
+    zone = ZoneInfo(zone_name)
+    start = _days_from_civil(TABLE_START_YEAR, 1, 1) * 86400
+    end = _days_from_civil(TABLE_END_YEAR, 1, 1) * 86400
+
+    local_starts = [-(1 << 62)]
+    offsets = [_offsets_at(zone, start)]
+    prev = offsets[0]
+    t = start
+    while t < end:
+        nxt = t + 86400
+        cur = _offsets_at(zone, nxt)
+        if cur != prev:
+            # 1日の中で切替時刻を分単位まで二分探索
+            lo, hi = t, nxt
+            while hi - lo > 60:
+                mid = (lo + hi) // 2 // 60 * 60
+                if mid <= lo:
+                    break
+                if _offsets_at(zone, mid) == prev:
+                    lo = mid
+                else:
+                    hi = mid
+            local_starts.append(hi + max(prev[0], cur[0]))
+            offsets.append(cur)
+            prev = cur
+        t = nxt
+    return local_starts, offsets
+
+
+def resolve_offset(zone_name: str, year: int, month: int, day: int,
+                   hour: int, minute: int) -> tuple[float, float]:
+    """
+    現地時刻に適用される (タイムゾーン時間, サマータイム時間) を返す。
+    compute_horoscope の tz, dst 引数にそのまま渡せる。
+    """
+    local_starts, offsets = offset_table(zone_name)
+    local = _days_from_civil(year, month, day) * 86400 + hour * 3600 + minute * 60
+    utcoffset, dst = offsets[bisect_right(local_starts, local) - 1]
+    return (utcoffset - dst) / 3600.0, dst / 3600.0
+
+
+def is_valid_zone(zone_name: str) -> bool:
+    try:
+        ZoneInfo(zone_name)
+    except (ZoneInfoNotFoundError, ValueError):
+        return False
+    return True
+
+
+def _in_japan(lat: float, lon: float) -> bool:
+    """
+    緯度経度が日本国内かを粗く判定する（朝鮮半島・済州島・沿海州・台湾を除外）。
+    韓国は日本とサマータイム・標準時の歴史が違う (1954〜1961年は +8:30 など) ため、
+    対馬・五島列島は日本に残しつつ、朝鮮半島の南岸と済州島まで除く。
+    """
+    if not (24.0 <= lat <= 45.6 and 122.9 <= lon <= 154.0):
+        return False
+    if lat >= 34.72 and lon < 129.6:    # 朝鮮半島 (対馬の北端は 34.70°N)
+        return False
+    if lat >= 34.3 and lon < 129.1:     # 巨済島など南岸の島 (対馬の西岸は 129.17°E)
+        return False
+    if lat >= 33.0 and lon < 128.0:     # 全羅南道の南岸・済州島 (五島列島は 128.6°E より東)
+        return False
+    if lat >= 41.3 and lon < 139.3:    # 沿海州
+        return False
+    return True
+
+
+def zone_for(prefecture: str = "", lat: float | None = None, lon: float | None = None) -> str | None:
+    """
+    出生地名または緯度経度から IANA タイムゾーン名を推定する。判定できなければ None。
+
+    緯度経度を優先する (出生地名が都道府県のままでも、国外の座標が送られていれば座標で判定する)。
+    日本国内の座標・都道府県は地名辞書を引かずに判定し、
+    それ以外は近くの都市(NEAREST_CITY_MAX_KM 以内) → 地名辞書の完全一致 の順に探す。
+    """
+    if lat is not None and lon is not None:
+        if _in_japan(lat, lon):
+            return JAPAN_ZONE
+        found = nearest_place(lat, lon, NEAREST_CITY_MAX_KM)
+        if found is not None:
+            return found[0].tz
+    if prefecture in JAPAN_PREFECTURES:
+        return JAPAN_ZONE
+    if prefecture:
+        place = get_gazetteer().lookup(prefecture)
+        if place is not None:
+            return place.tz
+    return None
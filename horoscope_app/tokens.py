@@ -0,0 +1,44 @@
+# horoscope_app/tokens.py
+"""
+ワンタイムトークン（/horoscope/ai/ の呼び出し許可）。
+
+トークンは「ランダムな nonce + 発行時刻」に HMAC 署名したもの(TimestampSigner)で、
+検証はサーバー側の状態なしで行える。セッション(DB)への書き込みは発生しない。
+使用済みの nonce は有効期限と同じ期間だけ Django キャッシュに記録し、再利用(リプレイ)を拒否する。
+
+LocMemCache の場合、使用済みの記録はワーカープロセス単位になる。
+全ワーカーで共有するには Redis/Memcached 等の共有キャッシュを設定する。
+"""
+import secrets
+
+from django.conf import settings
+from django.core import signing
+from django.core.cache import cache
+
+TOKEN_SALT = "horoscope_app.onetime-token"
+
+
+def _max_age() -> int:
+    return getattr(settings, "ONETIME_TOKEN_MAX_AGE", 60 * 60)
+
+
+def issue_token() -> str:
+    """新しいワンタイムトークンを発行する。"""
+    return signing.TimestampSigner(salt=TOKEN_SALT).sign(secrets.token_urlsafe(12))
+
+
+def consume_token(token: str) -> bool:
+    """
+    トークンを検証して使用済みにする。
+
+    :return: 署名が正しく、有効期限内で、まだ使われていなければ True
+    """
+    if not token:
+        return False
+    max_age = _max_age()
+    try:
+        nonce = signing.TimestampSigner(salt=TOKEN_SALT).unsign(token, max_age=max_age)
+    except signing.BadSignature:   # SignatureExpired を含む
+        return False
+    # add は既にキーがある場合は何もせず False を返すため、同時に使われても1回だけ成功する
+    return cache.add(f"onetime-token:{nonce}", 1, timeout=max_age)
@@ -12,10 +12,22 @@ urlpatterns = [
         content_type='text/plain'
     )),
     path('', views.index, name='index'),
+    path('token/', views.token, name='token'),  # ワンタイムトークン(キャッシュされたページから取得)
     path('horoscope/', views.horoscope, name='horoscope'),  # GET用のホロスコープAPI
     path('horoscope/ai/', views.horoscope_ai, name='horoscope_ai'),  # AI用のホロスコープAPI
     path('analyze/', views.analyze, name='analyze'),         # POSTで解析→OpenAI
+    path('horoscope/chart.svg', views.horoscope_chart_svg, name='horoscope_chart_svg'),
     path('horoscope/detail/', horoscope_detail, name='horoscope_detail'),
     path('compatibility/', views.compatibility, name='compatibility'),
     path('analyze_compatibility/', views.analyze_compatibility, name='analyze_compatibility'),
+    path('compatibility/score/', views.compatibility_score, name='compatibility_score'),  # LLMなしの相性スコア
+    path('compatibility/top/', views.compatibility_top, name='compatibility_top'),  # 登録済みチャートから相性の良い順
+    path('charts/similar/', views.similar_charts, name='similar_charts'),  # 登録済みチャートから似たものを検索
+    path('forecast/returns/', views.forecast_returns, name='forecast_returns'),
+    path('forecast/progression/', views.forecast_progression, name='forecast_progression'),
+    path('horoscope/transits/', views.transit_overlay, name='transit_overlay'),  # トランジットと出生図の関係の期間
+    path('metrics/', views.metrics_view, name='metrics'),  # 管理者向けメトリクス
+    path('metrics/llm-usage/', views.llm_usage_report, name='llm_usage_report'),  # 管理者向け OpenAI の使用量
+    path('geocode/autocomplete/', views.geocode_autocomplete, name='geocode_autocomplete'),
+    path('geocode/reverse/', views.geocode_reverse, name='geocode_reverse'),
 ]
@@ -0,0 +1,210 @@
+# horoscope_app/usage.py
+"""
+OpenAI 呼び出しのトークン数・費用の記録と集計、送信前のプロンプトの大きさの見積もり。
+
+- llm.complete が呼び出しごとに record() する。レコードはメモリに溜め、
+  LLM_USAGE_BATCH_SIZE 件または LLM_USAGE_FLUSH_SECONDS 秒ごとに bulk_create でまとめて書き込む
+  (リクエストごとに INSERT しない)。プロセス終了時にも残りを書き込む
+- estimate_tokens() は文字の種類から数える概算 (tiktoken を使わずに数マイクロ秒で済ませる)。
+  実際の prompt_tokens との比は report() の estimate_ratio で確認できる
+- 見積もりが LLM_PROMPT_TOKEN_LIMIT を超えるプロンプトは、LLM_PROMPT_OVERSIZE="trim" なら
+  チャートの JSON を縮めて (インデントと formatted と重複する数値を除いて) から送り、
+  それでも超える場合 (または "reject" の場合) は PromptTooLarge にする
+"""
+import atexit
+import datetime
+import re
+import threading
+import time
+
+from django.conf import settings
+from django.db.models import Avg, Count, Q, Sum
+from django.utils import timezone
+
+from . import metrics
+
+_lock = threading.Lock()
+_pending: list[dict] = []
+_last_flush = time.monotonic()
+
+# JSON (indent=2) の行頭のインデント
+_INDENT = re.compile(r"\n[ ]+")
+# "formatted" と同じ内容を表す数値の項目 (チャートの JSON を縮めるときに除く)
+_REDUNDANT_NUMBERS = re.compile(r'"(?:degree|deg_in_sign|cusp_degree)": -?\d+(?:\.\d+)?(?:e-?\d+)?, ')
+
+
+class PromptTooLarge(Exception):
+    """プロンプトの見積もりが上限を超えている。"""
+
+    def __init__(self, estimated: int, limit: int):
+        super().__init__(f"プロンプトが大きすぎます (見積もり {estimated} トークン, 上限 {limit})")
+        self.estimated = estimated
+        self.limit = limit
+
+
+def _setting(name: str, default):
+    return getattr(settings, name, default)
+
+
+# ---------------------------
+# 見積もり
+# ---------------------------
+
+def estimate_tokens(text: str) -> int:
+    """
+    プロンプトのトークン数の概算。
+    ASCII は4文字で約1トークン、日本語などそれ以外の文字は1文字で約 LLM_TOKENS_PER_CHAR トークンとする。
+    """
+    ascii_chars = len(text.encode("ascii", "ignore"))
+    other_chars = len(text) - ascii_chars
+    return int(ascii_chars / 4 + other_chars * _setting("LLM_TOKENS_PER_CHAR", 1.0)) + 1
+
+
+def compact_prompt(text: str) -> str:
+    """プロンプト中のチャートの JSON からインデントと重複する数値を除く。"""
+    return _REDUNDANT_NUMBERS.sub("", _INDENT.sub(" ", text))
+
+
+def fit_prompt(text: str) -> tuple[str, int, bool]:
+    """
+    プロンプトを上限に収める。
+
+    :return: (送るプロンプト, その見積もりトークン数, 縮めたかどうか)
+    :raises PromptTooLarge: 上限に収まらない場合
+    """
+    limit = _setting("LLM_PROMPT_TOKEN_LIMIT", 20000)
+    estimated = estimate_tokens(text)
+    if estimated <= limit:
+        return text, estimated, False
+    if _setting("LLM_PROMPT_OVERSIZE", "trim") == "trim":
+        compacted = compact_prompt(text)
+        estimated = estimate_tokens(compacted)
+        if estimated <= limit:
+            metrics.incr("llm.prompt_trimmed")
+            return compacted, estimated, True
+    metrics.incr("llm.prompt_rejected")
+    raise PromptTooLarge(estimated, limit)
+
+
+# ---------------------------
+# 記録
+# ---------------------------
+
+def record(endpoint: str, sb, model: str, source: str, prompt_tokens: int = 0, completion_tokens: int = 0,
+           estimated_prompt_tokens: int = 0, trimmed: bool = False, latency: float | None = None) -> None:
+    """呼び出し1回分の使用量をバッファに追加する (書き込みは flush でまとめて行う)。"""
+    now = timezone.now()
+    with _lock:
+        _pending.append({
+            "created_at": now, "day": timezone.localdate(now), "endpoint": endpoint, "sb": sb,
+            "model": model, "source": source, "prompt_tokens": prompt_tokens or 0,
+            "completion_tokens": completion_tokens or 0, "estimated_prompt_tokens": estimated_prompt_tokens,
+            "trimmed": trimmed, "latency_ms": None if latency is None else int(latency * 1000),
+        })
+
+
+def record_response(response, **fields) -> None:
+    """ChatCompletion のレスポンスの usage を記録する。"""
+    usage = getattr(response, "usage", None)
+    record(prompt_tokens=getattr(usage, "prompt_tokens", 0), completion_tokens=getattr(usage, "completion_tokens", 0),
+           **fields)
+
+
+def maybe_flush() -> None:
+    """バッファが LLM_USAGE_BATCH_SIZE 件に達したか、前回から LLM_USAGE_FLUSH_SECONDS 秒経っていれば書き込む。"""
+    with _lock:
+        due = (len(_pending) >= _setting("LLM_USAGE_BATCH_SIZE", 50)
+               or (_pending and time.monotonic() - _last_flush >= _setting("LLM_USAGE_FLUSH_SECONDS", 10.0)))
+    if due:
+        flush()
+
+
+def flush() -> int:
+    """バッファの使用量をまとめて書き込み、書き込んだ件数を返す。"""
+    global _pending, _last_flush
+    from .models import LLMUsage
+
+    with _lock:
+        rows, _pending = _pending, []
+        _last_flush = time.monotonic()
+    if not rows:
+        return 0
+    try:
+        LLMUsage.objects.bulk_create([LLMUsage(**row) for row in rows], batch_size=500)
+    except Exception:
+        # DB が使えない間は捨てずに次回へ持ち越す (上限を超えた分は古い順に捨てる)
+        with _lock:
+            _pending = (rows + _pending)[-_setting("LLM_USAGE_MAX_PENDING", 10000):]
+        metrics.incr("llm.usage_flush_failed")
+        return 0
+    metrics.incr("llm.usage_flushed", len(rows))
+    return len(rows)
+
+
+def pending_count() -> int:
+    with _lock:
+        return len(_pending)
+
+
+def reset() -> None:
+    """書き込んでいない使用量を捨てる (管理コマンドの確認用)。"""
+    with _lock:
+        _pending.clear()
+
+
+atexit.register(flush)
+
+
+# ---------------------------
+# 集計
+# ---------------------------
+
+def cost(model: str, prompt_tokens: int, completion_tokens: int) -> float | None:
+    """settings.LLM_PRICES (100万トークンあたりの USD) から費用を計算する。価格が未設定なら None。"""
+    prices = _setting("LLM_PRICES", {}).get(model)
+    if not prices:
+        return None
+    return (prompt_tokens * prices["input"] + completion_tokens * prices["output"]) / 1_000_000
+
+
+def report(days: int = 7) -> dict:
+    """
+    直近 days 日分の使用量を 日付・エンドポイント・占いモード・モデル・結果 ごとに集計する。
+
+    :return: {"since", "rows": [...], "totals": {...}, "pending"}
+    """
+    from .models import LLMUsage
+
+    since = timezone.localdate() - datetime.timedelta(days=days - 1)
+    rows = []
+    totals = {"calls": 0, "prompt_tokens": 0, "completion_tokens": 0, "cost_usd": 0.0}
+    estimated_sum = prompt_sum = 0
+    queryset = (LLMUsage.objects.filter(day__gte=since)
+                .values("day", "endpoint", "sb", "model", "source")
+                .annotate(calls=Count("id"), prompt_tokens=Sum("prompt_tokens"),
+                          completion_tokens=Sum("completion_tokens"),
+                          estimated_prompt_tokens=Sum("estimated_prompt_tokens"),
+                          trimmed=Count("id", filter=Q(trimmed=True)),
+                          latency_ms=Avg("latency_ms"))
+                .order_by("-day", "endpoint", "sb", "model", "source"))
+    for row in queryset:
+        row_cost = cost(row["model"], row["prompt_tokens"], row["completion_tokens"])
+        rows.append({
+            **row,
+            "day": row["day"].isoformat(),
+            "avg_prompt_tokens": round(row["prompt_tokens"] / row["calls"]),
+            "avg_completion_tokens": round(row["completion_tokens"] / row["calls"]),
+            "latency_ms": None if row["latency_ms"] is None else round(row["latency_ms"]),
+            "cost_usd": None if row_cost is None else round(row_cost, 6),
+        })
+        totals["calls"] += row["calls"]
+        totals["prompt_tokens"] += row["prompt_tokens"]
+        totals["completion_tokens"] += row["completion_tokens"]
+        totals["cost_usd"] += row_cost or 0.0
+        if row["source"] in ("llm", "discarded"):
+            estimated_sum += row["estimated_prompt_tokens"]
+            prompt_sum += row["prompt_tokens"]
+    totals["cost_usd"] = round(totals["cost_usd"], 6)
+    # 実際の prompt_tokens / 見積もり (1 に近いほど estimate_tokens が正確)
+    totals["estimate_ratio"] = round(prompt_sum / estimated_sum, 3) if estimated_sum else None
+    return {"since": since.isoformat(), "rows": rows, "totals": totals, "pending": pending_count()}
@@ -2,17 +2,156 @@
 import os
 import swisseph as swe
 import json
+import threading
+from contextlib import contextmanager
 from math import fabs
 from itertools import combinations
+from dataclasses import dataclass
+from functools import lru_cache
 
 # --- Swiss Ephemeris パス設定 ---
 # プロジェクトの構成に応じて、正しいパスをセットしてください。
-swe.set_ephe_path(
-    os.path.join(os.path.dirname(os.path.abspath(__file__)), 'ephe')
-)
+EPHE_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'ephe')
+swe.set_ephe_path(EPHE_PATH)
+
+# swisseph の設定 (エフェメリスのパス・sid_mode) はビルドによってはスレッドごとに保持される。
+# 設定していないスレッドでは .se1 が見つからず精度の低い Moshier 方式に切り替わる
+# (小惑星は計算できない) ため、計算の前に ensure_ephemeris() でスレッドごとに一度設定する
+_thread_state = threading.local()
+
+
+def ensure_ephemeris() -> None:
+    """現在のスレッドで swisseph のエフェメリスのパスを設定する（2回目以降は何もしない）。"""
+    if not getattr(_thread_state, "ephe_path_set", False):
+        swe.set_ephe_path(EPHE_PATH)
+        _thread_state.ephe_path_set = True
 
 # --- 定数/星座/ルーラー/アスペクト定義 ---
-HOUSE_SYSTEM = b'P'  # Placidusなど、好みに応じて変更可
+# ハウスシステム。リクエストで house_system=koch のように選べる (既定は Placidus)
+HOUSE_SYSTEMS = {
+    "placidus": b'P',
+    "koch": b'K',
+    "equal": b'E',
+    "whole_sign": b'W',
+    "porphyry": b'O',
+    "regiomontanus": b'R',
+    "campanus": b'C',
+}
+DEFAULT_HOUSE_SYSTEM = "placidus"
+HOUSE_SYSTEM_NAMES = {
+    "placidus": "プラシーダス", "koch": "コッホ", "equal": "イコール", "whole_sign": "ホールサイン",
+    "porphyry": "ポルフィリー", "regiomontanus": "レジオモンタナス", "campanus": "キャンパナス",
+}
+
+# サイデリアル方式のアヤナムシャ (zodiac=sidereal&ayanamsa=lahiri のように指定する)
+AYANAMSAS = {
+    "lahiri": swe.SIDM_LAHIRI,
+    "fagan_bradley": swe.SIDM_FAGAN_BRADLEY,
+    "krishnamurti": swe.SIDM_KRISHNAMURTI,
+    "raman": swe.SIDM_RAMAN,
+    "yukteshwar": swe.SIDM_YUKTESHWAR,
+}
+DEFAULT_AYANAMSA = "lahiri"
+
+# swe.set_sid_mode はビルドによってはプロセス全体の設定になるため、サイデリアルの計算は
+# このロックの中で行う (計算の途中で他のリクエストにアヤナムシャを変えられないようにする)。
+# トロピカルの計算は sid_mode を参照しないのでロックを取らない
+_sidereal_lock = threading.RLock()
+
+
+@contextmanager
+def zodiac_flags(ayanamsa: str = ""):
+    """
+    ayanamsa を指定した場合はロックを取って sid_mode を設定し、
+    swe.calc_ut などに追加するフラグ (FLG_SIDEREAL) を返す。空ならトロピカル (0)。
+    """
+    ensure_ephemeris()
+    if not ayanamsa:
+        yield 0
+        return
+    with _sidereal_lock:
+        swe.set_sid_mode(AYANAMSAS[ayanamsa])
+        yield swe.FLG_SIDEREAL
+
+
+def ayanamsa_offset(jd_ut: float, ayanamsa: str) -> float:
+    """トロピカルの黄経からサイデリアルの黄経を得るために引く値 (度)。"""
+    if not ayanamsa:
+        return 0.0
+    ensure_ephemeris()
+    with _sidereal_lock:
+        swe.set_sid_mode(AYANAMSAS[ayanamsa])
+        return swe.get_ayanamsa_ut(jd_ut)
+
+
+# --- 天体の定義 ---
+@dataclass(frozen=True)
+class Body:
+    """計算する天体1つ分の定義。"""
+    key: str            # raw_data 内の名前
+    group: str          # raw_data のグループ ("planets" / "nodes" / "lilith" / "asteroids")
+    code: int           # swisseph の天体番号
+    name: str = ""      # 解析結果での名前。空なら解析に含めない (raw_data のみ)
+    opposite: str = ""  # 180°反対側の感受点を解析に追加する場合の名前 (ドラゴンテイル)
+
+
+# 既定で計算する天体 (並び順がそのまま解析結果の並び順になる)
+DEFAULT_BODIES = (
+    Body("Sun", "planets", swe.SUN, "太陽"),
+    Body("Moon", "planets", swe.MOON, "月"),
+    Body("Mercury", "planets", swe.MERCURY, "水星"),
+    Body("Venus", "planets", swe.VENUS, "金星"),
+    Body("Mars", "planets", swe.MARS, "火星"),
+    Body("Jupiter", "planets", swe.JUPITER, "木星"),
+    Body("Saturn", "planets", swe.SATURN, "土星"),
+    Body("Uranus", "planets", swe.URANUS, "天王星"),
+    Body("Neptune", "planets", swe.NEPTUNE, "海王星"),
+    Body("Pluto", "planets", swe.PLUTO, "冥王星"),
+    Body("Mean Node", "nodes", swe.MEAN_NODE),
+    Body("True Node", "nodes", swe.TRUE_NODE, "ドラゴンヘッド", opposite="ドラゴンテイル"),
+    Body("Mean Apogee(Lilith)", "lilith", swe.MEAN_APOG),
+    Body("Oscu Apogee(True Lilith)", "lilith", swe.OSCU_APOG),
+)
+
+# リクエストで追加できる天体 (bodies=chiron,ceres のように指定する)
+# 既定の天体と同じ key のものは、その天体を解析対象にするだけで計算は増えない
+# 小惑星は ephe/seas_*.se1 を使う
+OPTIONAL_BODIES = {
+    "lilith": Body("Mean Apogee(Lilith)", "lilith", swe.MEAN_APOG, "リリス"),
+    "chiron": Body("Chiron", "asteroids", swe.CHIRON, "キロン"),
+    "ceres": Body("Ceres", "asteroids", swe.CERES, "セレス"),
+    "pallas": Body("Pallas", "asteroids", swe.PALLAS, "パラス"),
+    "juno": Body("Juno", "asteroids", swe.JUNO, "ジュノー"),
+    "vesta": Body("Vesta", "asteroids", swe.VESTA, "ベスタ"),
+}
+RAW_DATA_GROUPS = ("planets", "nodes", "lilith")   # 追加の天体がなくても raw_data に必ず含めるグループ
+
+# 黄道座標以外に追加で出力できる座標系 (frames=equatorial,heliocentric のように指定する)
+# 指定した座標系の分だけ、天体ごとに swe.calc_ut を1回ずつ追加で呼ぶ
+FRAMES = {
+    "equatorial": swe.FLG_EQUATORIAL,   # 赤経・赤緯 (パラレル/コントラパラレルの判定に使う)
+    "heliocentric": swe.FLG_HELCTR,     # 日心黄経
+}
+# 日心座標を求める天体のグループ (太陽・月・ノード・リリスは対象外)
+HELIOCENTRIC_GROUPS = ("planets", "asteroids")
+HELIOCENTRIC_EXCLUDED = (swe.SUN, swe.MOON)
+DECLINATION_ORB = 1.0   # パラレル/コントラパラレルのオーブ(度)
+
+
+@lru_cache(maxsize=64)
+def body_set(extra: tuple = ()) -> tuple:
+    """既定の天体に extra (OPTIONAL_BODIES のキー) を加えた計算対象の一覧を返す。"""
+    bodies = list(DEFAULT_BODIES)
+    for name in extra:
+        body = OPTIONAL_BODIES[name]
+        for i, existing in enumerate(bodies):
+            if (existing.group, existing.key) == (body.group, body.key):
+                bodies[i] = body
+                break
+        else:
+            bodies.append(body)
+    return tuple(bodies)
+
 
 ZODIAC_SIGNS = [
     "牡羊座", "牡牛座", "双子座", "蟹座",
@@ -133,94 +272,72 @@ def get_house(longitude: float, cusps: list[float]) -> int:
     return 12  # 万が一判定できなかった場合のフォールバック
 
 
+# 星座内の度数の表示を1分角ごとに作っておいた表 (21,600件)。添字は黄経(分角)
+ARC_MINUTES_PER_SIGN = 30 * 60
+FORMATTED_POSITIONS = tuple(
+    f"{minute // 60 % 30}°{minute % 60:02d}' {ZODIAC_SIGNS[minute // ARC_MINUTES_PER_SIGN]}"
+    for minute in range(12 * ARC_MINUTES_PER_SIGN)
+)
+
+
 def format_position(deg_in_sign: float, sign: str) -> str:
-    """度数(float) + 星座名を 'X°YY\' 星座' 形式にフォーマット。"""
-    deg_int = int(deg_in_sign)
-    minutes = int(round((deg_in_sign - deg_int) * 60))
-    return f"{deg_int}°{minutes:02d}' {sign}"
+    """
+    度数(float) + 星座名を 'X°YY\' 星座' 形式にフォーマット。
+    分を四捨五入して60'になる場合は度に繰り上げる (星座の境目を越える場合は 29°59' に留める)。
+    """
+    minutes = min(round(deg_in_sign * 60), ARC_MINUTES_PER_SIGN - 1)
+    return f"{minutes // 60}°{minutes % 60:02d}' {sign}"
+
+
+
+def sign_position(degree: float) -> tuple[str, float, str]:
+    """
+    黄経(0〜360)から (星座名, その星座内の度数, 'X°YY\' 星座' 形式の文字列) を返す。
+    get_sign + format_position と同じ結果を、文字列を組み立てずに表から引いて返す。
+    """
+    sign_index = int(degree // 30) % 12
+    degree_in_sign = degree % 30
+    minutes = min(round(degree_in_sign * 60), ARC_MINUTES_PER_SIGN - 1)
+    return (ZODIAC_SIGNS[sign_index], degree_in_sign,
+            FORMATTED_POSITIONS[sign_index * ARC_MINUTES_PER_SIGN + minutes])
 
 
-def analyze_horoscope_data(data: dict, birth_info: dict) -> dict:
+def analyze_horoscope_data(data: dict, birth_info: dict, time_unknown: bool = False,
+                           bodies: tuple = DEFAULT_BODIES, frames: tuple = ()) -> dict:
     """
     raw_data (swissephで計算した結果) を解析し、
     星座/ハウス/アスペクト/4区分/3区分/2区分/ハウスカスプ度数 をまとめた dict を返す。
+
+    time_unknown=True (出生時刻不明) の場合は ASC/MC とハウスに関する項目を含めず、
+    代わりに出生日の月の範囲 (data["moon_range"]) を追加する。
+    bodies (Body の並び) のうち name を持つ天体を解析対象にする。
+    frames に座標系を指定した場合は analyze_frames の結果 (赤経・赤緯・パラレル・日心黄経) を追加する。
     """
     house_cusps = data["houses"].get("cusp", [])
 
     # ---------------------------
     # 1) 天体リストの抽出
     # ---------------------------
-    celestial_bodies = {
-        "アセンダント": {
+    celestial_bodies = {}
+    if not time_unknown:
+        celestial_bodies["アセンダント"] = {
             "longitude_0": data["houses"].get("ASC", 0.0) % 360,
             "longitude_3": 0.0  # スピードの情報がない場合は0.0等のデフォルト値
-        },
-        "ミッドヘヴェン": {
+        }
+        celestial_bodies["ミッドヘヴェン"] = {
             "longitude_0": data["houses"].get("MC", 0.0) % 360,
             "longitude_3": 0.0
-        },
-        "太陽": {
-            "longitude_0": data["planets"].get("Sun", {}).get("longitude", [0.0])[0] % 360,
-            "longitude_3": data["planets"].get("Sun", {}).get("longitude", [0.0])[3],
-        },
-        "月": {
-            "longitude_0": data["planets"].get("Moon", {}).get("longitude", [0.0])[0] % 360,
-            "longitude_3": data["planets"].get("Moon", {}).get("longitude", [0.0])[3],
-        },
-        "水星": {
-            "longitude_0": data["planets"].get("Mercury", {}).get("longitude", [0.0])[0] % 360,
-            "longitude_3": data["planets"].get("Mercury", {}).get("longitude", [0.0])[3],
-        },
-        "金星": {
-            "longitude_0": data["planets"].get("Venus", {}).get("longitude", [0.0])[0] % 360,
-            "longitude_3": data["planets"].get("Venus", {}).get("longitude", [0.0])[3],
-        },
-        "火星": {
-            "longitude_0": data["planets"].get("Mars", {}).get("longitude", [0.0])[0] % 360,
-            "longitude_3": data["planets"].get("Mars", {}).get("longitude", [0.0])[3],
-        },
-        "木星": {
-            "longitude_0": data["planets"].get("Jupiter", {}).get("longitude", [0.0])[0] % 360,
-            "longitude_3": data["planets"].get("Jupiter", {}).get("longitude", [0.0])[3],
-        },
-        "土星": {
-            "longitude_0": data["planets"].get("Saturn", {}).get("longitude", [0.0])[0] % 360,
-            "longitude_3": data["planets"].get("Saturn", {}).get("longitude", [0.0])[3],
-        },
-        "天王星": {
-            "longitude_0": data["planets"].get("Uranus", {}).get("longitude", [0.0])[0] % 360,
-            "longitude_3": data["planets"].get("Uranus", {}).get("longitude", [0.0])[3],
-        },
-        "海王星": {
-            "longitude_0": data["planets"].get("Neptune", {}).get("longitude", [0.0])[0] % 360,
-            "longitude_3": data["planets"].get("Neptune", {}).get("longitude", [0.0])[3],
-        },
-        "冥王星": {
-            "longitude_0": data["planets"].get("Pluto", {}).get("longitude", [0.0])[0] % 360,
-            "longitude_3": data["planets"].get("Pluto", {}).get("longitude", [0.0])[3],
-        },
-    }
-     # ——————————————
-    # ノード(ドラゴンヘッド) と テイル の追加
-    # ——————————————
-    # data["nodes"]["True Node"]["longitude"] は
-    # [度数, 緯度, 距離, 速度] のリストまたはタプルで来る前提
-    raw_node = data.get("nodes", {}) \
-                   .get("True Node", {}) \
-                   .get("longitude", [0.0, 0.0, 0.0, 0.0])
-    node_deg   = raw_node[0] % 360
-    node_speed = raw_node[3] if len(raw_node) > 3 else 0.0
-
-    celestial_bodies["ドラゴンヘッド"] = {
-       "longitude_0": node_deg,
-        "longitude_3": node_speed
-    }
-    celestial_bodies["ドラゴンテイル"] = {
-        "longitude_0": (node_deg + 180) % 360,
-        "longitude_3": node_speed
-    }
-     
-
+        }
+    for body in bodies:
+        if not body.name:
+            continue
+        # longitude は [度数, 緯度, 距離, 速度, ...] のリストまたはタプルで来る前提
+        raw = data.get(body.group, {}).get(body.key, {}).get("longitude", [0.0, 0.0, 0.0, 0.0])
+        degree = raw[0] % 360
+        speed = raw[3] if len(raw) > 3 else 0.0
+        celestial_bodies[body.name] = {"longitude_0": degree, "longitude_3": speed}
+        if body.opposite:
+            celestial_bodies[body.opposite] = {"longitude_0": (degree + 180) % 360, "longitude_3": speed}
 
     # ---------------------------
     # 2) 各天体の星座・度数・フォーマット
@@ -229,8 +346,7 @@ def analyze_horoscope_data(data: dict, birth_info: dict) -> dict:
     for body, info in celestial_bodies.items():
         degree = info["longitude_0"]
         speed = info["longitude_3"]
-        sign_name, deg_in_sign = get_sign(degree)
-        formatted = format_position(deg_in_sign, sign_name)
+        sign_name, deg_in_sign, formatted = sign_position(degree)
         if speed < 0:
             formatted += " R"
         celestial_positions[body] = {
@@ -245,6 +361,8 @@ def analyze_horoscope_data(data: dict, birth_info: dict) -> dict:
     # ---------------------------
     celestial_houses = {}
     for body, info in celestial_positions.items():
+        if time_unknown:
+            break  # 出生時刻不明ならハウスは求めない
         if body in ["アセンダント", "ミッドヘヴェン"]:
             celestial_houses[body] = "-"  # ASC/MCはハウスに入れない例
         else:
@@ -255,7 +373,7 @@ def analyze_horoscope_data(data: dict, birth_info: dict) -> dict:
     # 4) ハウスごとの支配星 (既存実装例)
     # ---------------------------
     house_cusps_signs = []
-    for i in range(12):
+    for i in range(len(house_cusps)):
         cusp_deg = house_cusps[i] % 360
         cusp_sign, _ = get_sign(cusp_deg)
         house_cusps_signs.append(cusp_sign)
@@ -264,15 +382,12 @@ def analyze_horoscope_data(data: dict, birth_info: dict) -> dict:
         sign_of_house = cusp_signs[house_num - 1]
         return RULERSHIP.get(sign_of_house, "不明")
 
-    house_rulers = {i: get_house_ruler(i, house_cusps_signs) for i in range(1, 13)}
+    house_rulers = {i: get_house_ruler(i, house_cusps_signs) for i in range(1, len(house_cusps_signs) + 1)}
 
     # ---------------------------
     # 5) アスペクト計算 (例:太陽～冥王星)
     # ---------------------------
-    planet_list = [
-        "太陽", "月", "水星", "金星", "火星",
-        "木星", "土星", "天王星", "海王星", "冥王星","ドラゴンヘッド","ドラゴンテイル"
-    ]
+    planet_list = [body for body in celestial_positions if body not in ("アセンダント", "ミッドヘヴェン")]
     aspect_results = []
     for p1, p2 in combinations(planet_list, 2):
         deg1 = celestial_positions[p1]["degree"]
@@ -319,37 +434,166 @@ def analyze_horoscope_data(data: dict, birth_info: dict) -> dict:
     # 7) ハウスカスプの星座/度数リスト追加
     # ---------------------------
     house_cusps_list = []
-    for i in range(12):
+    for i in range(len(house_cusps)):
         cusp_deg = house_cusps[i] % 360
-        sign_name, deg_in_sign = get_sign(cusp_deg)
+        sign_name, deg_in_sign, formatted = sign_position(cusp_deg)
         house_cusps_list.append({
             "house": i + 1,
             "cusp_degree": round(cusp_deg, 2),
             "sign": sign_name,
             "deg_in_sign": round(deg_in_sign, 2),
-            "formatted": format_position(deg_in_sign, sign_name)
+            "formatted": formatted
         })
 
     # ---------------------------
     # 解析結果まとめ
     # ---------------------------
-    return {
-        "1.天体の配置": celestial_positions,      # 天体：星座・度数
-        "2.惑星のハウス": celestial_houses,       # 天体が何ハウスか
-        "3.ハウスの支配星": house_rulers,         # ハウスの支配星
-        "4.アスペクトの結果": aspect_results,      # 惑星間のアスペクト
-        "5.天体の四区分": four_divisions,
-        "6.天体の三区分": three_divisions,
-        "7.天体の二区分": two_divisions,
-        "8.ハウスカスプ": house_cusps_list,
-        "9.生年月日と出生地": birth_info  # ★ここを追加
-    }
+    if time_unknown:
+        moon_range = data.get("moon_range", {})
+        start_sign, _, start_formatted = sign_position(moon_range.get("start", 0.0) % 360)
+        end_sign, _, end_formatted = sign_position(moon_range.get("end", 0.0) % 360)
+        result = {
+            "1.天体の配置": celestial_positions,
+            "4.アスペクトの結果": aspect_results,
+            "5.天体の四区分": four_divisions,
+            "6.天体の三区分": three_divisions,
+            "7.天体の二区分": two_divisions,
+            "9.生年月日と出生地": birth_info,
+            "10.出生日の月の範囲": {
+                "0時": start_formatted,
+                "24時": end_formatted,
+                "星座の移動": start_sign != end_sign,
+            },
+        }
+    else:
+        result = {
+            "1.天体の配置": celestial_positions,      # 天体：星座・度数
+            "2.惑星のハウス": celestial_houses,       # 天体が何ハウスか
+            "3.ハウスの支配星": house_rulers,         # ハウスの支配星
+            "4.アスペクトの結果": aspect_results,      # 惑星間のアスペクト
+            "5.天体の四区分": four_divisions,
+            "6.天体の三区分": three_divisions,
+            "7.天体の二区分": two_divisions,
+            "8.ハウスカスプ": house_cusps_list,
+            "9.生年月日と出生地": birth_info  # ★ここを追加
+        }
+    if frames:
+        result.update(analyze_frames(data, bodies, frames))
+    return result
+
+
+def format_declination(declination: float) -> str:
+    """赤緯を「+12°34'」の形式にする。"""
+    sign = "+" if declination >= 0 else "-"
+    deg_int, minutes = divmod(round(abs(declination) * 60), 60)
+    return f"{sign}{deg_int}°{minutes:02d}'"
+
+
+def format_right_ascension(right_ascension: float) -> str:
+    """赤経(度)を「12h34m」の形式にする。"""
+    hours, minutes = divmod(round(right_ascension % 360 * 4), 60)
+    return f"{hours % 24}h{minutes:02d}m"
+
+
+def find_declination_aspects(declinations: dict, orb: float = DECLINATION_ORB) -> list:
+    """
+    赤緯によるアスペクトを求める。
+    パラレル: 同じ側(北/南)で赤緯がほぼ等しい。コントラパラレル: 反対側で赤緯の絶対値がほぼ等しい。
+
+    :param declinations: {天体名: 赤緯}
+    """
+    results = []
+    for p1, p2 in combinations(declinations, 2):
+        d1, d2 = declinations[p1], declinations[p2]
+        if (d1 >= 0) == (d2 >= 0):
+            aspect, diff = "パラレル", fabs(d1 - d2)
+        else:
+            aspect, diff = "コントラパラレル", fabs(d1 + d2)
+        if diff <= orb:
+            results.append({
+                "aspect": aspect,
+                "planet1": p1,
+                "planet2": p2,
+                "declination1": round(d1, 2),
+                "declination2": round(d2, 2),
+                "orb": round(diff, 2),
+            })
+    return results
+
+
+def analyze_frames(data: dict, bodies: tuple, frames: tuple) -> dict:
+    """
+    compute_horoscope で frames を指定した場合に raw_data に入る座標から、
+    赤経・赤緯 (11)、赤緯のアスペクト (12)、日心黄経 (13) の項目を作る。
+    """
+    result = {}
+    if "equatorial" in frames:
+        obliquity = data.get("obliquity", 0.0)
+        equatorial = {}
+        declinations = {}
+        for body in bodies:
+            coords = data.get(body.group, {}).get(body.key, {}).get("equatorial")
+            if not body.name or coords is None:
+                continue
+            points = [(body.name, coords[0], coords[1])]
+            if body.opposite:
+                points.append((body.opposite, (coords[0] + 180) % 360, -coords[1]))
+            for name, right_ascension, declination in points:
+                equatorial[name] = {
+                    "right_ascension": right_ascension,
+                    "declination": declination,
+                    "formatted": f"赤経 {format_right_ascension(right_ascension)} "
+                                 f"赤緯 {format_declination(declination)}",
+                    # 赤緯が黄道傾斜角を超える (アウト・オブ・バウンズ)
+                    "out_of_bounds": fabs(declination) > obliquity,
+                }
+                declinations[name] = declination
+        result["11.赤経・赤緯"] = equatorial
+        result["12.赤緯のアスペクト"] = find_declination_aspects(declinations)
+    if "heliocentric" in frames:
+        heliocentric = {}
+        points = []
+        # 地球の日心黄経は太陽の地心黄経の反対側
+        sun = data.get("planets", {}).get("Sun", {}).get("longitude")
+        if sun is not None:
+            points.append(("地球", sun[0] + 180))
+        for body in bodies:
+            coords = data.get(body.group, {}).get(body.key, {}).get("heliocentric")
+            if body.name and coords is not None:
+                points.append((body.name, coords[0]))
+        for name, longitude in points:
+            degree = longitude % 360
+            sign_name, deg_in_sign, formatted = sign_position(degree)
+            heliocentric[name] = {
+                "degree": degree,
+                "sign": sign_name,
+                "deg_in_sign": deg_in_sign,
+                "formatted": formatted,
+            }
+        result["13.ヘリオセントリック"] = heliocentric
+    return result
+
+
+def compute_moon_range(year: int, month: int, day: int, tz: float, dst: float,
+                       extra_flags: int = 0) -> dict:
+    """
+    出生日(現地時刻の0時〜24時)の月の黄経の範囲を返す。
+    月は逆行しないため、0時が最小・24時が最大となる (360°をまたぐ場合は end < start)。
+    """
+    jd_start = swe.julday(year, month, day, -(tz + dst), swe.GREG_CAL)
+    flg = swe.FLG_SWIEPH | swe.FLG_SPEED | extra_flags
+    start = swe.calc_ut(jd_start, swe.MOON, flg)[0][0] % 360
+    end = swe.calc_ut(jd_start + 1.0, swe.MOON, flg)[0][0] % 360
+    return {"start": start, "end": end}
 
 
 def compute_horoscope(year: int, month: int, day: int,
                       hour: int, minute: int,
                       lat: float, lon: float,
-                      tz: float, dst: float, prefecture: str) -> dict:
+                      tz: float, dst: float, prefecture: str,
+                      time_unknown: bool = False, bodies: tuple = (),
+                      ayanamsa: str = "", house_system: str = DEFAULT_HOUSE_SYSTEM,
+                      frames: tuple = ()) -> dict:
     """
     スイスエフェメリスを用いてホロスコープを計算し、
     解析結果をまとめた辞書({ "raw_data": {...}, "analysis": {...} })を返す。
@@ -363,6 +607,11 @@ def compute_horoscope(year: int, month: int, day: int,
     :param lon: 観測地点の経度 (東経は+、西経は-)
     :param tz: タイムゾーン (例: 日本は+9)
     :param dst: サマータイム補正時間 (通常0, 夏時間なら+1等)
+    :param time_unknown: 出生時刻不明。ハウス計算を省き、出生日の月の範囲を計算する
+    :param bodies: 標準の天体に加えて計算する天体 (OPTIONAL_BODIES のキー。例: ("chiron",))
+    :param ayanamsa: サイデリアル方式で計算する場合のアヤナムシャ (AYANAMSAS のキー)。空ならトロピカル
+    :param house_system: ハウスシステム (HOUSE_SYSTEMS のキー)
+    :param frames: 追加で出力する座標系 (FRAMES のキー)。指定した座標系だけ追加で計算する
     """
     # ---------------------------
     # 1) ローカル時刻 -> UT(世界時) 変換
@@ -375,79 +624,54 @@ def compute_horoscope(year: int, month: int, day: int,
     jd_ut = swe.julday(year, month, day, ut, swe.GREG_CAL)
 
     # ---------------------------
-    # 3) 主要天体の位置 (太陽～冥王星) を計算
-    # ---------------------------
-    planets_info = {}
-    flg = swe.FLG_SWIEPH | swe.FLG_SPEED
-    for planet_code in range(swe.SUN, swe.PLUTO + 1):
-        try:
-            lon_p, lat_p = swe.calc_ut(jd_ut, planet_code, flg)
-            planet_name = swe.get_planet_name(planet_code)
-            planets_info[planet_name] = {
-                "longitude": lon_p,
-                "latitude": lat_p
-            }
-        except Exception as e:
-            planet_name = swe.get_planet_name(planet_code)
-            planets_info[planet_name] = {"error": str(e)}
-
-    # ---------------------------
-    # 4) ノード(ドラゴンヘッド) 計算
-    # ---------------------------
-    nodes_codes = [
-        ("Mean Node", swe.MEAN_NODE),
-        ("True Node", swe.TRUE_NODE),
-    ]
-    nodes_info = {}
-    for node_name, node_code in nodes_codes:
-        try:
-            lon_n, lat_n = swe.calc_ut(jd_ut, node_code, flg)
-            nodes_info[node_name] = {
-                "longitude": lon_n,
-                "latitude": lat_n
-            }
-        except Exception as e:
-            nodes_info[node_name] = {"error": str(e)}
-
-    # ---------------------------
-    # 5) リリス(ブラックムーン) 計算
-    # ---------------------------
-    lilith_codes = [
-        ("Mean Apogee(Lilith)", swe.MEAN_APOG),
-        ("Oscu Apogee(True Lilith)", swe.OSCU_APOG),
-    ]
-    lilith_info = {}
-    for lilith_name, lilith_code in lilith_codes:
-        try:
-            lon_l, lat_l = swe.calc_ut(jd_ut, lilith_code, flg)
-            lilith_info[lilith_name] = {
-                "longitude": lon_l,
-                "latitude": lat_l
-            }
-        except Exception as e:
-            lilith_info[lilith_name] = {"error": str(e)}
-
-    # ---------------------------
-    # 6) ハウス (ASC, MC, 12ハウスカスプ) の計算
-    # ---------------------------
-    try:
-        houses_result = swe.houses(jd_ut, lat, lon, HOUSE_SYSTEM)
-        if len(houses_result) == 2:
-            cusps, ascmc = houses_result
-            asc, mc = ascmc[0], ascmc[1]
-            houses_info = {
-                "ASC":  asc,
-                "MC":   mc,
-                "cusp": list(cusps),
-                "ASCMC": list(ascmc)
-            }
+    # 3) 天体の位置 (太陽～冥王星・ノード・リリス + 追加指定の天体) を計算
+    # 4) ハウス (ASC, MC, 12ハウスカスプ) の計算
+    # ---------------------------
+    bodies = body_set(tuple(bodies))
+    with zodiac_flags(ayanamsa) as zodiac_flg:
+        body_groups = {group: {} for group in RAW_DATA_GROUPS}
+        flg = swe.FLG_SWIEPH | swe.FLG_SPEED | zodiac_flg
+        for body in bodies:
+            group = body_groups.setdefault(body.group, {})
+            try:
+                lon_b, lat_b = swe.calc_ut(jd_ut, body.code, flg)
+                group[body.key] = {
+                    "longitude": lon_b,
+                    "latitude": lat_b
+                }
+                for frame in frames:
+                    if frame == "heliocentric" and (body.group not in HELIOCENTRIC_GROUPS
+                                                    or body.code in HELIOCENTRIC_EXCLUDED):
+                        continue
+                    # 赤道座標は春分点基準のため、サイデリアルの指定は外す
+                    frame_flg = flg & ~swe.FLG_SIDEREAL if frame == "equatorial" else flg
+                    group[body.key][frame] = swe.calc_ut(jd_ut, body.code, frame_flg | FRAMES[frame])[0]
+            except Exception as e:
+                group[body.key] = {"error": str(e)}
+
+        if time_unknown:
+            # 出生時刻が不明な場合はハウスを計算しない
+            houses_info = {}
+            moon_range = compute_moon_range(year, month, day, tz, dst, zodiac_flg)
         else:
-            houses_info = {
-                "error": f"Houses function returned {len(houses_result)} values, expected 2.",
-                "content": houses_result
-            }
-    except Exception as e:
-        houses_info = {"error": str(e)}
+            try:
+                houses_result = swe.houses_ex(jd_ut, lat, lon, HOUSE_SYSTEMS[house_system], zodiac_flg)
+                if len(houses_result) == 2:
+                    cusps, ascmc = houses_result
+                    asc, mc = ascmc[0], ascmc[1]
+                    houses_info = {
+                        "ASC":  asc,
+                        "MC":   mc,
+                        "cusp": list(cusps),
+                        "ASCMC": list(ascmc)
+                    }
+                else:
+                    houses_info = {
+                        "error": f"Houses function returned {len(houses_result)} values, expected 2.",
+                        "content": houses_result
+                    }
+            except Exception as e:
+                houses_info = {"error": str(e)}
 
     # ---------------------------
     # (1) raw_data まとめ
@@ -464,11 +688,14 @@ def compute_horoscope(year: int, month: int, day: int,
             "dst":    dst,
             "ut_used": ut,
         },
-        "planets": planets_info,
-        "nodes":   nodes_info,
-        "lilith":  lilith_info,
+        **body_groups,
         "houses":  houses_info
     }
+    if time_unknown:
+        raw_data["moon_range"] = moon_range
+    if "equatorial" in frames:
+        # 真の黄道傾斜角 (アウト・オブ・バウンズの判定に使う)
+        raw_data["obliquity"] = swe.calc_ut(jd_ut, swe.ECL_NUT)[0][0]
     birth_info = {
         "year": year,
         "month": month,
@@ -481,10 +708,15 @@ def compute_horoscope(year: int, month: int, day: int,
         "dst": dst,
         "birthplace": prefecture  # prefecture（出生地）を追加
     }
+    # 既定(トロピカル・プラシーダス)以外の場合のみ、計算方式を解析結果に含める
+    if ayanamsa:
+        birth_info["zodiac"] = f"サイデリアル ({ayanamsa})"
+    if house_system != DEFAULT_HOUSE_SYSTEM and not time_unknown:
+        birth_info["house_system"] = HOUSE_SYSTEM_NAMES[house_system]
     # ---------------------------
     # (2) 解析(星座/ハウス/アスペクト/4区分など)
     # ---------------------------
-    analysis_result = analyze_horoscope_data(raw_data, birth_info)
+    analysis_result = analyze_horoscope_data(raw_data, birth_info, time_unknown, bodies, frames)
 
     # ---------------------------
     # (3) 返却 (raw_data + analysis)
@@ -493,3 +725,14 @@ def compute_horoscope(year: int, month: int, day: int,
         "analysis": analysis_result,
         "raw_data": raw_data
     }
+
+
+@lru_cache(maxsize=2048)
+def horoscope_for(birth, time_unknown: bool = False) -> dict:
+    """
+    検証済みの BirthInput からホロスコープを計算する。
+    同じ入力は再計算せずキャッシュを返すため、返り値を変更しないこと。
+    """
+    return compute_horoscope(*birth.horoscope_args(), time_unknown=time_unknown, bodies=birth.bodies,
+                             ayanamsa=birth.ayanamsa, house_system=birth.house_system,
+                             frames=birth.frames)
@@ -0,0 +1,301 @@
+# horoscope_app/validation.py
+"""
+出生データ(年月日・時刻・緯度経度・タイムゾーン)の解析と検証。
+
+全ビューとバッチ処理で共通して使う。
+解析結果は BirthInput にまとめ、正規化した値から計算したキー(key)を
+チャートのキャッシュキーとして利用する。
+"""
+import datetime
+import hashlib
+import math
+from dataclasses import dataclass, field
+
+from django.core.exceptions import ValidationError
+
+from .geocoding import get_gazetteer
+from .timezones import is_valid_zone, resolve_offset, zone_for
+from .utils import (AYANAMSAS, DEFAULT_AYANAMSA, DEFAULT_HOUSE_SYSTEM, FRAMES, HOUSE_SYSTEMS,
+                    OPTIONAL_BODIES)
+
+DATE_RANGE_MESSAGE = "日付は1900年1月1日から2100年12月31日までの範囲で入力してください。"
+MIN_YEAR = 1900
+MAX_YEAR = 2100
+
+# 各月の日数（うるう年の2月は _days_in_month で補正）
+_DAYS_IN_MONTH = (0, 31, 28, 31, 30, 31, 30, 31, 31, 30, 31, 30, 31)
+
+# (項目名, 既定値, 最小値, 最大値) — 既定値は従来のビューと同じ
+_INT_FIELDS = (
+    ("year", 2023, MIN_YEAR, MAX_YEAR),
+    ("month", 1, 1, 12),
+    ("day", 1, 1, 31),
+    ("hour", 0, 0, 23),
+    ("minute", 0, 0, 59),
+)
+_FLOAT_FIELDS = (
+    ("lat", 35.6895, -90.0, 90.0),
+    ("lon", 139.6917, -180.0, 180.0),
+    ("tz", 9.0, -14.0, 14.0),
+    ("dst", 0.0, -2.0, 2.0),
+)
+DEFAULT_PREFECTURE = "Tokyo"
+
+
+@dataclass(frozen=True, slots=True)
+class BirthInput:
+    """検証済みの出生データ1人分。"""
+    year: int
+    month: int
+    day: int
+    hour: int
+    minute: int
+    lat: float
+    lon: float
+    tz: float
+    dst: float
+    prefecture: str = DEFAULT_PREFECTURE
+    unknown: bool = False
+    tzid: str = ""
+    bodies: tuple = ()   # 追加で計算する天体 (OPTIONAL_BODIES のキー、ソート済み)
+    ayanamsa: str = ""   # サイデリアルの場合のアヤナムシャ (空ならトロピカル)
+    house_system: str = DEFAULT_HOUSE_SYSTEM
+    frames: tuple = ()   # 追加で出力する座標系 (FRAMES のキー、ソート済み)
+    key: str = field(init=False, compare=False, repr=False)
+
+    def __post_init__(self):
+        values = (self.year, self.month, self.day, self.hour, self.minute,
+                  self.lat, self.lon, self.tz, self.dst, self.prefecture)
+        # 既定値のままの項目はキーに含めない（従来のキャッシュキーを変えないため）
+        if self.bodies:
+            values += (self.bodies,)
+        if self.ayanamsa or self.house_system != DEFAULT_HOUSE_SYSTEM:
+            values += (self.ayanamsa, self.house_system)
+        if self.frames:
+            values += (self.frames,)
+        raw = repr(values)
+        object.__setattr__(
+            self, "key", hashlib.blake2b(raw.encode("utf-8"), digest_size=16).hexdigest()
+        )
+
+    def horoscope_args(self) -> tuple:
+        """compute_horoscope に渡す位置引数を返す。"""
+        return (self.year, self.month, self.day, self.hour, self.minute,
+                self.lat, self.lon, self.tz, self.dst, self.prefecture)
+
+
+def _days_in_month(year: int, month: int) -> int:
+    if month == 2 and year % 4 == 0 and (year % 100 != 0 or year % 400 == 0):
+        return 29
+    return _DAYS_IN_MONTH[month]
+
+
+def _get(params, name: str):
+    value = params.get(name)
+    if value is None or value == "":
+        return None
+    return value
+
+
+def _option_name(params, name: str, suffix: str) -> str:
+    """計算方式の項目名。相性診断では人ごとの指定 (name + suffix) がなければ共通の name を使う。"""
+    if suffix and _get(params, name + suffix) is not None:
+        return name + suffix
+    return name
+
+
+def _name_list(params, name: str) -> tuple:
+    """カンマ区切りの名前の並びを、重複を除いてソートしたタプルにする。"""
+    return tuple(sorted({item.strip().lower()
+                         for item in str(params.get(name) or "").split(",") if item.strip()}))
+
+
+def parse_birth_input(params, suffix: str = "") -> BirthInput:
+    """
+    リクエストパラメータ(QueryDict / dict)から BirthInput を作る。
+
+    :param params: request.GET / request.POST / JSON を読み込んだ dict
+    :param suffix: 相性診断など複数人分の項目名に付く接尾辞 (例: "1", "2")
+    :raises ValidationError: message_dict に {項目名: [メッセージ]} を持つ
+    """
+    errors = {}
+    values = {}
+    defaulted = set()
+
+    for name, default, lo, hi in _INT_FIELDS:
+        key = name + suffix
+        raw = _get(params, key)
+        if raw is None:
+            values[name] = default
+            continue
+        try:
+            value = int(raw)
+        except (ValueError, TypeError):
+            errors[key] = ["整数で入力してください。"]
+            continue
+        if not lo <= value <= hi:
+            errors[key] = [DATE_RANGE_MESSAGE if name == "year"
+                           else f"{lo}〜{hi}の範囲で入力してください。"]
+            continue
+        values[name] = value
+
+    for name, default, lo, hi in _FLOAT_FIELDS:
+        key = name + suffix
+        raw = _get(params, key)
+        if raw is None:
+            values[name] = default
+            defaulted.add(name)
+            continue
+        try:
+            value = float(raw)
+        except (ValueError, TypeError):
+            errors[key] = ["数値で入力してください。"]
+            continue
+        if not math.isfinite(value) or not lo <= value <= hi:
+            errors[key] = [f"{lo:g}〜{hi:g}の範囲で入力してください。"]
+            continue
+        values[name] = round(value, 6)
+
+    if "year" in values and "month" in values and "day" in values:
+        if values["day"] > _days_in_month(values["year"], values["month"]):
+            errors["day" + suffix] = ["存在しない日付です。"]
+
+    tzid = str(params.get("tzid" + suffix) or "")
+    if tzid and not is_valid_zone(tzid):
+        errors["tzid" + suffix] = ["不明なタイムゾーンです。"]
+
+    bodies_key = _option_name(params, "bodies", suffix)
+    bodies = _name_list(params, bodies_key)
+    unknown_bodies = [name for name in bodies if name not in OPTIONAL_BODIES]
+    if unknown_bodies:
+        errors[bodies_key] = [f"不明な天体です: {', '.join(unknown_bodies)}"
+                              f" (指定できる天体: {', '.join(OPTIONAL_BODIES)})"]
+
+    frames_key = _option_name(params, "frames", suffix)
+    frames = _name_list(params, frames_key)
+    unknown_frames = [name for name in frames if name not in FRAMES]
+    if unknown_frames:
+        errors[frames_key] = [f"不明な座標系です: {', '.join(unknown_frames)}"
+                              f" (指定できる座標系: {', '.join(FRAMES)})"]
+
+    zodiac_key = _option_name(params, "zodiac", suffix)
+    zodiac = str(params.get(zodiac_key) or "tropical").lower()
+    ayanamsa = ""
+    if zodiac == "sidereal":
+        ayanamsa_key = _option_name(params, "ayanamsa", suffix)
+        ayanamsa = str(params.get(ayanamsa_key) or DEFAULT_AYANAMSA).lower()
+        if ayanamsa not in AYANAMSAS:
+            errors[ayanamsa_key] = [f"不明なアヤナムシャです (指定できる値: {', '.join(AYANAMSAS)})"]
+    elif zodiac != "tropical":
+        errors[zodiac_key] = ["tropical または sidereal を指定してください。"]
+
+    house_key = _option_name(params, "house_system", suffix)
+    house_system = str(params.get(house_key) or DEFAULT_HOUSE_SYSTEM).lower()
+    if house_system not in HOUSE_SYSTEMS:
+        errors[house_key] = [f"不明なハウスシステムです (指定できる値: {', '.join(HOUSE_SYSTEMS)})"]
+
+    if errors:
+        raise ValidationError(errors)
+
+    given_prefecture = str(params.get("prefecture" + suffix) or "")[:64]
+    prefecture = given_prefecture or DEFAULT_PREFECTURE
+    unknown = str(params.get("unknown" + suffix, "")).lower() == "on"
+
+    # 緯度経度が送られていない場合は出生地名から地名辞書で補う
+    if {"lat", "lon"} <= defaulted and given_prefecture:
+        place = get_gazetteer().lookup(given_prefecture)
+        if place is not None:
+            values["lat"], values["lon"] = place.lat, place.lon
+            tzid = tzid or place.tz
+
+    # 出生地からタイムゾーンが分かる場合は、クライアントの tz/dst より優先する
+    tzid = tzid or zone_for(given_prefecture, values["lat"], values["lon"]) or ""
+    if tzid:
+        values["tz"], values["dst"] = resolve_offset(
+            tzid, values["year"], values["month"], values["day"],
+            values["hour"], values["minute"],
+        )
+    return BirthInput(prefecture=prefecture, unknown=unknown, tzid=tzid, bodies=bodies,
+                      ayanamsa=ayanamsa, house_system=house_system, frames=frames, **values)
+
+
+def parse_birth_inputs(records, suffix: str = "") -> list:
+    """
+    バッチ処理用: レコード(dict)の列をまとめて解析する。
+
+    :return: 各レコードについて BirthInput または {項目名: [メッセージ]} のリスト
+    """
+    results = []
+    for record in records:
+        try:
+            results.append(parse_birth_input(record, suffix))
+        except ValidationError as e:
+            results.append(e.message_dict)
+    return results
+
+
+def parse_mode(params, default: int = 1) -> int:
+    """占いモード(sb)を解析する。"""
+    raw = _get(params, "sb")
+    if raw is None:
+        return default
+    try:
+        return int(raw)
+    except (ValueError, TypeError):
+        raise ValidationError({"sb": ["整数で入力してください。"]})
+
+
+def parse_int_param(params, name: str, default: int, lo: int, hi: int) -> int:
+    """整数のパラメータを解析する（未指定なら default）。"""
+    raw = _get(params, name)
+    if raw is None:
+        return default
+    try:
+        value = int(raw)
+    except (ValueError, TypeError):
+        raise ValidationError({name: ["整数で入力してください。"]})
+    if not lo <= value <= hi:
+        raise ValidationError({name: [f"{lo}〜{hi}の範囲で入力してください。"]})
+    return value
+
+
+def parse_date_param(params, name: str, default: datetime.date) -> datetime.date:
+    """YYYY-MM-DD 形式の日付パラメータを解析する（未指定なら default）。"""
+    raw = _get(params, name)
+    if raw is None:
+        return default
+    try:
+        value = datetime.date.fromisoformat(str(raw))
+    except ValueError:
+        raise ValidationError({name: ["YYYY-MM-DD 形式で入力してください。"]})
+    if not MIN_YEAR <= value.year <= MAX_YEAR:
+        raise ValidationError({name: [DATE_RANGE_MESSAGE]})
+    return value
+
+
+def parse_fields(params, available) -> tuple:
+    """
+    返す項目を絞り込む fields パラメータを解析する (未指定なら空のタプル = すべて)。
+
+    カンマ区切り (JSON では配列も可) で、項目名 ("1.天体の配置") または番号 ("1") を指定する。
+    結果は available の順に並べる。
+    """
+    raw = params.get("fields")
+    if raw is None or raw == "" or raw == []:
+        return ()
+    names = raw if isinstance(raw, (list, tuple)) else str(raw).split(",")
+    by_number = {key.split(".", 1)[0]: key for key in available if "." in key}
+    selected = set()
+    unknown = []
+    for name in (str(name).strip() for name in names):
+        if not name:
+            continue
+        key = name if name in available else by_number.get(name)
+        if key is None:
+            unknown.append(name)
+        else:
+            selected.add(key)
+    if unknown:
+        raise ValidationError({"fields": [f"不明な項目です: {', '.join(unknown)}"
+                                          f" (指定できる項目: {', '.join(available)})"]})
+    return tuple(key for key in available if key in selected)
@@ -10,45 +10,86 @@ from django.core.exceptions import ValidationError
 import datetime
 from zoneinfo import ZoneInfo
 import copy
-import uuid
+from functools import lru_cache
 from django.shortcuts import render, redirect
 from django.http import JsonResponse, HttpResponseForbidden
+from django.contrib.admin.views.decorators import staff_member_required
+from django.views.decorators.cache import cache_control, cache_page, never_cache
+from django.views.decorators.csrf import ensure_csrf_cookie
+from django.views.decorators.http import etag
+from django.http import HttpResponse
+from django.utils.cache import patch_cache_control
+from django.utils.functional import SimpleLazyObject
 
-# OpenAI
-from openai import OpenAI
+# OpenAI (クライアントは llm.get_openai_client で共有する)
+from . import fallback, llm, routing, usage
 
 # 上で作成したユーティリティ関数をインポート
-from .utils import compute_horoscope
-
+from .utils import compute_horoscope, horoscope_for
+from .validation import (DATE_RANGE_MESSAGE, parse_birth_input, parse_date_param,
+                         parse_fields, parse_int_param, parse_mode)
+from . import metrics
+from .compression import stream_json
+from .geocoding import autocomplete_dicts, nearest_place
+from .ratelimit import throttle_and_coalesce
+from .chart_svg import CHART_SVG_MAX_AGE, CHART_SVG_VERSION, chart_etag, chart_svg_for
+from .tokens import consume_token, issue_token
+from .daily_positions import transit_positions
+from . import overlay
+from . import progressions
+from . import scoring
+from . import similarity
+from .models import StoredChart
+from .timezones import JAPAN_ZONE, resolve_offset
+
+def _input_error(e: ValidationError, message: str) -> JsonResponse:
+    """入力エラーを項目ごとのメッセージ付きの 400 レスポンスにする。"""
+    fields = e.message_dict
+    if any(DATE_RANGE_MESSAGE in messages for messages in fields.values()):
+        message = DATE_RANGE_MESSAGE
+    return JsonResponse({"error": message, "fields": fields}, status=400)
+
+
+def _project(analysis: dict, fields: tuple) -> dict:
+    """analysis のうち fields (parse_fields の結果) の項目だけを返す。fields が空ならそのまま。"""
+    if not fields:
+        return analysis
+    return {key: analysis[key] for key in fields if key in analysis}
+
+
+# トップページ・相性ページは訪問ごとに変わる値を含まないため、まるごとキャッシュして配信する
+PAGE_CACHE_SECONDS = 60 * 60
+
+
+@cache_control(public=True, max_age=PAGE_CACHE_SECONDS)
+@cache_page(PAGE_CACHE_SECONDS)
 def index(request):
     """
     トップページ(index.html)を返すビュー。
     ユーザがここでフォームに出生データを入力する。
+    プルダウンの生成とワンタイムトークンの取得はクライアント側(static/horoscope_app/js/index.js)で行う。
     """
-    years = range(1900, 2100)
-    months = range(1, 13)
-    days = range(1, 32)
-    # ワンタイムトークン生成
-    token = str(uuid.uuid4())
-    request.session['valid_token'] = token
+    return render(request, 'horoscope_app/index.html')
 
-    context = {
-        'years': years,
-        'months': months,
-        'days': days,
-        'token': token,  # テンプレートに渡す
-    }
-    return render(request, 'horoscope_app/index.html', context)
 
+@cache_control(public=True, max_age=PAGE_CACHE_SECONDS)
+@cache_page(PAGE_CACHE_SECONDS)
 def compatibility(request):
     """
     二人の相性(compatibility.html)を返すビュー。
     ユーザがここでフォームに出生データを入力する。
     """
-    years = range(1900, 2100)
-    months = range(1, 13)
-    days = range(1, 32)
-    return render(request, 'horoscope_app/compatibility.html', {'years': years, 'months': months, 'days': days})
+    return render(request, 'horoscope_app/compatibility.html')
+
+
+@never_cache
+@ensure_csrf_cookie
+def token(request):
+    """
+    ページを表示するたびに必要な値(ワンタイムトークン)を JSON で返す。
+    キャッシュされたページから呼ばれ、同時に CSRF Cookie を設定する。
+    """
+    return JsonResponse({"token": issue_token()})
 
 
 @csrf_exempt
@@ -69,47 +110,160 @@ def horoscope(request):
           "lon": 139.6917,
           "tz": 9.0,
           "dst": 0.0,
-          "prefecture": "Tokyo"
+          "prefecture": "Tokyo",
+          "fields": "1.天体の配置,raw_data"   (任意: 返す項目。番号だけでも可)
         }
     """
     if request.method != "POST":
         return JsonResponse({"error": "Invalid request method. POSTのみ対応しています。"}, status=400)
 
-    try:
-        # JSONで送られてきた場合にも対応
-        data = request.POST or request.body
-        if request.content_type == 'application/json':
-            import json
+    # JSONで送られてきた場合にも対応
+    data = request.POST
+    if request.content_type == 'application/json':
+        try:
             data = json.loads(request.body)
+        except ValueError as ve:
+            return JsonResponse({"error": "Invalid input parameters", "details": str(ve)}, status=400)
+        if not isinstance(data, dict):
+            return JsonResponse({"error": "Invalid input parameters"}, status=400)
 
-        year = int(data.get("year", 2023))
-        month = int(data.get("month", 1))
-        day = int(data.get("day", 1))
-        hour = int(data.get("hour", 0))
-        minute = int(data.get("minute", 0))
-        lat = float(data.get("lat", 35.6895))
-        lon = float(data.get("lon", 139.6917))
-        tz = float(data.get("tz", 9.0))
-        dst = float(data.get("dst", 0.0))
-        prefecture = data.get("prefecture", "Tokyo")
-    except (ValueError, TypeError) as ve:
-        return JsonResponse({"error": "Invalid input parameters", "details": str(ve)}, status=400)
-
+    # 計算処理
     try:
-        input_date = datetime.datetime(year, month, day)
-        if input_date < datetime.datetime(1900, 1, 1) or input_date > datetime.datetime(2100, 12, 31):
-            raise ValidationError("日付は1900年1月1日から2100年12月31日までの範囲で入力してください。")
+        birth = parse_birth_input(data)
+        result_dict = horoscope_for(birth)
+        fields = parse_fields(data, [*result_dict["analysis"], "raw_data"])
     except ValidationError as ve:
-        return JsonResponse({"error": str(ve)}, status=400)
-    except Exception:
-        return JsonResponse({"error": "日付の解析に失敗しました。"}, status=400)
+        return _input_error(ve, "Invalid input parameters")
 
-    # 計算処理
-    result_dict = compute_horoscope(year, month, day, hour, minute, lat, lon, tz, dst, prefecture)
+    # fields で必要な項目だけに絞る (raw_data は指定した場合のみ)
+    if fields:
+        projected = {"analysis": _project(result_dict["analysis"], fields)}
+        if "raw_data" in fields:
+            projected["raw_data"] = result_dict["raw_data"]
+        result_dict = projected
 
     return JsonResponse(result_dict)
 
+def _reply_response(reply) -> JsonResponse:
+    """llm.complete の結果を返す。縮退した回答には fallback (cache / template) を付ける。"""
+    body = {"result": reply.text}
+    if reply.degraded:
+        body["fallback"] = reply.source
+    return JsonResponse(body)
+
+
+PROMPT_INTRO = "あなたは熟練した占星術師であり、日本語で丁寧に分かりやすく回答を行います。\n"
+
+
+@lru_cache(maxsize=2048)
+def _chart_prompt(birth, time_unknown: bool, sections: tuple) -> str:
+    """
+    プロンプトに入れるチャートの JSON (sections の項目のみ)。
+    JSON にするのはチャートの計算と同じくらい時間がかかるため、同じ人 (相性を続けて占う「私」など) は再利用する。
+    """
+    analysis = horoscope_for(birth, time_unknown).get("analysis", {})
+    return json.dumps(routing.select_sections(analysis, sections), ensure_ascii=False, indent=2)
+
+
+def _transit_overlay(birth, start: datetime.date, days: int, time_unknown: bool) -> dict:
+    """start から days 日間、毎日正午のトランジットを出生チャートに重ねた期間の一覧 (overlay.timeline)。"""
+    return overlay.timeline(birth, overlay.instants(start, days, 24, birth.tzid), time_unknown)
+
+
+def _yearly_transits(birth, year: int, time_unknown: bool) -> tuple[dict, dict]:
+    """
+    1年の運勢に使う、各月1日正午のトランジット天体 ({月: JSON}) と、
+    動きの遅い天体と出生図の関係を計算するための1年分の重ね合わせ (_transit_overlay)。
+    トランジットは出生チャートと同じ黄道帯 (サイデリアルならアヤナムシャ)・追加の天体で計算する。
+    """
+    transit_str = {}
+    for month in range(1, 13):
+        horoscope_result = compute_horoscope(year, month, 1, 12, 0, birth.lat, birth.lon,
+                                             *_offset_at(birth, year, month, 1, 12, 0), birth.prefecture,
+                                             bodies=birth.bodies, ayanamsa=birth.ayanamsa,
+                                             house_system=birth.house_system)
+        # トランジットデータの抽出と不要なキーの除外
+        transit_data = horoscope_result.get("analysis", {}).get("1.天体の配置", {})
+        filtered = {k: v for k, v in transit_data.items() if k not in ['アセンダント', 'ミッドヘヴェン']}
+        transit_str[month] = json.dumps(filtered, ensure_ascii=False, indent=2)
+    year_overlay = _transit_overlay(birth, datetime.date(year, 1, 1),
+                                    (datetime.date(year + 1, 1, 1) - datetime.date(year, 1, 1)).days, time_unknown)
+    return transit_str, year_overlay
+
+
+def _yearly_message(horoscope_str: str, year: int, transit_str: dict, year_overlay: dict,
+                    brief: bool = False) -> str:
+    """1年の運勢を1つのプロンプトで尋ねる場合の本文 (PROMPT_INTRO の後に続ける)。"""
+    transit_messages = "\n\n".join(
+        [f"【トランジットの惑星{month}月】\n{transit_str[month]}" for month in range(1, 13)]
+    )
+    return (
+        f"以下のネイタルチャートとトランジットの惑星データを参考に、アスペクトも計算して、今年（{year}年）の運勢を教えてください。\n"
+        f"【ネイタルチャート】\n{horoscope_str}\n\n"
+        f"{transit_messages}\n\n"
+        f"【トランジットと出生図の関係（計算済み・{year}年）】\n{overlay.describe(year_overlay, overlay.SLOW_BODIES)}\n\n"
+        f"トランジットの特に外惑星との関係から、この人の今年（{year}年）の運勢はどのようになっていると考えられますか？\n"
+        + ("400字程度で結論だけ教えてください。\n" if brief else "")
+    )
+
+
+def _yearly_parts(horoscope_str: str, year: int, transit_str: dict, year_overlay: dict, parts: int, note: str,
+                  brief: bool = False) -> list[tuple[str, str]]:
+    """
+    1年の運勢のプロンプトを 全体の流れ + routing.month_groups(parts) の期間ごと に分ける。
+    期間ごとのプロンプトにはその期間の月のトランジットと、その期間に重なる出生図との関係だけを入れる。
+
+    :return: llm.complete_parts に渡す (見出し, プロンプト) のリスト
+    """
+    length = "400字程度で結論だけ教えてください。\n" if brief else ""
+    natal = f"【ネイタルチャート】\n{horoscope_str}\n\n"
+    all_months = "\n\n".join(f"【トランジットの惑星{month}月】\n{transit_str[month]}" for month in range(1, 13))
+    result = [(f"【{year}年の全体運】", (
+        f"{PROMPT_INTRO}以下のネイタルチャートとトランジットの惑星データを参考に、今年（{year}年）の運勢を教えてください。\n"
+        f"{natal}{all_months}\n\n"
+        f"【トランジットと出生図の関係（計算済み・{year}年）】\n{overlay.describe(year_overlay, overlay.SLOW_BODIES)}\n\n"
+        f"トランジットの特に外惑星との関係から、この人の今年（{year}年）全体の流れはどのようになっていると考えられますか？\n"
+        f"月ごとの詳しい運勢は別に扱うので、1年を通したテーマと流れだけを教えてください。\n{length}{note}"
+    ))]
+    for months in routing.month_groups(parts):
+        period = f"{months[0]}月〜{months[-1]}月" if len(months) > 1 else f"{months[0]}月"
+        transits = "\n\n".join(f"【トランジットの惑星{month}月】\n{transit_str[month]}" for month in months)
+        first = datetime.date(year, months[0], 1)
+        last = datetime.date(year + months[-1] // 12, months[-1] % 12 + 1, 1) - datetime.timedelta(days=1)
+        relations = overlay.describe(overlay.between(year_overlay, first, last), overlay.SLOW_BODIES)
+        result.append((f"【{period}】", (
+            f"{PROMPT_INTRO}以下のネイタルチャートとトランジットの惑星データを参考に、アスペクトも計算して、"
+            f"{year}年{period}の運勢を教えてください。\n"
+            f"{natal}{transits}\n\n"
+            f"【トランジットと出生図の関係（計算済み・{period}）】\n{relations}\n\n"
+            f"この人の{year}年{period}の運勢は月ごとにどのようになっていると考えられますか？\n{length}{note}"
+        )))
+    return result
+
+
+def _offset_at(birth, year, month, day, hour, minute):
+    """
+    出生地のタイムゾーンでその時刻に適用される (tz, dst)。
+    夏時間の有無は時刻ごとに変わるため、出生時の tz/dst は使わない (タイムゾーンが分からなければ使う)。
+    """
+    if birth.tzid:
+        return resolve_offset(birth.tzid, year, month, day, hour, minute)
+    return birth.tz, birth.dst
+
+
+def _today_transits(birth):
+    """
+    出生地のタイムゾーンでの今日の日付と、その日の正午のトランジット天体を返す。
+    天体位置は DailyPosition テーブルから補間する（無ければ swisseph で計算）。
+    """
+    zone = ZoneInfo(birth.tzid or JAPAN_ZONE)
+    today = datetime.datetime.now(zone).date()
+    noon = datetime.datetime.combine(today, datetime.time(12, 0), tzinfo=zone)
+    return today, transit_positions(noon, birth.ayanamsa)
+
+
 @csrf_protect
+@throttle_and_coalesce("analyze")
 def analyze(request):
     """
     POSTで受け取った出生データを使い、ホロスコープを計算→OpenAI で占いコメントを生成→返す。
@@ -117,45 +271,21 @@ def analyze(request):
     if request.method != "POST":
         return JsonResponse({"error": "POSTメソッドのみ対応しています。"}, status=400)
 
-    data = request.POST
-
-    try:
-        year = int(request.POST.get("year", "2023"))
-        month = int(request.POST.get("month", "1"))
-        day = int(request.POST.get("day", "1"))
-        hour = int(request.POST.get("hour", "0"))
-        minute = int(request.POST.get("minute", "0"))
-        lat = float(request.POST.get("lat", "35.6895"))
-        lon = float(request.POST.get("lon", "139.6917"))
-        tz = float(request.POST.get("tz", "9.0"))
-        dst = float(request.POST.get("dst", "0.0"))
-        sb = int(request.POST.get("sb", "1"))
-        prefecture = request.POST.get('prefecture', 'Tokyo')
-        unknown_str = request.POST.get("unknown", "false").lower()
-        unknown = unknown_str == "on"
-    except (ValueError, TypeError):
-        return JsonResponse({"error": "入力データに誤りがあります。"}, status=400)
-    
     try:
-        input_date = datetime.datetime(year, month, day)
-        if input_date < datetime.datetime(1900, 1, 1) or input_date > datetime.datetime(2100, 12, 31):
-            raise ValidationError("日付は1900年1月1日から2100年12月31日までの範囲で入力してください。")
+        birth = parse_birth_input(request.POST)
+        sb = parse_mode(request.POST)
     except ValidationError as ve:
-        return JsonResponse({"error": str(ve)}, status=400)
-    except Exception as e:
-        return JsonResponse({"error": "日付の解析に失敗しました。"}, status=400)
-    
+        return _input_error(ve, "入力データに誤りがあります。")
+    unknown = birth.unknown
 
-    # (1) ホロスコープ計算
-    
-    result_dict = compute_horoscope(year, month, day, hour, minute, lat, lon, tz, dst, prefecture)
-    
+    # (1) ホロスコープ計算 (出生時刻不明ならハウスを省いたチャート)
+    result_dict = horoscope_for(birth, unknown)
     horoscope_data = result_dict.get("analysis", {})
-    
 
-    # (2) ChatGPTへ送るプロンプト作成
-    horoscope_str = json.dumps(horoscope_data, ensure_ascii=False, indent=2)
-    user_message = "あなたは熟練した占星術師であり、日本語で丁寧に分かりやすく回答を行います。\n"
+    # (2) ChatGPTへ送るプロンプト作成 (チャートの項目・モデルは占いモードごとの設定 routing.route_for)
+    route = routing.route_for(sb)
+    horoscope_str = _chart_prompt(birth, unknown, route.sections)
+    user_message = PROMPT_INTRO
     if sb == 1:
         user_message += (
             "以下のネイタルチャートを参考に、性格を教えてください。\n"
@@ -205,55 +335,26 @@ def analyze(request):
             f"400字程度で結論だけ教えてください。\n"
         )
     elif sb == 9:
-        tokyo_now = datetime.datetime.now(ZoneInfo("Asia/Tokyo"))
-        today = tokyo_now.date()
-        year_t = today.year
-        month_t = today.month
-        day_t = today.day
-        result_dict = compute_horoscope(year_t, month_t, day_t, 12, 0, lat, lon, tz, dst, prefecture)
-        transit_data = result_dict.get("analysis", {}).get("1.天体の配置")
-        filtered_dict = {key: value for key, value in transit_data.items() if key not in ['アセンダント', 'ミッドヘヴェン']}
-        transit_str = json.dumps(filtered_dict, ensure_ascii=False, indent=2)
+        today, transit_data = _today_transits(birth)
+        year_t, month_t, day_t = today.year, today.month, today.day
+        transit_str = json.dumps(transit_data, ensure_ascii=False, indent=2)
+        overlay_str = overlay.describe(_transit_overlay(birth, today, 1, unknown))
         user_message += (
             f"以下のネイタルチャートとトランジットの惑星データを参考に、アスペクトも計算して、今日（{year_t}年{month_t}月{day_t}日）の運勢を教えてください。\n"
             "【ネイタルチャート】\n"
             f"{horoscope_str}\n\n"
             "【トランジットの惑星】\n"
             f"{transit_str}\n\n"
+            "【トランジットと出生図の関係（計算済み）】\n"
+            f"{overlay_str}\n\n"
             f"この人の今日（{year_t}年{month_t}月{day_t}日）の運勢はどのようになっていると考えられますか？\n"
             f"400字程度で結論だけ教えてください。\n"
         )
     elif sb == 10:
-        tokyo_now = datetime.datetime.now(ZoneInfo("Asia/Tokyo"))
-        today = tokyo_now.date()
-        year_t = today.year
-
-        # 各月のトランジットデータを格納する辞書を初期化
-        transit_str = {}
-
-        for month in range(1, 13):
-            # 各月のホロスコープを計算
-            horoscope_result = compute_horoscope(year_t, month, 1, 12, 0, lat, lon, tz, dst, prefecture)
-            result_dict[month] = horoscope_result
-
-            # トランジットデータの抽出と不要なキーの除外
-            transit_data = horoscope_result.get("analysis", {}).get("1.天体の配置", {})
-            filtered = {k: v for k, v in transit_data.items() if k not in ['アセンダント', 'ミッドヘヴェン']}
-            transit_str[month] = json.dumps(filtered, ensure_ascii=False, indent=2)
-
-        # 各月のトランジットデータの文字列を生成
-        transit_messages = "\n\n".join(
-            [f"【トランジットの惑星{month}月】\n{transit_str[month]}" for month in range(1, 13)]
-        )
-
-        # ユーザーメッセージの生成
-        user_message += (
-            f"以下のネイタルチャートとトランジットの惑星データを参考に、アスペクトも計算して、今年（{year_t}年）の運勢を教えてください。\n"
-            f"【ネイタルチャート】\n{horoscope_str}\n\n"
-            f"{transit_messages}\n\n"
-            f"トランジットの特に外惑星との関係から、この人の今年（{year_t}年）の運勢はどのようになっていると考えられますか？\n"
-            f"400字程度で結論だけ教えてください。\n"
-        )
+        year_t = datetime.datetime.now(ZoneInfo("Asia/Tokyo")).year
+        transit_str, year_overlay = _yearly_transits(birth, year_t, unknown)
+        if route.parts == 1:
+            user_message += _yearly_message(horoscope_str, year_t, transit_str, year_overlay, brief=True)
     elif sb == 11:
         user_message += (
             "以下のネイタルチャートを参考に、性格を教えてください。\n"
@@ -297,53 +398,25 @@ def analyze(request):
             "この人の学業運はどのようになっていると考えられますか？\n"
         )
     elif sb == 19:
-        tokyo_now = datetime.datetime.now(ZoneInfo("Asia/Tokyo"))
-        today = tokyo_now.date()
-        year_t = today.year
-        month_t = today.month
-        day_t = today.day
-        result_dict = compute_horoscope(year_t, month_t, day_t, 12, 0, lat, lon, tz, dst, prefecture)
-        transit_data = result_dict.get("analysis", {}).get("1.天体の配置")
-        filtered_dict = {key: value for key, value in transit_data.items() if key not in ['アセンダント', 'ミッドヘヴェン']}
-        transit_str = json.dumps(filtered_dict, ensure_ascii=False, indent=2)
+        today, transit_data = _today_transits(birth)
+        year_t, month_t, day_t = today.year, today.month, today.day
+        transit_str = json.dumps(transit_data, ensure_ascii=False, indent=2)
+        overlay_str = overlay.describe(_transit_overlay(birth, today, 1, unknown))
         user_message += (
             f"以下のネイタルチャートとトランジットの惑星データを参考に、アスペクトも計算して、今日（{year_t}年{month_t}月{day_t}日）の運勢を教えてください。\n"
             "【ネイタルチャート】\n"
             f"{horoscope_str}\n\n"
             "【トランジットの惑星】\n"
             f"{transit_str}\n\n"
+            "【トランジットと出生図の関係（計算済み）】\n"
+            f"{overlay_str}\n\n"
             f"この人の今日（{year_t}年{month_t}月{day_t}日）の運勢はどのようになっていると考えられますか？\n"
         )
     elif sb == 20:
-        tokyo_now = datetime.datetime.now(ZoneInfo("Asia/Tokyo"))
-        today = tokyo_now.date()
-        year_t = today.year
-
-        # 各月のトランジットデータを格納する辞書を初期化
-        transit_str = {}
-
-        for month in range(1, 13):
-            # 各月のホロスコープを計算
-            horoscope_result = compute_horoscope(year_t, month, 1, 12, 0, lat, lon, tz, dst, prefecture)
-            result_dict[month] = horoscope_result
-
-            # トランジットデータの抽出と不要なキーの除外
-            transit_data = horoscope_result.get("analysis", {}).get("1.天体の配置", {})
-            filtered = {k: v for k, v in transit_data.items() if k not in ['アセンダント', 'ミッドヘヴェン']}
-            transit_str[month] = json.dumps(filtered, ensure_ascii=False, indent=2)
-
-        # 各月のトランジットデータの文字列を生成
-        transit_messages = "\n\n".join(
-            [f"【トランジットの惑星{month}月】\n{transit_str[month]}" for month in range(1, 13)]
-        )
-
-        # ユーザーメッセージの生成
-        user_message += (
-            f"以下のネイタルチャートとトランジットの惑星データを参考に、アスペクトも計算して、今年（{year_t}年）の運勢を教えてください。\n"
-            f"【ネイタルチャート】\n{horoscope_str}\n\n"
-            f"{transit_messages}\n\n"
-            f"トランジットの特に外惑星との関係から、この人の今年（{year_t}年）の運勢はどのようになっていると考えられますか？\n"
-        )
+        year_t = datetime.datetime.now(ZoneInfo("Asia/Tokyo")).year
+        transit_str, year_overlay = _yearly_transits(birth, year_t, unknown)
+        if route.parts == 1:
+            user_message += _yearly_message(horoscope_str, year_t, transit_str, year_overlay)
 
     elif sb == 21:
         user_message += (
@@ -388,89 +461,59 @@ def analyze(request):
             "この人の学業運はどのようになっていると考えられますか？\n"
         )
     elif sb == 29:
-        tokyo_now = datetime.datetime.now(ZoneInfo("Asia/Tokyo"))
-        today = tokyo_now.date()
-        year_t = today.year
-        month_t = today.month
-        day_t = today.day
-        result_dict = compute_horoscope(year_t, month_t, day_t, 12, 0, lat, lon, tz, dst, prefecture)
-        transit_data = result_dict.get("analysis", {}).get("1.天体の配置")
-        filtered_dict = {key: value for key, value in transit_data.items() if key not in ['アセンダント', 'ミッドヘヴェン']}
-        transit_str = json.dumps(filtered_dict, ensure_ascii=False, indent=2)
+        today, transit_data = _today_transits(birth)
+        year_t, month_t, day_t = today.year, today.month, today.day
+        transit_str = json.dumps(transit_data, ensure_ascii=False, indent=2)
+        overlay_str = overlay.describe(_transit_overlay(birth, today, 1, unknown))
         user_message += (
             f"以下のネイタルチャートとトランジットの惑星データを参考に、アスペクトも計算して、今日（{year_t}年{month_t}月{day_t}日）の運勢を教えてください。\n"
             "【ネイタルチャート】\n"
             f"{horoscope_str}\n\n"
             "【トランジットの惑星】\n"
             f"{transit_str}\n\n"
+            "【トランジットと出生図の関係（計算済み）】\n"
+            f"{overlay_str}\n\n"
             f"この人の今日（{year_t}年{month_t}月{day_t}日）の運勢はどのようになっていると考えられますか？\n"
         )
     elif sb == 30:
-        tokyo_now = datetime.datetime.now(ZoneInfo("Asia/Tokyo"))
-        today = tokyo_now.date()
-        year_t = today.year
-
-        # 各月のトランジットデータを格納する辞書を初期化
-        transit_str = {}
-
-        for month in range(1, 13):
-            # 各月のホロスコープを計算
-            horoscope_result = compute_horoscope(year_t, month, 1, 12, 0, lat, lon, tz, dst, prefecture)
-            result_dict[month] = horoscope_result
-
-            # トランジットデータの抽出と不要なキーの除外
-            transit_data = horoscope_result.get("analysis", {}).get("1.天体の配置", {})
-            filtered = {k: v for k, v in transit_data.items() if k not in ['アセンダント', 'ミッドヘヴェン']}
-            transit_str[month] = json.dumps(filtered, ensure_ascii=False, indent=2)
-
-        # 各月のトランジットデータの文字列を生成
-        transit_messages = "\n\n".join(
-            [f"【トランジットの惑星{month}月】\n{transit_str[month]}" for month in range(1, 13)]
-        )
-
-        # ユーザーメッセージの生成
-        user_message += (
-            f"以下のネイタルチャートとトランジットの惑星データを参考に、アスペクトも計算して、今年（{year_t}年）の運勢を教えてください。\n"
-            f"【ネイタルチャート】\n{horoscope_str}\n\n"
-            f"{transit_messages}\n\n"
-            f"トランジットの特に外惑星との関係から、この人の今年（{year_t}年）の運勢はどのようになっていると考えられますか？\n"
-        )
+        # 21〜30 はプロンプトをそのまま返すため、分割せず1つのプロンプトにする
+        year_t = datetime.datetime.now(ZoneInfo("Asia/Tokyo")).year
+        transit_str, year_overlay = _yearly_transits(birth, year_t, unknown)
+        user_message += _yearly_message(horoscope_str, year_t, transit_str, year_overlay)
 
 
-    if unknown:
-        user_message += "出生時刻が不明なので、アセンダント、MC、ハウスのデータは使わないでください。"
+    unknown_note = "出生時刻が不明なので、ハウスのデータはありません。月は出生日の範囲も考慮してください。" if unknown else ""
+    user_message += unknown_note
 
     # ★ 追加: sb が 21〜30 のときは user_message をそのまま返す
     if 21 <= sb <= 30:
         return JsonResponse({"result": user_message})
     
 
-    # (3) OpenAI APIキーを取得し、ChatCompletionを呼び出し
-    OPENAI_API_KEY = os.environ.get("OPENAI_API_KEY")
-    if not OPENAI_API_KEY:
+    # (3) OpenAI APIキーを確認し、ChatCompletionを呼び出し
+    if not llm.is_configured():
         return JsonResponse({"error": "OpenAI APIキーが設定されていません。"}, status=500)
 
-    client = OpenAI(api_key=OPENAI_API_KEY)
-
+    # 失敗・タイムアウト時は過去の回答か、チャートから作った定型文を返す (llm.complete)
     try:
-        chat_completion = client.chat.completions.create(
-            messages=[
-                # {"role": "system", "content": "あなたは熟練した占星術師であり、日本語で丁寧に分かりやすく回答を行います。"},
-                {"role": "user", "content": user_message},
-            ],
-            model="gpt-5-mini",  # 必要に応じてモデル名を修正
-            timeout=180,
-            # temperature=0.7,
-            # max_tokens=1500
-        )
-        answer = chat_completion.choices[0].message.content
-    except Exception as e:
-        return JsonResponse({"error": f"OpenAI APIの呼び出しに失敗: {e}"}, status=500)
+        if sb in (10, 20) and route.parts > 1:
+            # 1年の運勢は 全体の流れ と 期間ごとの運勢 を並列に生成してつなげる
+            reply = llm.complete_parts(
+                _yearly_parts(horoscope_str, year_t, transit_str, year_overlay, route.parts, unknown_note,
+                              brief=sb == 10),
+                lambda: fallback.template_reading(horoscope_data, sb),
+                endpoint="analyze", sb=sb, **route.options())
+        else:
+            reply = llm.complete(user_message, lambda: fallback.template_reading(horoscope_data, sb),
+                                 endpoint="analyze", sb=sb, **route.options())
+    except usage.PromptTooLarge as e:
+        return JsonResponse({"error": "入力が大きすぎるため鑑定できません。", "detail": str(e)}, status=400)
 
     # (4) 結果を返す
-    return JsonResponse({"result": answer})
+    return _reply_response(reply)
 
 @csrf_protect
+@throttle_and_coalesce("analyze_compatibility")
 def analyze_compatibility(request):
     """
     POSTで受け取った出生データを使い、ホロスコープを計算→OpenAI で占いコメントを生成→返す。
@@ -478,63 +521,36 @@ def analyze_compatibility(request):
     if request.method != "POST":
         return JsonResponse({"error": "POSTメソッドのみ対応しています。"}, status=400)
 
-    data = request.POST
-
-    try:
-        year1 = int(request.POST.get("year1", "2023"))
-        month1 = int(request.POST.get("month1", "1"))
-        day1 = int(request.POST.get("day1", "1"))
-        hour1 = int(request.POST.get("hour1", "0"))
-        minute1 = int(request.POST.get("minute1", "0"))
-        lat1 = float(request.POST.get("lat1", "35.6895"))
-        lon1 = float(request.POST.get("lon1", "139.6917"))
-        tz1 = float(request.POST.get("tz1", "9.0"))
-        dst1 = float(request.POST.get("dst1", "0.0"))
-        prefecture1 = request.POST.get('prefecture1', 'Tokyo')
-        unknown_str1 = request.POST.get("unknown1", "false").lower()
-        unknown1 = unknown_str1 == "on"
-        
-        year2 = int(request.POST.get("year2", "2023"))
-        month2 = int(request.POST.get("month2", "1"))
-        day2 = int(request.POST.get("day2", "1"))
-        hour2 = int(request.POST.get("hour2", "0"))
-        minute2 = int(request.POST.get("minute2", "0"))
-        lat2 = float(request.POST.get("lat2", "35.6895"))
-        lon2 = float(request.POST.get("lon2", "139.6917"))
-        tz2 = float(request.POST.get("tz2", "9.0"))
-        dst2 = float(request.POST.get("dst2", "0.0"))
-        prefecture2 = request.POST.get('prefecture2', 'Tokyo')
-        unknown_str2 = request.POST.get("unknown2", "false").lower()
-        unknown2 = unknown_str2 == "on"
-        
-        sb = int(request.POST.get("sb", "1"))
-        
-
-
-    except (ValueError, TypeError):
-        return JsonResponse({"error": "入力データに誤りがあります。"}, status=400)
-    
+    errors = {}
+    births = []
+    for suffix in ("1", "2"):
+        try:
+            births.append(parse_birth_input(request.POST, suffix))
+        except ValidationError as ve:
+            errors.update(ve.message_dict)
     try:
-        input_date = datetime.datetime(year1, month1, day1)
-        if input_date < datetime.datetime(1900, 1, 1) or input_date > datetime.datetime(2100, 12, 31):
-            raise ValidationError("日付は1900年1月1日から2100年12月31日までの範囲で入力してください。")
+        sb = parse_mode(request.POST)
     except ValidationError as ve:
-        return JsonResponse({"error": str(ve)}, status=400)
-    except Exception as e:
-        return JsonResponse({"error": "日付の解析に失敗しました。"}, status=400)
-    
+        errors.update(ve.message_dict)
+    if errors:
+        return _input_error(ValidationError(errors), "入力データに誤りがあります。")
+    birth1, birth2 = births
+    unknown1, unknown2 = birth1.unknown, birth2.unknown
 
     # (1) ホロスコープ計算
-    result_dict1 = compute_horoscope(year1, month1, day1, hour1, minute1, lat1, lon1, tz1, dst1, prefecture1)
-    result_dict2 = compute_horoscope(year2, month2, day2, hour2, minute2, lat2, lon2, tz2, dst2, prefecture2)
+    # 2人分でも1ms未満で、swisseph は GIL を持ったまま計算するため、スレッドに分けても速くならない
+    # (bench compatibility で確認)。「私」のチャートとその JSON は相手を変えて続けて占う間は再利用される
+    result_dict1 = horoscope_for(birth1, unknown1)
+    result_dict2 = horoscope_for(birth2, unknown2)
     horoscope_data1 = result_dict1.get("analysis", {})
     horoscope_data2 = result_dict2.get("analysis", {})
 
-    # (2) ChatGPTへ送るプロンプト作成
-    horoscope_str1 = json.dumps(horoscope_data1, ensure_ascii=False, indent=2)
-    horoscope_str2 = json.dumps(horoscope_data2, ensure_ascii=False, indent=2)
+    # (2) ChatGPTへ送るプロンプト作成 (チャートの項目・モデルは占いモードごとの設定 routing.route_for)
+    route = routing.route_for(sb)
+    horoscope_str1 = _chart_prompt(birth1, unknown1, route.sections)
+    horoscope_str2 = _chart_prompt(birth2, unknown2, route.sections)
     
-    user_message = "あなたは熟練した占星術師であり、日本語で丁寧に分かりやすく回答を行います。\n"
+    user_message = PROMPT_INTRO
     if sb == 7:
         user_message += (
             "以下のネイタルチャートを参考に、二人の相性を教えてください。\n"
@@ -573,118 +589,211 @@ def analyze_compatibility(request):
         )
 
     if unknown1 == True and unknown2 == False:
-        user_message += "私の出生時刻が不明なので、私のアセンダント、MC、ハウスのデータは使わないでください。"
+        user_message += "私の出生時刻が不明なので、私のハウスのデータはありません。私の月は出生日の範囲も考慮してください。"
     elif unknown1 == False and unknown2 == True:
-        user_message += "お相手の出生時刻が不明なので、お相手のアセンダント、MC、ハウスのデータは使わないでください。"
+        user_message += "お相手の出生時刻が不明なので、お相手のハウスのデータはありません。お相手の月は出生日の範囲も考慮してください。"
     elif unknown1 == True and unknown2 == True:
-        user_message += "二人の出生時刻が不明なので、アセンダント、MC、ハウスのデータは使わないでください。"
+        user_message += "二人の出生時刻が不明なので、ハウスのデータはありません。月は出生日の範囲も考慮してください。"
 
     # ★ 追加: sb が 21〜30 のときは user_message をそのまま返す
     if 17 <= sb <= 18:
         return JsonResponse({"result": user_message})
     
 
-    # (3) OpenAI APIキーを取得し、ChatCompletionを呼び出し
-    OPENAI_API_KEY = os.environ.get("OPENAI_API_KEY")
-    if not OPENAI_API_KEY:
+    # (3) OpenAI APIキーを確認し、ChatCompletionを呼び出し
+    if not llm.is_configured():
         return JsonResponse({"error": "OpenAI APIキーが設定されていません。"}, status=500)
 
-    client = OpenAI(api_key=OPENAI_API_KEY)
-
+    # 失敗・タイムアウト時は過去の回答か、チャートから作った定型文を返す (llm.complete)
     try:
-        chat_completion = client.chat.completions.create(
-            messages=[
-                # {"role": "system", "content": "あなたは熟練した占星術師であり、日本語で丁寧に分かりやすく回答を行います。"},
-                {"role": "user", "content": user_message},
-            ],
-            model="gpt-5-mini",  # 必要に応じてモデル名を修正
-            timeout=180,
-            # temperature=0.7,
-            # max_tokens=1500
-        )
-        answer = chat_completion.choices[0].message.content
-    except Exception as e:
-        return JsonResponse({"error": f"OpenAI APIの呼び出しに失敗: {e}"}, status=500)
+        reply = llm.complete(user_message, lambda: fallback.template_compatibility(
+            horoscope_data1, horoscope_data2,
+            scoring.score_pair(result_dict1, result_dict2)["score"], sb),
+            endpoint="analyze_compatibility", sb=sb, **route.options())
+    except usage.PromptTooLarge as e:
+        return JsonResponse({"error": "入力が大きすぎるため鑑定できません。", "detail": str(e)}, status=400)
 
     # (4) 結果を返す
-    return JsonResponse({"result": answer})
+    return _reply_response(reply)
 
 
-def horoscope_detail(request):
+def compatibility_score(request):
+    """
+    二人の相性スコア(0〜100点)を LLM を使わずに計算して返す。
 
+    例:
+      /compatibility/score/?year1=1990&month1=5&day1=3&hour1=14&minute1=30&prefecture1=Tokyo
+        &year2=1992&month2=2&day2=29&hour2=8&minute2=5&prefecture2=Osaka
+    """
+    if request.method != "GET":
+        return JsonResponse({"error": "Invalid request method. GETのみ対応しています。"}, status=400)
+
+    errors = {}
+    births = []
+    for suffix in ("1", "2"):
+        try:
+            births.append(parse_birth_input(request.GET, suffix))
+        except ValidationError as ve:
+            errors.update(ve.message_dict)
+    if errors:
+        return _input_error(ValidationError(errors), "入力データに誤りがあります。")
+    birth1, birth2 = births
+    return JsonResponse(scoring.score_pair(horoscope_for(birth1, birth1.unknown),
+                                           horoscope_for(birth2, birth2.unknown)))
+
+
+# 相性の良い候補を返す最大件数
+MAX_TOP_MATCHES = 100
+
+
+def compatibility_top(request):
+    """
+    登録済みのチャート (StoredChart) の中から、相性スコアの高い順に k 件を返す。
+
+    例:
+      /compatibility/top/?year=1990&month=5&day=3&hour=14&minute=30&prefecture=Tokyo&k=10
+    """
     if request.method != "GET":
         return JsonResponse({"error": "Invalid request method. GETのみ対応しています。"}, status=400)
 
-    # GETから各値を取得
     try:
-        year = int(request.GET.get("year", "2023"))
-        month = int(request.GET.get("month", "1"))
-        day = int(request.GET.get("day", "1"))
-        hour = int(request.GET.get("hour", "0"))
-        minute = int(request.GET.get("minute", "0"))
-        lat = float(request.GET.get("lat", "35.6895"))
-        lon = float(request.GET.get("lon", "139.6917"))
-        tz = float(request.GET.get("tz", "9.0"))
-        dst = float(request.GET.get("dst", "0.0"))
-        prefecture = request.GET.get('prefecture', 'Tokyo')
-    except ValueError as ve:
-        return JsonResponse({"error": "Invalid input parameters", "details": str(ve)}, status=400)
+        birth = scoring.comparable_birth(parse_birth_input(request.GET))
+        k = parse_int_param(request.GET, "k", 10, 1, MAX_TOP_MATCHES)
+    except ValidationError as ve:
+        return _input_error(ve, "Invalid input parameters")
+
+    longitudes, cusps = scoring.chart_features(horoscope_for(birth, birth.unknown))
+    pool = scoring.candidate_pool()
+    # 本人が登録済みの場合は結果から除く
+    own_id = StoredChart.objects.filter(key=birth.key).values_list("id", flat=True).first()
+    return JsonResponse({
+        "count": len(pool),
+        "results": pool.top_matches(longitudes, cusps, k, exclude_id=own_id),
+    })
+
+
+def similar_charts(request):
+    """
+    登録済みのチャートの中から、出生データのチャートに似たものを近い順に k 件返す。
+    インデックスは chart_index コマンドで作成する（未作成の場合は 503）。
+
+    例:
+      /charts/similar/?year=1990&month=5&day=3&hour=14&minute=30&prefecture=Tokyo&k=10
+    """
+    if request.method != "GET":
+        return JsonResponse({"error": "Invalid request method. GETのみ対応しています。"}, status=400)
 
     try:
-        input_date = datetime.datetime(year, month, day)
-        if input_date < datetime.datetime(1900, 1, 1) or input_date > datetime.datetime(2100, 12, 31):
-            raise ValidationError("日付は1900年1月1日から2100年12月31日までの範囲で入力してください。")
+        birth = scoring.comparable_birth(parse_birth_input(request.GET))
+        k = parse_int_param(request.GET, "k", 10, 1, MAX_TOP_MATCHES)
     except ValidationError as ve:
-        return JsonResponse({"error": str(ve)}, status=400)
-    except Exception as e:
-        return JsonResponse({"error": "日付の解析に失敗しました。"}, status=400)
-    
+        return _input_error(ve, "Invalid input parameters")
+
+    index = similarity.get_index()
+    if index is None:
+        return JsonResponse({"error": "検索インデックスが作成されていません。"}, status=503)
+    longitudes, _ = scoring.chart_features(horoscope_for(birth, birth.unknown))
+    own_id = StoredChart.objects.filter(key=birth.key).values_list("id", flat=True).first()
+    found = index.search(similarity.feature_vectors(longitudes), k, exclude_id=own_id)
+    labels = dict(StoredChart.objects.filter(id__in=[pk for pk, _ in found]).values_list("id", "label"))
+    return JsonResponse({
+        "count": len(index),
+        "results": [
+            {"id": pk, "label": labels.get(pk, ""), "distance": round(distance, 4),
+             "similarity": round(100 * (1 - distance / similarity.MAX_DISTANCE), 1)}
+            for pk, distance in found
+        ],
+    })
+
+
+# 詳細ページの表部分のフラグメントキャッシュの保持秒数（同じ出生データなら内容は変わらない）
+DETAIL_CACHE_TIMEOUT = 60 * 60 * 24
+
+
+def _detail_view_model(birth) -> dict:
+    """
+    horoscope_detail.html の表に必要な値だけをまとめる。
+    四区分などの天体リストはテンプレートでループせずに済むよう文字列にしておく。
+    """
+    analysis = horoscope_for(birth)["analysis"]
+    house_info = analysis["2.惑星のハウス"]
+    house_ruler = analysis["3.ハウスの支配星"]
+    return {
+        "planets": [
+            {"planet": planet.strip(),
+             "zodiac_formatted": z_info["formatted"],
+             "house": house_info.get(planet.strip())}
+            for planet, z_info in analysis["1.天体の配置"].items()
+        ],
+        "houses": [
+            {"house": cusp["house"],
+             "cusp_formatted": cusp["formatted"],
+             "ruler": house_ruler.get(cusp["house"])}
+            for cusp in analysis["8.ハウスカスプ"]
+        ],
+        "four_elements": [(k, ", ".join(v)) for k, v in analysis["5.天体の四区分"].items()],
+        "three_modes": [(k, ", ".join(v)) for k, v in analysis["6.天体の三区分"].items()],
+        "two_polarities": [(k, ", ".join(v)) for k, v in analysis["7.天体の二区分"].items()],
+        "aspects": analysis["4.アスペクトの結果"],
+    }
 
-    # ユーティリティ関数で計算
-    result_dict = compute_horoscope(year, month, day, hour, minute, lat, lon, tz, dst, prefecture)
 
-    # JSONとして返す
-    data = result_dict
-
-    merged_planets = []
-    for planet, z_info in data["analysis"]["1.天体の配置"].items():
-        clean_planet = planet.strip()
-        h_info = data["analysis"]["2.惑星のハウス"].get(clean_planet, None)
-        merged_planets.append({
-            "planet": clean_planet,
-            "zodiac_formatted": z_info["formatted"],
-            "house": h_info
-        })
-    
-    merged_house_data = []
-    for cusp in data["analysis"]["8.ハウスカスプ"]:
-        # 「house」番号を取り出し
-        house_number = cusp["house"]
-        # house_ruler の中から該当の「支配星」を取得（存在しない場合は None）
-        ruler = data["analysis"]["3.ハウスの支配星"].get(house_number, None)
-
-        merged_house_data.append({
-            "house": house_number,
-            "cusp_formatted": cusp["formatted"],
-            "ruler": ruler
-        })
-
-    # テンプレートに渡すコンテキストを作成
+def horoscope_detail(request):
+
+    if request.method != "GET":
+        return JsonResponse({"error": "Invalid request method. GETのみ対応しています。"}, status=400)
+
+    # GETから各値を取得
+    try:
+        birth = parse_birth_input(request.GET)
+    except ValidationError as ve:
+        return _input_error(ve, "Invalid input parameters")
+
+    # 表はチャートのキーでフラグメントキャッシュするため、
+    # キャッシュにない場合だけ(テンプレートが detail を参照した時点で)計算する
     context = {
-        'zodiac_info': data["analysis"]["1.天体の配置"],
-        'house_info': data["analysis"]["2.惑星のハウス"],
-        'house_ruler': data["analysis"]["3.ハウスの支配星"],
-        'aspects': data["analysis"]["4.アスペクトの結果"],
-        'four_elements': data["analysis"]["5.天体の四区分"],
-        'three_modes': data["analysis"]["6.天体の三区分"],
-        'two_polarities': data["analysis"]["7.天体の二区分"],
-        'house_cusps': data["analysis"]["8.ハウスカスプ"],
-        'marged_planets': merged_planets,
-        'merged_house_data': merged_house_data,
+        'chart_key': birth.key,
+        'detail_cache_timeout': DETAIL_CACHE_TIMEOUT,
+        'detail': SimpleLazyObject(lambda: _detail_view_model(birth)),
     }
     return render(request, 'horoscope_app/horoscope_detail.html', context)
 
 
+def _chart_svg_etag(request):
+    try:
+        return chart_etag(parse_birth_input(request.GET))
+    except ValidationError:
+        return None
+
+
+@etag(_chart_svg_etag)
+def horoscope_chart_svg(request):
+    """
+    ホロスコープのチャート(ホイール)を SVG で返す。
+    ETag を付け、URL に描画のバージョン (v=CHART_SVG_VERSION) が入っている場合だけ
+    長期キャッシュ(immutable)にする。v が無い・古い URL は描画を変えると内容が変わるため、
+    短い max-age にして期限後は ETag で再検証させる。
+
+    例:
+      /horoscope/chart.svg?year=2025&month=1&day=29&hour=14&minute=30
+        &lat=35.6895&lon=139.6917&prefecture=Tokyo&v=1
+    """
+    if request.method != "GET":
+        return JsonResponse({"error": "Invalid request method. GETのみ対応しています。"}, status=400)
+
+    try:
+        birth = parse_birth_input(request.GET)
+    except ValidationError as ve:
+        return _input_error(ve, "Invalid input parameters")
+
+    response = HttpResponse(chart_svg_for(birth), content_type="image/svg+xml; charset=utf-8")
+    if request.GET.get("v") == str(CHART_SVG_VERSION):
+        patch_cache_control(response, public=True, max_age=31536000, immutable=True)
+    else:
+        patch_cache_control(response, public=True, max_age=CHART_SVG_MAX_AGE)
+    return response
+
+
 def horoscope_ai(request):
     """
     GETパラメータからホロスコープを計算して JSON を返すAPIエンドポイント。
@@ -697,43 +806,24 @@ def horoscope_ai(request):
         return JsonResponse({"error": "Invalid request method. GETのみ対応しています。"}, status=400)
 
     # トークン検証
-    token = request.GET.get('token')
-    valid_token = request.session.get('valid_token')
-
-    if not (token and valid_token and token == valid_token):
+    # トークンは使い捨て（署名と有効期限を確認し、使用済みとして記録する）
+    if not consume_token(request.GET.get('token', '')):
         return HttpResponseForbidden('Forbidden: 無効なトークンです。')
 
-    # トークンは使い捨て
-    del request.session['valid_token']
     # GETから各値を取得
     try:
-        year = int(request.GET.get("year", "2023"))
-        month = int(request.GET.get("month", "1"))
-        day = int(request.GET.get("day", "1"))
-        hour = int(request.GET.get("hour", "0"))
-        minute = int(request.GET.get("minute", "0"))
-        lat = float(request.GET.get("lat", "35.6895"))
-        lon = float(request.GET.get("lon", "139.6917"))
-        tz = float(request.GET.get("tz", "9.0"))
-        dst = float(request.GET.get("dst", "0.0"))
-        prefecture = request.GET.get('prefecture', 'Tokyo')
-    except ValueError as ve:
-        return JsonResponse({"error": "Invalid input parameters", "details": str(ve)}, status=400)
-
-    try:
-        input_date = datetime.datetime(year, month, day)
-        if input_date < datetime.datetime(1900, 1, 1) or input_date > datetime.datetime(2100, 12, 31):
-            raise ValidationError("日付は1900年1月1日から2100年12月31日までの範囲で入力してください。")
+        birth = parse_birth_input(request.GET)
     except ValidationError as ve:
-        return JsonResponse({"error": str(ve)}, status=400)
-    except Exception as e:
-        return JsonResponse({"error": "日付の解析に失敗しました。"}, status=400)
-    
+        return _input_error(ve, "Invalid input parameters")
 
     # ユーティリティ関数で計算
-    result_dict = compute_horoscope(year, month, day, hour, minute, lat, lon, tz, dst, prefecture)
+    result_dict = horoscope_for(birth)
     
     result_dict = result_dict["analysis"]
+    try:
+        fields = parse_fields(request.GET, list(result_dict))
+    except ValidationError as ve:
+        return _input_error(ve, "Invalid input parameters")
 
 
     # 元のデータを壊さないように、深いコピーを作成する
@@ -746,9 +836,180 @@ def horoscope_ai(request):
     }
 
     # ハウスカスプのformattedだけを抽出
-    result_copy["8.ハウスカスプ"] = [
-        cusp["formatted"] for cusp in result_dict["8.ハウスカスプ"]
-    ]
+    if "8.ハウスカスプ" in result_dict:
+        result_copy["8.ハウスカスプ"] = [
+            cusp["formatted"] for cusp in result_dict["8.ハウスカスプ"]
+        ]
 
     # JSONとして返す
-    return JsonResponse(result_copy)
+    return JsonResponse(_project(result_copy, fields))
+
+
+# 1リクエストで計算するリターンの最大件数
+MAX_SOLAR_RETURNS = 150
+MAX_LUNAR_RETURNS = 60
+
+
+def forecast_returns(request):
+    """
+    ソーラー/ルナー・リターンの瞬間を JSON で返す。
+
+    例:
+      /forecast/returns/?year=1990&month=5&day=3&hour=14&minute=30&prefecture=Tokyo
+        &kind=solar&from=2020&to=2030          (ソーラー: from〜to 年)
+        &kind=lunar&start=2025-01-01&count=12  (ルナー: start 以降 count 回)
+        &chart=1                               (各リターンのチャートも含める)
+        &fields=1,4                            (チャートの項目を絞る)
+
+    チャートを含める場合は1件ずつ計算しながらストリーミングで返す。
+    """
+    if request.method != "GET":
+        return JsonResponse({"error": "Invalid request method. GETのみ対応しています。"}, status=400)
+
+    params = request.GET
+    kind = params.get("kind", "solar")
+    if kind not in ("solar", "lunar"):
+        return JsonResponse({"error": "kind は solar または lunar を指定してください。"}, status=400)
+    with_chart = params.get("chart") in ("1", "true", "on")
+    today = datetime.date.today()
+    try:
+        birth = parse_birth_input(params)
+        if kind == "solar":
+            first = parse_int_param(params, "from", today.year, birth.year, 2100)
+            last = parse_int_param(params, "to", first, first, min(2100, first + MAX_SOLAR_RETURNS - 1))
+        else:
+            start = parse_date_param(params, "start", today)
+            count = parse_int_param(params, "count", 12, 1, MAX_LUNAR_RETURNS)
+        fields = parse_fields(params, list(horoscope_for(birth)["analysis"])) if with_chart else ()
+    except ValidationError as ve:
+        return _input_error(ve, "Invalid input parameters")
+
+    if kind == "solar":
+        results = progressions.iter_solar_returns(birth, first, last, with_chart)
+    else:
+        results = progressions.iter_lunar_returns(birth, start, count, with_chart)
+    if not with_chart:
+        return JsonResponse({"kind": kind, "results": list(results)})
+    if fields:
+        results = ({**entry, "chart": _project(entry["chart"], fields)} for entry in results)
+    return stream_json({"kind": kind}, "results", results)
+
+
+def forecast_progression(request):
+    """
+    二次進行(1日=1年)の進行チャートを JSON で返す。
+
+    例:
+      /forecast/progression/?year=1990&month=5&day=3&hour=14&minute=30&prefecture=Tokyo&date=2025-01-01
+        &fields=1.天体の配置   (任意: 返す項目)
+    """
+    if request.method != "GET":
+        return JsonResponse({"error": "Invalid request method. GETのみ対応しています。"}, status=400)
+
+    try:
+        birth = parse_birth_input(request.GET)
+        on = parse_date_param(request.GET, "date", datetime.date.today())
+        fields = parse_fields(request.GET, list(horoscope_for(birth)["analysis"]))
+    except ValidationError as ve:
+        return _input_error(ve, "Invalid input parameters")
+    result = progressions.secondary_progression(birth, on)
+    result["chart"] = _project(result["chart"], fields)
+    return JsonResponse(result)
+
+
+MAX_OVERLAY_DAYS = 366
+MAX_OVERLAY_STEPS = 24 * 31   # 1時間おきなら31日分まで
+
+
+def transit_overlay(request):
+    """
+    トランジット天体を出生チャートに重ね、出生のハウスと出生天体へのアスペクトの期間を JSON で返す (カレンダー表示用)。
+    step_hours が2以下のときは月も含める。
+
+    例:
+      /horoscope/transits/?year=1990&month=5&day=3&hour=14&minute=30&prefecture=Tokyo
+        &start=2025-01-01&days=90   (任意: 開始日(既定は今日)・日数)
+        &step_hours=24              (任意: 計算する間隔(時間)。24なら毎日正午)
+    """
+    if request.method != "GET":
+        return JsonResponse({"error": "Invalid request method. GETのみ対応しています。"}, status=400)
+
+    try:
+        birth = parse_birth_input(request.GET)
+        today = datetime.datetime.now(ZoneInfo(birth.tzid or JAPAN_ZONE)).date()
+        start = parse_date_param(request.GET, "start", today)
+        days = parse_int_param(request.GET, "days", 30, 1, MAX_OVERLAY_DAYS)
+        step_hours = parse_int_param(request.GET, "step_hours", 24, 1, 24)
+        if days * 24 // step_hours > MAX_OVERLAY_STEPS:
+            raise ValidationError({"step_hours": [f"計算する時刻が多すぎます ({MAX_OVERLAY_STEPS}件まで)。"
+                                                  "間隔を長くするか日数を減らしてください。"]})
+    except ValidationError as ve:
+        return _input_error(ve, "Invalid input parameters")
+    result = overlay.timeline(birth, overlay.instants(start, days, step_hours, birth.tzid), birth.unknown, step_hours)
+    return JsonResponse({"start": start.isoformat(), "days": days, "step_hours": step_hours,
+                         "steps": result["steps"], "houses": result["houses"], "aspects": result["aspects"]})
+
+
+@staff_member_required
+def metrics_view(request):
+    """
+    プロセス内メトリクス(レート制限の拒否数・合流数など)と OpenAI 呼び出しの状態を JSON で返す。
+    管理者ログインが必要。
+    """
+    return JsonResponse({"pid": os.getpid(), "counters": metrics.snapshot(), "llm": llm.status()})
+
+
+@staff_member_required
+def llm_usage_report(request):
+    """
+    OpenAI のトークン数と費用を 日付・エンドポイント・占いモード ごとに集計して JSON で返す。
+    管理者ログインが必要。
+
+    例:
+      /metrics/llm-usage/?days=30
+    """
+    try:
+        days = parse_int_param(request.GET, "days", 7, 1, 366)
+    except ValidationError as ve:
+        return _input_error(ve, "Invalid input parameters")
+    # 直前の呼び出しまで集計に含める
+    usage.flush()
+    return JsonResponse(usage.report(days))
+
+
+@cache_control(public=True, max_age=86400)
+def geocode_autocomplete(request):
+    """
+    出生地のオートコンプリート(地名辞書の前方一致)を JSON で返す。
+    地名 (英語・日本語) のほか、よみ (ひらがな・カタカナ) でも引ける。
+    地名辞書は都道府県と国内外の主要都市だけで、市区町村すべては含まない。
+
+    例: /geocode/autocomplete/?q=おおさ&limit=5
+    """
+    q = request.GET.get("q", "")[:64]
+    try:
+        limit = min(max(int(request.GET.get("limit", "10")), 1), 20)
+    except ValueError:
+        limit = 10
+    return JsonResponse({"results": list(autocomplete_dicts(q, limit))})
+
+
+@cache_control(public=True, max_age=86400)
+def geocode_reverse(request):
+    """
+    緯度経度から最寄りの地名を JSON で返す。
+
+    例: /geocode/reverse/?lat=35.0&lon=135.7
+    """
+    try:
+        lat = float(request.GET.get("lat", ""))
+        lon = float(request.GET.get("lon", ""))
+    except ValueError:
+        return JsonResponse({"error": "lat, lon を数値で指定してください。"}, status=400)
+    if not (-90 <= lat <= 90 and -180 <= lon <= 180):
+        return JsonResponse({"error": "lat, lon が範囲外です。"}, status=400)
+    found = nearest_place(round(lat, 4), round(lon, 4))
+    if found is None:
+        return JsonResponse({"result": None})
+    place, km = found
+    return JsonResponse({"result": place.as_dict(), "distance_km": round(km, 1)})